@@ -0,0 +1,135 @@
+import os
+from email.utils import formatdate, parsedate_to_datetime
+
+from flask import request, Response
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+CHUNK_SIZE = 64 * 1024  # 无 sendfile 时每次读取的块大小
+AUDIO_MAX_AGE = int(os.getenv('AUDIO_CACHE_MAX_AGE', 30 * 24 * 60 * 60))  # 音频缓存时间，默认30天
+AUDIO_MIMETYPES = {
+    '.mp3': 'audio/mp3',
+    '.flac': 'audio/flac',
+    '.m4a': 'audio/mp4',
+    '.mp4': 'audio/mp4',
+    '.ogg': 'audio/ogg',
+    '.oga': 'audio/ogg',
+    '.opus': 'audio/ogg',
+}
+
+
+def audio_mimetype(path):
+    """按扩展名返回音频的 MIME 类型，未知格式按 MP3 处理"""
+    return AUDIO_MIMETYPES.get(os.path.splitext(path)[1].lower(), 'audio/mp3')
+
+
+def make_etag(stat):
+    """根据文件的修改时间和大小生成 ETag"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """解析 Range 请求头，返回闭区间 (start, end)；无效的 Range 返回 None（按完整文件处理）"""
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec:
+        # 不支持多段 Range
+        raise RequestedRangeNotSatisfiable(length=size)
+
+    start, sep, end = spec.partition('-')
+    if not sep:
+        return None
+    try:
+        if not start:
+            # bytes=-N 表示最后 N 个字节
+            suffix = int(end)
+            if suffix <= 0:
+                raise RequestedRangeNotSatisfiable(length=size)
+            return max(size - suffix, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RequestedRangeNotSatisfiable(length=size)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _not_modified(etag, mtime):
+    """检查 If-None-Match / If-Modified-Since 条件请求"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_allowed(etag, last_modified):
+    """If-Range 与当前文件不匹配时忽略 Range，返回完整文件"""
+    if_range = request.headers.get('If-Range')
+    return not if_range or if_range.strip() in (etag, last_modified)
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def send_audio(path, mimetype="audio/mp3"):
+    """发送音频文件，支持 Range 分段、条件请求和 sendfile 零拷贝"""
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = make_etag(stat)
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': f'public, max-age={AUDIO_MAX_AGE}',
+    }
+
+    if _not_modified(etag, stat.st_mtime):
+        return Response(status=304, headers=headers)
+
+    byte_range = None
+    if _range_allowed(etag, last_modified):
+        byte_range = parse_range(request.headers.get('Range'), size)
+
+    if byte_range:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        start, end = 0, size - 1
+        status = 200
+    length = end - start + 1
+    headers['Content-Length'] = str(length)
+
+    f = open(path, 'rb')
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper and end == size - 1:
+        # 读到文件末尾的请求交给 WSGI 服务器的 file_wrapper，可使用 sendfile 零拷贝
+        f.seek(start)
+        body = file_wrapper(f, CHUNK_SIZE)
+    else:
+        body = _read_range(f, start, length)
+
+    return Response(body, status=status, mimetype=mimetype, headers=headers, direct_passthrough=True)
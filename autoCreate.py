@@ -1,127 +1,46 @@
+import argparse
 import os
-from database import get_db_connection
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, ID3NoHeaderError, TPE1, TIT2, TCON, TALB, TDRC, TRCK, TPOS, TCOM, COMM, USLT
 from datetime import datetime
 
-# 连接数据库 - 获取连接池
-db_pool = get_db_connection()
-
-# 从连接池获取一个连接
-db_connection = db_pool.get_connection()
-
-# 使用连接创建游标
-cursor = db_connection.cursor()
-
-
-def convert_id3_timestamp(year_tag):
-    try:
-        timestamp_str = year_tag.text[0]
-        # 处理不同格式的时间戳（YYYY、YYYY-MM-DD等）
-        return int(timestamp_str.split('-')[0]) if timestamp_str else None
-    except (TypeError, IndexError, AttributeError):
-        return None
+from database import get_db_connection
+from ingest import (SONG_INSERT, song_row, DimensionCache, dimension_item, iter_audio_files, batch_ingest,
+                    sync_library, ensure_schema)
+from invalidation import invalidation_bus
+from sidecar import SidecarBuilder
+from tags import read_song_tags
+from watcher import LibraryWatcher
 
 
-def parse_number(value):
-    """解析分轨格式（如"1/2"）并返回第一个数字"""
-    try:
-        return int(value.split('/')[0].strip()) if value else None
-    except (ValueError, AttributeError):
-        return None
-
-
-def add_song_to_database(file_path):
-    audio = MP3(file_path, ID3=ID3)
-    id3v2 = audio.tags if audio.tags else None
-
-    # 基础信息
-    artist = id3v2.get("TPE1").text[0] if id3v2 and id3v2.get("TPE1") else "Unknown Artist"
-    title = id3v2.get("TIT2").text[0] if id3v2 and id3v2.get("TIT2") else os.path.basename(file_path).replace(".mp3",
-                                                                                                              "")
-    genre = id3v2.get("TCON").text[0] if id3v2 and id3v2.get("TCON") else "Unknown Genre"
-    duration = int(audio.info.length)
-    album = id3v2.get("TALB").text[0] if id3v2 and id3v2.get("TALB") else "Unknown Album"
-    album_artist = id3v2.get("TPE2").text[0] if id3v2 and id3v2.get("TPE2") else artist
-
-    # 年份处理
-    year_tag = id3v2.get("TDRC") or id3v2.get("TYER")
-    year = convert_id3_timestamp(year_tag)
-    release_date = f"{year}-01-01" if year else None
-
-    # 轨道号和碟号
-    track_value = id3v2.get("TRCK").text[0] if id3v2 and id3v2.get("TRCK") else None
-    track_number = parse_number(track_value)
-
-    disc_value = id3v2.get("TPOS").text[0] if id3v2 and id3v2.get("TPOS") else None
-    disc_number = parse_number(disc_value)
-
-    # 创作信息
-    composer = id3v2.get("TCOM").text[0] if id3v2 and id3v2.get("TCOM") else None
-    lyricist = id3v2.get("TEXT").text[0] if id3v2 and id3v2.get("TEXT") else None
-    if lyricist and len(lyricist) > 100:
-        lyricist = lyricist[:100]
-
-    # 评论（优先获取英文评论）
-    comments = None
-    if id3v2:
-        comm_frame = id3v2.get("COMM::eng") or id3v2.get("COMM")
-        if comm_frame:
-            comments = comm_frame.text[0] if isinstance(comm_frame.text, list) else comm_frame.text
-
-    # 歌词处理
-    lyrics = None
-    if id3v2:
-        uslt_frame = next((frame for frame in id3v2.getall("USLT") if frame), None)
-        if uslt_frame:
-            lyrics = uslt_frame.text if isinstance(uslt_frame.text, str) else uslt_frame.text[0]
-
-    # 音频技术信息
-    channels = audio.info.channels if hasattr(audio.info, "channels") else None
+def add_song_to_database(cursor, file_path, dimensions):
+    tags = read_song_tags(file_path)
+    title = tags['title']
 
     # 用户输入信息
     cover_image_path = input(f"请输入歌曲 {title} 的封面图片路径：")
     language = input(f"请输入歌曲 {title} 的语言（直接回车使用默认语言 '国语'）：") or "国语"
 
     # 数据库操作
-    cursor.execute("SELECT ArtistID FROM artists WHERE Name = %s", (artist,))
-    result = cursor.fetchone()
-    artist_id = result[0] if result else None
-    if not artist_id:
-        cursor.execute("INSERT INTO artists (Name) VALUES (%s)", (artist,))
-        artist_id = cursor.lastrowid
-
-    cursor.execute("SELECT AlbumID FROM albums WHERE Title = %s", (album,))
-    result = cursor.fetchone()
-    album_id = result[0] if result else None
-    if not album_id:
-        cursor.execute("INSERT INTO albums (Title, ArtistID) VALUES (%s, %s)", (album, artist_id))
-        album_id = cursor.lastrowid
-
-    current_time = datetime.now()
+    [(artist_id, album_id)] = dimensions.resolve(cursor, [dimension_item(tags)])
 
     # 插入歌曲信息
-    cursor.execute("""
-                   INSERT INTO songs
-                   (Title, ArtistID, AlbumID, Genre, Duration, ReleaseDate, FilePath, CoverImagePath,
-                    Lyrics, Language, PlayCount, CreateTime, UpdateTime, AlbumArtist, Year,
-                    TrackNumber, DiscNumber, Composer, Lyricist, Comments, Channels)
-                   VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                           %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                   """, (
-                       title, artist_id, album_id, genre, duration, release_date, file_path, cover_image_path,
-                       lyrics, language, 0, current_time, current_time, album_artist, year,
-                       track_number, disc_number, composer, lyricist, comments, channels
-                   ))
+    cursor.execute(SONG_INSERT, song_row(tags, artist_id, album_id, cover_image_path, language, datetime.now()))
 
 
 def scan_folder(folder_path):
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(".mp3"):
-                add_song_to_database(os.path.join(root, file))
-    # 所有操作完成后统一提交事务
-    db_connection.commit()
+    # 连接数据库 - 从共享连接池获取一个连接
+    db_connection = get_db_connection().get_connection()
+    cursor = db_connection.cursor()
+    dimensions = DimensionCache()  # 预加载已有艺术家和专辑，避免每首歌查询一次
+    try:
+        for file_path in iter_audio_files(folder_path):
+            add_song_to_database(cursor, file_path, dimensions)
+        # 所有操作完成后统一提交事务
+        db_connection.commit()
+        dimensions.commit(cursor)
+    finally:
+        # 关闭数据库连接
+        cursor.close()
+        db_connection.close()
 
 
 def get_folder_path():
@@ -134,10 +53,35 @@ def get_folder_path():
     return folder_path
 
 
-# 获取用户输入的文件夹路径
-folder_path = get_folder_path()
-scan_folder(folder_path)
-
-# 关闭数据库连接
-cursor.close()
-db_connection.close()
+def main():
+    parser = argparse.ArgumentParser(description="导入音乐文件到数据库")
+    parser.add_argument('folder', nargs='?', help="音乐文件夹，不传时交互输入")
+    parser.add_argument('--batch', action='store_true', help="非交互批量导入（多进程解析、批量写入、断点续传）")
+    parser.add_argument('--sync', action='store_true', help="增量同步：只导入新增或变化的文件，识别移动和删除的文件")
+    parser.add_argument('--watch', action='store_true', help="常驻监听目录，新文件写入完成后自动入库")
+    parser.add_argument('--config', help="批量导入的默认配置 JSON，例如 {\"cover\": \"...\", \"language\": \"国语\"}")
+    parser.add_argument('--workers', type=int, help="解析标签的进程数，默认为 CPU 核数")
+    parser.add_argument('--batch-size', type=int, default=500, help="每批插入并提交的歌曲数")
+    parser.add_argument('--no-sidecar', action='store_true', help="不生成时长、波形、歌词时间轴等元数据副本")
+    args = parser.parse_args()
+
+    # 获取用户输入的文件夹路径
+    folder_path = args.folder or get_folder_path()
+    ensure_schema()  # 旧库先补齐 songs 表缺少的列和索引
+    sidecars = None if args.no_sidecar else SidecarBuilder(workers=args.workers or os.cpu_count())
+    invalidations = invalidation_bus()  # 通知正在运行的后端进程清理缓存
+    if args.watch:
+        LibraryWatcher(folder_path, config_path=args.config, sidecars=sidecars, invalidations=invalidations).run()
+    elif args.sync:
+        sync_library(folder_path, config_path=args.config, workers=args.workers, batch_size=args.batch_size,
+                     sidecars=sidecars, invalidations=invalidations)
+    elif args.batch:
+        written, errors = batch_ingest(folder_path, config_path=args.config, workers=args.workers,
+                                       batch_size=args.batch_size, sidecars=sidecars, invalidations=invalidations)
+        print(f"导入完成：{written} 首歌曲，{errors} 个文件解析失败")
+    else:
+        scan_folder(folder_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from database import get_db_connection
+from versions import build_lock, current_version, new_version, publish
+
+CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'catalog')
+CHECK_INTERVAL = 60  # 检查曲库是否变化的间隔（秒）
+MAX_AGE = 60 * 60  # 即使没有检测到变化也重建的间隔（秒），用来带上不改 UpdateTime 的修改
+
+NULL_TIME = np.iinfo(np.int64).min
+EPOCH = datetime(1970, 1, 1)
+
+# 每张表的列：(列名, 类型)，str 列存为 UTF-8 拼接的字节和偏移量，date 存为序数，datetime 存为秒数
+TABLES = {
+    'songs': ("SELECT SongID, Title, ArtistID, AlbumID, Genre, Duration, ReleaseDate, FilePath, Lyrics, Language, "
+              "PlayCount, CreateTime, UpdateTime FROM songs ORDER BY SongID",
+              (('id', 'int'), ('title', 'str'), ('artist_id', 'int'), ('album_id', 'int'), ('genre', 'str'),
+               ('duration', 'int'), ('release_date', 'date'), ('file_path', 'str'), ('lyrics', 'str'),
+               ('language', 'str'), ('play_count', 'int'), ('create_time', 'datetime'),
+               ('update_time', 'datetime'))),
+    'artists': ("SELECT ArtistID, Name FROM artists ORDER BY ArtistID",
+                (('id', 'int'), ('name', 'str'))),
+    'albums': ("SELECT AlbumID, Title, ArtistID FROM albums ORDER BY AlbumID",
+               (('id', 'int'), ('title', 'str'), ('artist_id', 'int'))),
+}
+# 表的数据版本：行数、最大ID、最后修改时间，都没变时不重建
+SIGNATURE_QUERY = "SELECT COUNT(*), MAX({id}), MAX(UpdateTime) FROM {table}"
+TABLE_IDS = {'songs': 'SongID', 'artists': 'ArtistID', 'albums': 'AlbumID'}
+# 播放次数每次播放都会变、也不改 UpdateTime，快照里的值只是构建时的值；song_info 按主键读最新值
+PLAY_COUNT_QUERY = "SELECT PlayCount FROM songs WHERE SongID = %s"
+
+
+def _write_column(path, name, kind, values):
+    """把一列写成 .npy 文件；可为空的整数列额外写一个空值标记"""
+    if kind == 'str':
+        encoded = [value.encode('utf-8') if value is not None else b'' for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        with open(os.path.join(path, name + '.bin'), 'wb') as f:
+            for value in encoded:
+                f.write(value)
+        np.save(os.path.join(path, name + '.off.npy'), offsets)
+        np.save(os.path.join(path, name + '.null.npy'), np.array([value is None for value in values], dtype=bool))
+    elif kind == 'int':
+        np.save(os.path.join(path, name + '.npy'), np.array([value or 0 for value in values], dtype=np.int64))
+        np.save(os.path.join(path, name + '.null.npy'), np.array([value is None for value in values], dtype=bool))
+    elif kind == 'date':
+        np.save(os.path.join(path, name + '.npy'),
+                np.array([value.toordinal() if value else 0 for value in values], dtype=np.int32))
+    else:
+        np.save(os.path.join(path, name + '.npy'),
+                np.array([int((value - EPOCH).total_seconds()) if value else NULL_TIME for value in values],
+                         dtype=np.int64))
+
+
+class _Column:
+    """内存映射打开的一列，各进程通过页缓存共享同一份数据"""
+
+    def __init__(self, path, name, kind):
+        self.kind = kind
+        self.nulls = None
+        if kind == 'str':
+            self.offsets = np.load(os.path.join(path, name + '.off.npy'), mmap_mode='r')
+            size = os.path.getsize(os.path.join(path, name + '.bin'))
+            # 空文件不能映射
+            self.data = np.memmap(os.path.join(path, name + '.bin'), dtype=np.uint8, mode='r') if size else b''
+        else:
+            self.values = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+        if kind in ('str', 'int'):
+            self.nulls = np.load(os.path.join(path, name + '.null.npy'), mmap_mode='r')
+
+    def __getitem__(self, i):
+        if self.nulls is not None and self.nulls[i]:
+            return None
+        if self.kind == 'str':
+            return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+        value = int(self.values[i])
+        if self.kind == 'date':
+            return date.fromordinal(value) if value else None
+        if self.kind == 'datetime':
+            return EPOCH + timedelta(seconds=value) if value != NULL_TIME else None
+        return value
+
+
+class _Table:
+    def __init__(self, path, table):
+        self.columns = {name: _Column(os.path.join(path, table), name, kind) for name, kind in TABLES[table][1]}
+        self.ids = self.columns['id'].values
+
+    def __len__(self):
+        return len(self.ids)
+
+    def offset(self, target_id):
+        """ID -> 行号，二分查找，不存在时返回 None"""
+        i = int(np.searchsorted(self.ids, target_id))
+        return i if i < len(self.ids) and self.ids[i] == target_id else None
+
+
+class CatalogSnapshot:
+    """只读曲库快照：歌曲、歌手、专辑按列存储并按ID排序，另有按歌手和专辑分组的歌曲行号索引"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.signature = meta['signature']
+        self.built = meta['built']
+        self.songs = _Table(path, 'songs')
+        self.artists = _Table(path, 'artists')
+        self.albums = _Table(path, 'albums')
+        # 每首歌所属歌手的行号（-1 表示歌手不存在），以及按 (歌手ID, 歌曲ID)、(专辑ID, 歌曲ID) 排序的歌曲行号
+        self.song_artist_offsets = np.load(os.path.join(path, 'song_artist_offsets.npy'), mmap_mode='r')
+        self.artist_order = np.load(os.path.join(path, 'artist_order.npy'), mmap_mode='r')
+        self.artist_keys = np.load(os.path.join(path, 'artist_keys.npy'), mmap_mode='r')
+        self.album_order = np.load(os.path.join(path, 'album_order.npy'), mmap_mode='r')
+        self.album_keys = np.load(os.path.join(path, 'album_keys.npy'), mmap_mode='r')
+
+    def song_info(self, song_id):
+        """与 /music_info 的字段一致，歌曲不在快照中时返回 None"""
+        i = self.songs.offset(song_id)
+        if i is None:
+            return None
+        columns = self.songs.columns
+        return {"id": song_id, "title": columns['title'][i], "artist": columns['artist_id'][i],
+                "album": columns['album_id'][i], "genre": columns['genre'][i], "duration": columns['duration'][i],
+                "releaseDate": columns['release_date'][i], "filePath": columns['file_path'][i],
+                "lyrics": columns['lyrics'][i], "language": columns['language'][i],
+                "playCount": columns['play_count'][i], "createTime": columns['create_time'][i],
+                "updateTime": columns['update_time'][i]}
+
+    def _song_row(self, i):
+        """(SongID, Title, 歌手名)，与 JOIN artists 的查询结果相同；歌手不存在时返回 None"""
+        artist = int(self.song_artist_offsets[i])
+        if artist < 0:
+            return None
+        return int(self.songs.ids[i]), self.songs.columns['title'][i], self.artists.columns['name'][artist]
+
+    def songs_by_ids(self, song_ids):
+        """返回 ({歌曲ID: 行}, 快照中没有的歌曲ID)"""
+        rows = {}
+        missing = []
+        for song_id in song_ids:
+            i = self.songs.offset(song_id)
+            if i is None:
+                missing.append(song_id)
+                continue
+            row = self._song_row(i)
+            if row:
+                rows[song_id] = row
+        return rows, missing
+
+    def _grouped(self, keys, order, key):
+        start = int(np.searchsorted(keys, key, 'left'))
+        end = int(np.searchsorted(keys, key, 'right'))
+        return [row for row in (self._song_row(int(i)) for i in order[start:end]) if row]
+
+    def artist_songs(self, artist_id):
+        """歌手的歌曲，歌手不在快照中时返回 None"""
+        if self.artists.offset(artist_id) is None:
+            return None
+        return self._grouped(self.artist_keys, self.artist_order, artist_id)
+
+    def album_songs(self, album_id):
+        """专辑的歌曲，专辑不在快照中时返回 None"""
+        if self.albums.offset(album_id) is None:
+            return None
+        return self._grouped(self.album_keys, self.album_order, album_id)
+
+    def stats(self):
+        return {'version': os.path.basename(self.path), 'built': self.built, 'songs': len(self.songs),
+                'artists': len(self.artists), 'albums': len(self.albums)}
+
+
+def _signature(cursor):
+    signature = {}
+    for table, id_column in TABLE_IDS.items():
+        cursor.execute(SIGNATURE_QUERY.format(id=id_column, table=table))
+        count, max_id, updated = cursor.fetchone()
+        signature[table] = [count, max_id, str(updated) if updated else None]
+    return signature
+
+
+def build(root=CATALOG_DIR, force=False):
+    """曲库有变化（或快照已超过 MAX_AGE）时生成新快照并切换，返回新版本目录；没有变化时返回 None"""
+    current = current_version(root)
+    meta = None
+    if current:
+        try:
+            with open(os.path.join(current, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            signature = _signature(cursor)
+            if (not force and meta and meta['signature'] == signature
+                    and time.time() - meta['built'] < MAX_AGE):
+                return None
+            os.makedirs(root, exist_ok=True)
+            path = new_version(root)
+            try:
+                ids = {}
+                for table, (query, columns) in TABLES.items():
+                    cursor.execute(query)
+                    rows = cursor.fetchall()
+                    os.makedirs(os.path.join(path, table))
+                    for index, (name, kind) in enumerate(columns):
+                        _write_column(os.path.join(path, table), name, kind, [row[index] for row in rows])
+                    ids[table] = np.array([row[0] for row in rows], dtype=np.int64)
+                    if table == 'songs':
+                        song_artists = np.array([row[2] or 0 for row in rows], dtype=np.int64)
+                        song_albums = np.array([row[3] or 0 for row in rows], dtype=np.int64)
+            except Exception:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+        finally:
+            cursor.close()
+
+    try:
+        artist_ids = ids['artists']
+        positions = np.searchsorted(artist_ids, song_artists)
+        found = np.zeros(len(song_artists), dtype=bool)
+        inside = positions < len(artist_ids)
+        found[inside] = artist_ids[positions[inside]] == song_artists[inside]
+        np.save(os.path.join(path, 'song_artist_offsets.npy'), np.where(found, positions, -1).astype(np.int32))
+        # 歌曲已按ID排序，稳定排序后同一歌手/专辑内仍按歌曲ID排列
+        for name, keys in (('artist', song_artists), ('album', song_albums)):
+            order = np.argsort(keys, kind='stable').astype(np.int32)
+            np.save(os.path.join(path, f'{name}_order.npy'), order)
+            np.save(os.path.join(path, f'{name}_keys.npy'), keys[order])
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'signature': signature, 'built': time.time()}, f)
+        publish(root, path)
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return path
+
+
+class Catalog:
+    """定期检查曲库变化并重建快照；多个进程共用目录时只有一个进程构建，其余进程只重新打开"""
+
+    def __init__(self, root=CATALOG_DIR, interval=CHECK_INTERVAL, build=True, on_build=None):
+        self.root = root
+        self.interval = interval
+        self.build_enabled = build
+        self.on_build = on_build  # on_build(新版本目录)，例如通知各进程清理由快照生成的缓存
+        self.snapshot = None
+        self._current = None  # CURRENT 文件的 (inode, 修改时间)，变化时才重新读取
+        self._thread = None
+        self._stats = {'builds': 0, 'failures': 0, 'last_duration': None, 'hits': 0, 'fallbacks': 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='catalog', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.reload()
+                if self.build_enabled:
+                    self.build()
+            except Exception as e:
+                self._stats['failures'] += 1
+                print('生成曲库快照失败:', e)
+            time.sleep(self.interval)
+
+    def build(self, force=False):
+        with build_lock(self.root) as locked:
+            if not locked:
+                return None
+            started = time.monotonic()
+            path = build(self.root, force)
+            if path:
+                self._stats['builds'] += 1
+                self._stats['last_duration'] = round(time.monotonic() - started, 3)
+        self.reload()
+        if path and self.on_build:
+            self.on_build(path)
+        return path
+
+    def reload(self):
+        """CURRENT 指向新版本时重新打开；每次查询前调用，没有变化时只有一次 stat"""
+        try:
+            st = os.stat(os.path.join(self.root, 'CURRENT'))
+        except FileNotFoundError:
+            return self.snapshot
+        if (st.st_ino, st.st_mtime_ns) != self._current:
+            path = current_version(self.root)
+            if self.snapshot is None or self.snapshot.path != path:
+                self.snapshot = CatalogSnapshot(path)
+            self._current = (st.st_ino, st.st_mtime_ns)
+        return self.snapshot
+
+    def _lookup(self, method, *args):
+        """在快照中查询，快照还没生成或ID比快照新时返回 None，由调用方查数据库"""
+        snapshot = self.reload()
+        result = getattr(snapshot, method)(*args) if snapshot else None
+        self._stats['hits' if result is not None else 'fallbacks'] += 1
+        return result
+
+    def song_info(self, song_id):
+        info = self._lookup('song_info', song_id)
+        if info is None:
+            return None
+        try:
+            with get_db_connection().get_connection() as db:
+                cursor = db.cursor()
+                try:
+                    cursor.execute(PLAY_COUNT_QUERY, (song_id,))
+                    row = cursor.fetchone()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print('读取播放次数失败，使用快照中的值:', e)
+            return info
+        if row is None:
+            return None  # 快照生成后歌曲已删除，由调用方查数据库
+        info['playCount'] = row[0]
+        return info
+
+    def artist_songs(self, artist_id):
+        return self._lookup('artist_songs', artist_id)
+
+    def album_songs(self, album_id):
+        return self._lookup('album_songs', album_id)
+
+    def songs_by_ids(self, song_ids):
+        """返回 ({歌曲ID: 行}, 需要查数据库的歌曲ID)"""
+        snapshot = self.reload()
+        if snapshot is None:
+            self._stats['fallbacks'] += 1
+            return {}, list(song_ids)
+        rows, missing = snapshot.songs_by_ids(song_ids)
+        self._stats['fallbacks' if missing else 'hits'] += 1
+        return rows, missing
+
+    def stats(self):
+        snapshot = self.snapshot
+        return dict(self._stats, **(snapshot.stats() if snapshot else {}))
+
+
+if __name__ == '__main__':
+    print('曲库快照已写入', build(force=True))
@@ -0,0 +1,119 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, features
+
+COVER_SIZES = (64, 256, 1024)  # 预定义的封面尺寸（像素）
+HASH_CACHE_SIZE = 4096  # 内存中记住的原图内容哈希和生成失败的版本数
+QUALITY = {'avif': 60, 'webp': 80, 'jpeg': 85}
+MIMETYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+# 从音频文件提取的原图按原格式保存，不再统一转成 PNG；尺寸版本由 CoverRenditions 从原图生成
+SOURCE_EXTENSIONS = {'image/jpeg': 'jpg', 'image/jpg': 'jpg', 'image/png': 'png', 'image/webp': 'webp',
+                     'image/gif': 'gif'}
+SOURCE_MIMETYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp', 'gif': 'image/gif'}
+
+
+def source_mimetype(path):
+    """原图的 MIME 类型，按扩展名判断"""
+    return SOURCE_MIMETYPES.get(path.rsplit('.', 1)[-1].lower(), 'image/png')
+
+
+def pick_size(size):
+    """取不小于请求尺寸的最小预定义尺寸，超过最大尺寸时取最大尺寸"""
+    for candidate in COVER_SIZES:
+        if size <= candidate:
+            return candidate
+    return COVER_SIZES[-1]
+
+
+class CoverRenditions:
+    """封面多尺寸版本：按原图内容哈希命名，WebP/AVIF 按 Accept 协商，JPEG 兜底；
+    在后台线程池中生成，生成好之前由调用方返回原图"""
+
+    def __init__(self, root, workers=2):
+        self.root = root
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cover')
+        self._lock = threading.Lock()
+        self._pending = {}  # 文件名 -> Future
+        self._hashes = OrderedDict()  # (原图路径, mtime, 大小) -> 内容哈希，LRU
+        self._failed = OrderedDict()  # 生成失败的版本文件名（原图损坏或格式不支持），不再重试
+        self.formats = [fmt for fmt in ('avif', 'webp') if features.check(fmt)]
+
+    def negotiate(self, accept):
+        """按 Accept 请求头选择输出格式"""
+        accept = accept or ''
+        for fmt in self.formats:
+            if MIMETYPES[fmt] in accept:
+                return fmt
+        return 'jpeg'
+
+    def _content_hash(self, source_path):
+        st = os.stat(source_path)
+        key = (source_path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            content_hash = self._hashes.get(key)
+            if content_hash is not None:
+                self._hashes.move_to_end(key)
+                return content_hash
+        with open(source_path, 'rb') as f:
+            content_hash = hashlib.sha1(f.read()).hexdigest()[:16]
+        with self._lock:
+            _remember(self._hashes, key, content_hash)
+        return content_hash
+
+    def rendition_name(self, source_path, size, fmt):
+        return f'{self._content_hash(source_path)}_{size}.{EXTENSIONS[fmt]}'
+
+    def path(self, name):
+        return os.path.join(self.root, name[:2], name)
+
+    def render(self, source_path, size, fmt):
+        """返回 (版本文件名, 文件路径)；还没生成时提交后台生成并返回 None，由调用方先返回原图"""
+        size = pick_size(size)
+        try:
+            name = self.rendition_name(source_path, size, fmt)
+        except OSError as e:
+            print('读取封面失败:', e)
+            return None
+        path = self.path(name)
+        if os.path.exists(path):
+            return name, path
+
+        with self._lock:
+            if name not in self._pending and name not in self._failed:
+                self._pending[name] = self._executor.submit(self._generate, source_path, path, size, fmt, name)
+        return None
+
+    def _generate(self, source_path, path, size, fmt, name):
+        try:
+            with Image.open(source_path) as img:
+                img = img.convert('RGB')
+                img.thumbnail((size, size), Image.LANCZOS)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        img.save(f, format=fmt.upper(), quality=QUALITY[fmt])
+                    os.replace(tmp_path, path)
+                except Exception:
+                    os.remove(tmp_path)
+                    raise
+        except Exception as e:
+            print(f'生成封面 {name} 失败:', e)
+            with self._lock:
+                _remember(self._failed, name, True)
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+
+def _remember(entries, key, value):
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > HASH_CACHE_SIZE:
+        entries.popitem(last=False)
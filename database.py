@@ -1,10 +1,18 @@
+import threading
+import time
+
 import mysql.connector
 import mysql.connector.pooling
+from mysql.connector import errors
 from dotenv import load_dotenv
 import os
 
+# 进程级共享连接池（懒加载，首次使用时创建）
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
 
-def get_db_connection(pool_name="mypool", pool_size=5):
+
+def load_db_config():
     # 加载 .env 文件
     load_dotenv()
 
@@ -32,7 +40,7 @@ def get_db_connection(pool_name="mypool", pool_size=5):
     except (TypeError, ValueError) as e:
         raise ValueError(f"Invalid DATABASE_PORT: {db_port}. Must be a valid integer.") from e
 
-    db_config = {
+    return {
         'host': db_host,
         'port': port,
         'user': db_user,
@@ -40,20 +48,233 @@ def get_db_connection(pool_name="mypool", pool_size=5):
         'database': db_name
     }
 
-    # 创建连接池
-    try:
-        db_pool = mysql.connector.pooling.MySQLConnectionPool(
-            pool_name=pool_name,
-            pool_size=pool_size,
-            host=db_config['host'],
-            port=db_config['port'],
-            user=db_config['user'],
-            password=db_config['password'],
-            database=db_config['database']
-        )
-        return db_pool
-    except mysql.connector.Error as err:
-        raise mysql.connector.Error(f"Failed to create connection pool: {err}") from err
+
+def load_pool_config(pool_size=5):
+    """读取连接池参数，未配置时使用默认值"""
+    return {
+        # mysql-connector 限制单个连接池最多 32 个连接
+        'pool_size': min(int(os.getenv('DATABASE_POOL_SIZE', pool_size)), mysql.connector.pooling.CNX_POOL_MAXSIZE),
+        # 连接池耗尽时最长等待时间（秒）
+        'wait_timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+        # 连接最长存活时间（秒），超过后在借出时重建
+        'max_lifetime': float(os.getenv('DATABASE_POOL_MAX_LIFETIME', 1800)),
+        # 空闲超过该时间（秒）的连接在借出时先 ping 校验
+        'validate_idle': float(os.getenv('DATABASE_POOL_VALIDATE_IDLE', 30)),
+    }
+
+
+class PooledConnection:
+    """借出的连接包装，close() 时归还连接池并记录统计"""
+
+    def __init__(self, pool, cnx):
+        self._pool = pool
+        self._cnx = cnx
+        self._borrowed_at = time.monotonic()
+
+    def __getattr__(self, item):
+        return getattr(self._cnx, item)
+
+    def close(self):
+        if self._cnx is not None:
+            cnx, self._cnx = self._cnx, None
+            self._pool.release(cnx, time.monotonic() - self._borrowed_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SharedConnectionPool:
+    """进程级共享连接池：借出校验、最长存活时间回收、等待统计"""
+
+    def __init__(self, db_config, pool_name="mypool", pool_size=5, wait_timeout=10.0, max_lifetime=1800.0,
+                 validate_idle=30.0):
+        self.db_config = db_config
+        self.pool_name = pool_name
+        self.wait_timeout = wait_timeout
+        self.max_lifetime = max_lifetime
+        self.validate_idle = validate_idle
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        # 记录每个底层连接的创建时间和最后归还时间
+        self._created_at = {}
+        self._released_at = {}
+        self._releases = 0  # 归还次数，借用方据此判断等待期间是否有连接归还
+        self._stats = {'borrowed': 0, 'in_use': 0, 'peak_in_use': 0, 'waits': 0, 'wait_time': 0.0,
+                       'max_wait': 0.0, 'timeouts': 0, 'recycled': 0, 'validation_failures': 0,
+                       'hold_time': 0.0}
+        self._pool = self._create_pool(pool_size)
+
+    def _create_pool(self, pool_size):
+        try:
+            return mysql.connector.pooling.MySQLConnectionPool(pool_name=self.pool_name, pool_size=pool_size,
+                                                               pool_reset_session=True, **self.db_config)
+        except mysql.connector.Error as err:
+            raise mysql.connector.Error(f"Failed to create connection pool: {err}") from err
+
+    @property
+    def pool_size(self):
+        return self._pool.pool_size
+
+    def resize(self, pool_size):
+        """按新的大小重建连接池，已借出的连接归还时会被丢弃"""
+        pool_size = min(int(pool_size), mysql.connector.pooling.CNX_POOL_MAXSIZE)
+        with self._lock:
+            if pool_size == self._pool.pool_size:
+                return
+            old_pool, self._pool = self._pool, self._create_pool(pool_size)
+            self._available.notify_all()
+        old_pool._remove_connections()
+
+    def get_connection(self):
+        """从连接池借出一个连接，连接池耗尽时等待，超过 wait_timeout 抛出 PoolError"""
+        start = time.monotonic()
+        waited = False
+        while True:
+            with self._lock:
+                pool, releases = self._pool, self._releases
+            # 底层连接池借出时会 ping 甚至重连，不能占着锁，否则一次慢的往返会挡住所有借用方
+            try:
+                pooled = pool.get_connection()
+                break
+            except errors.PoolError:
+                with self._lock:
+                    remaining = self.wait_timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise
+                    waited = True
+                    # 尝试期间已有连接归还时直接重试，避免错过通知
+                    if releases == self._releases and pool is self._pool:
+                        self._available.wait(min(remaining, 0.5))
+
+        with self._lock:
+            wait_time = time.monotonic() - start
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += wait_time
+                self._stats['max_wait'] = max(self._stats['max_wait'], wait_time)
+            self._stats['borrowed'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+
+        try:
+            self._prepare(pooled)
+        except Exception:
+            self.release(pooled, 0.0)
+            raise
+        return PooledConnection(self, pooled)
+
+    def _prepare(self, pooled):
+        """借出前检查连接：超过最长存活时间则重连，空闲过久则 ping 校验"""
+        cnx = pooled._cnx
+        now = time.monotonic()
+        key = id(cnx)
+        with self._lock:
+            created_at = self._created_at.setdefault(key, now)
+            released_at = self._released_at.get(key, created_at)
+
+        if self.max_lifetime and now - created_at > self.max_lifetime:
+            cnx.reconnect(attempts=1)
+            with self._lock:
+                self._created_at[key] = now
+                self._stats['recycled'] += 1
+            return
+
+        if now - released_at > self.validate_idle:
+            try:
+                cnx.ping(reconnect=False)
+            except mysql.connector.Error:
+                with self._lock:
+                    self._stats['validation_failures'] += 1
+                cnx.reconnect(attempts=3, delay=0.2)
+                with self._lock:
+                    self._created_at[key] = time.monotonic()
+
+    def release(self, pooled, hold_time):
+        cnx = pooled._cnx
+        key = id(cnx)
+        if pooled._cnx_pool is not self._pool:
+            # 连接池已被 resize 重建，旧池的连接直接断开
+            cnx.disconnect()
+            pooled._cnx = None
+            with self._lock:
+                self._created_at.pop(key, None)
+            self._on_released(None, hold_time)
+            return
+        # 不走 PooledMySQLConnection.close()：它在重置会话失败时也会把连接放回队列
+        try:
+            if self._pool.reset_session:
+                cnx.reset_session()
+        except mysql.connector.Error as err:
+            # 重置会话失败，断开后重连，换成新会话再放回连接池，避免坏连接被再次借出
+            print('重置数据库会话失败，重建连接:', err)
+            cnx.disconnect()
+            with self._lock:
+                self._created_at.pop(key, None)
+            try:
+                cnx.reconnect(attempts=1)
+            except mysql.connector.Error as err:
+                # 仍然放回连接池保持容量，下次借出时连接池会在连接断开的情况下重连
+                print('重建数据库连接失败:', err)
+            key = None
+        pooled._cnx = None
+        try:
+            self._pool.add_connection(cnx)
+        finally:
+            self._on_released(key, hold_time)
+
+    def _on_released(self, key, hold_time):
+        with self._lock:
+            if key is not None:
+                self._released_at[key] = time.monotonic()
+            self._stats['in_use'] -= 1
+            self._stats['hold_time'] += hold_time
+            self._releases += 1
+            self._available.notify()
+
+    def stats(self):
+        """返回连接池使用和等待统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pool_size'] = self._pool.pool_size
+        stats['idle'] = self._pool._cnx_queue.qsize()
+        stats['avg_wait_ms'] = round(stats['wait_time'] / stats['waits'] * 1000, 2) if stats['waits'] else 0.0
+        stats['avg_hold_ms'] = round(stats['hold_time'] / stats['borrowed'] * 1000, 2) if stats['borrowed'] else 0.0
+        return stats
+
+
+def get_db_connection(pool_name="mypool", pool_size=5):
+    """返回进程级共享连接池，首次调用时才读取配置并创建"""
+    global _shared_pool
+    if _shared_pool is None:
+        with _shared_pool_lock:
+            if _shared_pool is None:
+                _shared_pool = SharedConnectionPool(load_db_config(), pool_name=pool_name,
+                                                    **load_pool_config(pool_size))
+    return _shared_pool
+
+
+def column_exists(cursor, table, column):
+    """当前库的 table 是否已有 column，启动时据此补齐旧库缺少的列"""
+    cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    return bool(cursor.fetchone()[0])
+
+
+def index_columns(cursor, table, index):
+    """索引包含的列（按索引中的顺序），索引不存在时返回空列表"""
+    cursor.execute("SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s "
+                   "ORDER BY SEQ_IN_INDEX", (table, index))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def pool_stats():
+    """连接池尚未创建时返回 None"""
+    return _shared_pool.stats() if _shared_pool is not None else None
 
 
 def test_database_connection():
@@ -84,4 +305,4 @@ def test_database_connection():
 
 
 if __name__ == '__main__':
-    test_database_connection()
\ No newline at end of file
+    test_database_connection()
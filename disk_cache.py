@@ -0,0 +1,255 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MAINTENANCE_INTERVAL = 10 * 60  # 后台清理过期条目、校正磁盘占用的间隔（秒）
+TOUCH_INTERVAL = 60  # 命中的条目至多每隔这么久刷新一次文件修改时间，多个进程按修改时间共享 LRU 顺序
+
+
+class DiskCache:
+    """有容量上限的磁盘缓存：键哈希后分片存储，TTL 过期，超出容量按 LRU 淘汰，前面有一层内存热缓存。
+    多个进程共用同一目录时，容量按磁盘上的实际占用在文件锁内统一淘汰"""
+
+    def __init__(self, root, ttl, max_bytes=256 * 1024 * 1024, memory_items=1024, stale_ttl=None):
+        self.root = root
+        self.ttl = ttl
+        # 过期超过 stale_ttl 的条目在读取或清理时删除
+        self.stale_ttl = ttl if stale_ttl is None else stale_ttl
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # 哈希 -> (过期时间, 值)
+        self._index = None  # 哈希 -> 文件大小，按最近访问排序，首次使用时扫描磁盘建立
+        self._bytes = 0
+        self._unscanned = 0  # 上次扫描磁盘之后本进程写入的字节数
+        self._touched = {}  # 哈希 -> 上次刷新修改时间的时间
+        self._thread = None
+        self._stats = {'hits': 0, 'memory_hits': 0, 'misses': 0, 'expired': 0, 'writes': 0, 'evictions': 0,
+                       'compactions': 0}
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _path(self, h):
+        return os.path.join(self.root, h[:2], f'{h}.json')
+
+    def _load_index(self):
+        self._index, self._bytes = self._scan()
+
+    def _scan(self):
+        """扫描缓存目录，按修改时间建立 LRU 索引，返回 (索引, 总字节数)"""
+        entries = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.json'):
+                        try:
+                            st = entry.stat()
+                        except FileNotFoundError:  # 其他进程刚刚删除
+                            continue
+                        entries.append((st.st_mtime, entry.name[:-5], st.st_size))
+        entries.sort()
+        return OrderedDict((h, size) for _, h, size in entries), sum(size for _, _, size in entries)
+
+    def _ensure_index(self):
+        if self._index is None:
+            self._load_index()
+
+    def _remember(self, h, expires, value):
+        self._memory[h] = (expires, value)
+        self._memory.move_to_end(h)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read(self, h):
+        """读取缓存条目，返回 (过期时间, 值)，不存在时返回 None"""
+        cached = self._memory.get(h)
+        if cached is not None:
+            self._memory.move_to_end(h)
+            return cached, True
+        try:
+            with open(self._path(h), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            if self._index is not None and h in self._index:
+                self._bytes -= self._index.pop(h)
+            return None, False
+        cached = (entry['expires'], entry['value'])
+        self._remember(h, *cached)
+        return cached, False
+
+    def get(self, key, default=None):
+        """返回未过期的缓存值，不存在或已过期返回 default"""
+        value, expires = self.get_entry(key)
+        if value is None or expires < time.time():
+            return default
+        return value
+
+    def get_entry(self, key):
+        """返回 (值, 过期时间)，已过期但仍在 stale_ttl 内的条目也会返回；不存在时返回 (None, None)"""
+        h = self._hash(key)
+        now = time.time()
+        with self._lock:
+            self._ensure_index()
+            cached, from_memory = self._read(h)
+            if cached is None:
+                self._stats['misses'] += 1
+                return None, None
+            if cached[0] < now:
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                if cached[0] + self.stale_ttl < now:
+                    self._remove(h)
+                    return None, None
+            else:
+                self._stats['hits'] += 1
+                if from_memory:
+                    self._stats['memory_hits'] += 1
+            if h in self._index:
+                self._index.move_to_end(h)
+            self._touch(h, now)
+            return cached[1], cached[0]
+
+    def _touch(self, h, now):
+        """刷新文件修改时间，让其他进程淘汰时也把它当作最近访问过"""
+        if now - self._touched.get(h, 0) < TOUCH_INTERVAL:
+            return
+        self._touched[h] = now
+        try:
+            os.utime(self._path(h))
+        except OSError:
+            pass
+
+    def set(self, key, value, ttl=None):
+        """写入缓存：先写临时文件再原子重命名，写入后按容量淘汰"""
+        h = self._hash(key)
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        data = json.dumps({'key': key, 'expires': expires, 'value': value}, ensure_ascii=False).encode('utf-8')
+        path = self._path(h)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._ensure_index()
+            self._bytes += len(data) - self._index.pop(h, 0)
+            self._index[h] = len(data)
+            self._remember(h, expires, value)
+            self._stats['writes'] += 1
+            self._unscanned += len(data)
+            # 本进程看到的占用只包括启动时的扫描和自己的写入，超出上限或写入较多后按磁盘实际占用校正
+            compact = self._bytes > self.max_bytes or self._unscanned > self.max_bytes // 20
+        if compact:
+            self.compact(block=False)
+
+    def delete(self, key):
+        h = self._hash(key)
+        with self._lock:
+            self._ensure_index()
+            self._remove(h)
+
+    def forget(self, key):
+        """只丢弃内存中的副本，下次读取时从磁盘重新加载（磁盘文件可能已被其他进程更新）"""
+        with self._lock:
+            self._memory.pop(self._hash(key), None)
+
+    def _remove(self, h):
+        self._memory.pop(h, None)
+        self._touched.pop(h, None)
+        if h in self._index:
+            self._bytes -= self._index.pop(h)
+        try:
+            os.remove(self._path(h))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """超出容量上限时淘汰最久未访问的条目，直到降到上限的 90%"""
+        if self._bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        while self._index and self._bytes > target:
+            h = next(iter(self._index))
+            self._remove(h)
+            self._stats['evictions'] += 1
+
+    def compact(self, purge=False, block=True):
+        """在文件锁内重新扫描磁盘（包括其他进程写入的条目），purge 为真时删除过期条目，
+        再按修改时间淘汰到容量上限以内；block 为假且其他进程正在整理时直接返回 None，否则返回删除数量"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, 'cache.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if block else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return None
+            index, total = self._scan()
+            with self._lock:
+                self._index, self._bytes = index, total
+                self._unscanned = 0
+                self._stats['compactions'] += 1
+            removed = self.purge_expired() if purge else 0
+            with self._lock:
+                evictions = self._stats['evictions']
+                self._evict()
+                return removed + self._stats['evictions'] - evictions
+
+    def start(self, interval=MAINTENANCE_INTERVAL):
+        """启动后台线程，定期清理过期条目并校正磁盘占用"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name='disk-cache', daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.compact(purge=True)
+            except Exception as e:
+                print(f'清理磁盘缓存 {self.root} 失败:', e)
+
+    def purge_expired(self):
+        """删除过期超过 stale_ttl 的条目，返回删除数量"""
+        with self._lock:
+            self._ensure_index()
+            hashes = list(self._index)
+        removed = 0
+        deadline = time.time() - self.stale_ttl
+        for h in hashes:
+            try:
+                with open(self._path(h), 'r', encoding='utf-8') as f:
+                    expires = json.load(f)['expires']
+            except (OSError, ValueError, KeyError):
+                expires = 0
+            if expires < deadline:
+                with self._lock:
+                    self._remove(h)
+                    self._stats['expired'] += 1
+                removed += 1
+        return removed
+
+    def stats(self):
+        with self._lock:
+            self._ensure_index()
+            stats = dict(self._stats)
+            stats['entries'] = len(self._index)
+            stats['memory_entries'] = len(self._memory)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,81 @@
+import os
+import re
+
+from transcode import BITRATES, WAIT_TIMEOUT, source_signature
+
+SEGMENT_SECONDS = 6  # 每个分片的时长（秒）
+SEGMENT_NAME_RE = re.compile(r'^([0-9a-f]{1,12})_(\d{1,5})$')  # <原文件签名>_<序号>
+SEGMENT_FILE_RE = re.compile(r'^(?:.*/)?(\d{5})\.ts$')  # ffmpeg 播放列表中的分片文件
+PLAYLIST_MIMETYPE = 'application/vnd.apple.mpegurl'
+SEGMENT_MIMETYPE = 'video/mp2t'
+
+
+class HlsPackager:
+    """把歌曲切成 HLS 分片：第一次请求某个码率的播放列表或分片时，用 ffmpeg 的 hls 封装对整首歌做一次编码，
+    切出全部分片并缓存，分片之间不会因为编码器重新启动而有间隙；播放列表直接使用 ffmpeg 写出的列表，
+    分片数量和每片时长与实际生成的分片一致"""
+
+    def __init__(self, transcoder, segment_seconds=SEGMENT_SECONDS, bitrates=BITRATES):
+        self.transcoder = transcoder
+        self.segment_seconds = segment_seconds
+        self.bitrates = bitrates
+
+    @property
+    def available(self):
+        return self.transcoder.available
+
+    def source_signature(self, source_path):
+        """原文件签名会写进分片地址，原文件变化后分片地址随之变化"""
+        return source_signature(os.stat(source_path))
+
+    def master_playlist(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+        for bitrate in self.bitrates:
+            # 带宽按码率加上 MPEG-TS 封装约 10% 的开销估算
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bitrate * 1100},CODECS="mp4a.40.2"')
+            lines.append(f'{bitrate}/index.m3u8')
+        return '\n'.join(lines) + '\n'
+
+    def media_playlist(self, song_id, source_path, bitrate, timeout=WAIT_TIMEOUT):
+        """返回 ffmpeg 生成的播放列表，分片地址改写为 <原文件签名>_<序号>.ts；编码超时返回 None"""
+        signature = self.source_signature(source_path)
+        path = self._encode(song_id, source_path, bitrate, signature, 'index.m3u8', timeout)
+        if path is None:
+            return None
+        lines = []
+        for line in _read_lines(path):
+            match = SEGMENT_FILE_RE.match(line)
+            lines.append(f'{signature}_{int(match.group(1))}.ts' if match else line)
+        return '\n'.join(lines) + '\n'
+
+    def segment(self, song_id, source_path, bitrate, signature, index, timeout=WAIT_TIMEOUT):
+        """返回分片文件路径；超时返回 None；签名不匹配或序号不在播放列表中时抛出 LookupError"""
+        if signature != self.source_signature(source_path):
+            raise LookupError('分片不存在')
+        # 先确认序号在 ffmpeg 的播放列表里，越界的序号不会触发重新编码
+        playlist = self._encode(song_id, source_path, bitrate, signature, 'index.m3u8', timeout)
+        if playlist is None:
+            return None
+        indexes = {int(match.group(1)) for match in map(SEGMENT_FILE_RE.match, _read_lines(playlist)) if match}
+        if index not in indexes:
+            raise LookupError('分片不存在')
+        return self._encode(song_id, source_path, bitrate, signature, f'{index:05d}.ts', timeout)
+
+    def _encode(self, song_id, source_path, bitrate, signature, filename, timeout):
+        prefix = f'{song_id}_{bitrate}_{signature}'
+        return self.transcoder.produce_many(f'{prefix}.hls', lambda produced: f'{prefix}_{produced}',
+                                            f'{prefix}_{filename}', ['-i', source_path],
+                                            lambda output_dir: self._output_args(bitrate, output_dir),
+                                            timeout=timeout)
+
+    def _output_args(self, bitrate, output_dir):
+        # 整首歌连续编码，hls 封装按 hls_time 切分并保持时间戳首尾相接
+        return ['-map', '0:a:0', '-map_metadata', '-1', '-codec:a', 'aac', '-b:a', f'{bitrate}k', '-ac', '2',
+                '-f', 'hls', '-hls_time', str(self.segment_seconds), '-hls_playlist_type', 'vod',
+                '-hls_list_size', '0', '-start_number', '0', '-hls_segment_type', 'mpegts',
+                '-hls_segment_filename', os.path.join(output_dir, '%05d.ts'), os.path.join(output_dir, 'index.m3u8')]
+
+
+def _read_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read().splitlines()
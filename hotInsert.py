@@ -14,11 +14,11 @@ end_value = int(input("请输入结束值（正整数）："))
 if start_value <= 0 or end_value <= 0 or start_value > end_value:
     print("请输入合法的起始值和结束值（均为正整数且起始值应小于等于结束值）")
 else:
-    # 构建 SQL 插入语句
+    # 构建 SQL 插入语句（写入第 0 代作为初始榜单，有播放记录后由 ranking.py 定时计算的榜单替换）
     sql = "INSERT INTO hot (TargetID, Type, Position, UpdateTime) VALUES "
     values = []
     for i in range(start_value, end_value + 1):
-        values.append(f"({i}, 'SONG', {i}, '2024-07-08 08:00:00')")
+        values.append(f"({i}, 'SONG', {i}, NOW())")
 
     sql += ",\n".join(values)
 
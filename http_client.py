@@ -0,0 +1,174 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 默认连接/读取超时（秒）
+DEFAULT_TIMEOUT = (float(os.getenv('HTTP_CONNECT_TIMEOUT', 3)), float(os.getenv('HTTP_READ_TIMEOUT', 10)))
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 2))  # 失败后最多重试次数
+BACKOFF_BASE = 0.2  # 退避基数（秒），第 n 次重试最多等待 BACKOFF_BASE * 2^n
+BACKOFF_MAX = 2.0
+RETRY_STATUS = {429, 502, 503, 504}  # 这些状态码视为临时错误，可以重试
+POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 20))  # 每个上游主机的连接池大小
+
+BREAKER_FAILURES = 5  # 连续失败多少次后熔断
+BREAKER_RESET = 30.0  # 熔断后多久（秒）放行一个试探请求
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """上游主机处于熔断状态，请求未发出"""
+
+
+class CircuitBreaker:
+    """单个上游主机的熔断器：closed -> open -> half_open -> closed"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # 放行一个试探请求
+                self.state = 'half_open'
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class HostStats:
+    """单个上游主机的请求统计"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0  # 熔断期间被拒绝的请求
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, error=False):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if error:
+                self.errors += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'avg_latency_ms': round(self.total_latency / self.requests * 1000, 2) if self.requests else 0.0,
+                'max_latency_ms': round(self.max_latency * 1000, 2),
+            }
+
+
+class HttpClient:
+    """共享的出站 HTTP 客户端：每个上游主机一个连接池，默认超时、抖动退避重试和熔断"""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_retries=MAX_RETRIES, pool_maxsize=POOL_MAXSIZE):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._breakers = {}
+        self._stats = {}
+
+    def _host_state(self, host):
+        with self._lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+                self._breakers[host] = CircuitBreaker()
+                self._stats[host] = HostStats()
+            return self._sessions[host], self._breakers[host], self._stats[host]
+
+    def request(self, method, url, timeout=None, retries=None, **kwargs):
+        host = urlsplit(url).netloc
+        session, breaker, stats = self._host_state(host)
+        timeout = timeout or self.timeout
+        retries = self.max_retries if retries is None else retries
+
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                with stats._lock:
+                    stats.rejected += 1
+                raise CircuitOpenError(f'上游 {host} 已熔断')
+
+            start = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                stats.record(time.monotonic() - start, error=True)
+                breaker.record_failure()
+                if attempt >= retries:
+                    raise
+            except Exception:
+                # 其余异常（读取响应体出错、重定向过多、URL 无效等）不重试，但同样记为失败，
+                # 否则半开状态的试探请求不会结束，熔断器一直拒绝该主机
+                stats.record(time.monotonic() - start, error=True)
+                breaker.record_failure()
+                raise
+            else:
+                failed = response.status_code >= 500 or response.status_code == 429
+                stats.record(time.monotonic() - start, error=failed)
+                if failed:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code not in RETRY_STATUS or attempt >= retries:
+                    return response
+                response.close()
+
+            # 抖动退避后重试
+            with stats._lock:
+                stats.retries += 1
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def stats(self):
+        """按上游主机返回请求、错误、延迟和熔断状态"""
+        with self._lock:
+            hosts = list(self._stats)
+        result = {}
+        for host in hosts:
+            result[host] = self._stats[host].as_dict()
+            result[host]['circuit'] = self._breakers[host].state
+        return result
+
+
+http_client = HttpClient()
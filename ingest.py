@@ -0,0 +1,552 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import ChainMap, Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from database import column_exists, get_db_connection, index_columns
+from manifest import Manifest, partial_hash
+from tags import read_song_tags
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.mp4', '.ogg', '.oga', '.opus')
+SIDECAR_NAME = 'ingest.json'  # 目录级配置文件，覆盖全局默认的封面和语言
+DEFAULT_LANGUAGE = '国语'
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'ingest_checkpoint.json')
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'library_manifest.sqlite3')
+
+SONG_INSERT = """
+              INSERT INTO songs
+              (Title, ArtistID, AlbumID, Genre, Duration, ReleaseDate, FilePath, CoverImagePath,
+               Lyrics, Language, PlayCount, CreateTime, UpdateTime, AlbumArtist, Year,
+               TrackNumber, DiscNumber, Composer, Lyricist, Comments, Channels, Bitrate, SampleRate,
+               BitDepth, Codec)
+              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                      %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                      %s, %s, %s, %s, %s)
+              """
+
+
+def song_row(tags, artist_id, album_id, cover_image_path, language, current_time):
+    """按 SONG_INSERT 的列顺序组装一行"""
+    return (
+        tags['title'], artist_id, album_id, tags['genre'], tags['duration'], tags['release_date'], tags['file_path'],
+        cover_image_path, tags['lyrics'], language, 0, current_time, current_time, tags['album_artist'],
+        tags['year'], tags['track_number'], tags['disc_number'], tags['composer'], tags['lyricist'],
+        tags['comments'], tags['channels'], tags['bitrate'], tags['sample_rate'], tags['bit_depth'], tags['codec']
+    )
+
+
+SONG_FILE_PATH_INDEX = 6  # FilePath 在 song_row 中的位置
+
+# 按指定的 SongID 插入，用于在线获取后缓存在曲库目录里的 <SongID>.mp3，保持与上游歌曲ID一致
+SONG_INSERT_WITH_ID = """
+                      INSERT INTO songs
+                      (SongID, Title, ArtistID, AlbumID, Genre, Duration, ReleaseDate, FilePath, CoverImagePath,
+                       Lyrics, Language, PlayCount, CreateTime, UpdateTime, AlbumArtist, Year,
+                       TrackNumber, DiscNumber, Composer, Lyricist, Comments, Channels, Bitrate, SampleRate,
+                       BitDepth, Codec)
+                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                              %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                              %s, %s, %s, %s, %s)
+                      """
+
+SONG_UPDATE = """
+              UPDATE songs
+              SET Title = %s, ArtistID = %s, AlbumID = %s, Genre = %s, Duration = %s, ReleaseDate = %s,
+                  FilePath = %s, Lyrics = %s, UpdateTime = %s, AlbumArtist = %s, Year = %s, TrackNumber = %s,
+                  DiscNumber = %s, Composer = %s, Lyricist = %s, Comments = %s, Channels = %s, Bitrate = %s,
+                  SampleRate = %s, BitDepth = %s, Codec = %s, Orphaned = 0
+              WHERE SongID = %s
+              """
+
+
+def song_update_row(tags, artist_id, album_id, current_time, song_id):
+    """按 SONG_UPDATE 的列顺序组装一行，封面和语言保持不变"""
+    return (
+        tags['title'], artist_id, album_id, tags['genre'], tags['duration'], tags['release_date'], tags['file_path'],
+        tags['lyrics'], current_time, tags['album_artist'], tags['year'], tags['track_number'], tags['disc_number'],
+        tags['composer'], tags['lyricist'], tags['comments'], tags['channels'], tags['bitrate'], tags['sample_rate'],
+        tags['bit_depth'], tags['codec'], song_id
+    )
+
+
+# 旧库升级：入库和同步写入的列、按路径查找歌曲用的索引
+SONG_COLUMNS = [
+    ('Codec', "varchar(16) null comment '编码格式（mp3、flac、aac、alac、vorbis、opus）'"),
+    ('Orphaned', "tinyint(1) default 0 null comment '文件是否已丢失'"),
+]
+
+
+def ensure_schema():
+    """检查并补齐 songs 表缺少的列和索引，重复执行无副作用；返回执行过的升级语句数"""
+    applied = 0
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            for column, definition in SONG_COLUMNS:
+                if not column_exists(cursor, 'songs', column):
+                    cursor.execute(f"ALTER TABLE songs ADD COLUMN {column} {definition}")
+                    applied += 1
+            if not index_columns(cursor, 'songs', 'idx_file_path'):
+                cursor.execute("CREATE INDEX idx_file_path ON songs (FilePath)")
+                applied += 1
+            db.commit()
+        finally:
+            cursor.close()
+    if applied:
+        print(f'歌曲表结构已升级（{applied} 项）')
+    return applied
+
+
+def dimension_key(name):
+    """与 MySQL 默认排序规则一致：忽略大小写和末尾空格"""
+    return (name or '').rstrip().casefold()
+
+
+class DimensionCache:
+    """艺术家/专辑 ID 解析缓存：首次使用时预加载，专辑按 (标题, 专辑艺术家) 区分，缺失的批量创建。
+    本事务新建的 ID 先记在该游标名下，调用 commit(cursor) 后才对其他写入方可见，回滚时调用 rollback(cursor) 丢弃"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.artists = {}  # 名称 -> ArtistID（已提交）
+        self.albums = {}  # (标题, ArtistID) -> AlbumID（已提交）
+        self._staged = {}  # 游标 -> (新建的艺术家, 新建的专辑)，事务提交前只有这个游标能用
+
+    def _load(self, cursor):
+        # 按 ID 倒序加载，同名时保留最早的那一条
+        cursor.execute("SELECT Name, ArtistID FROM artists ORDER BY ArtistID DESC")
+        for name, artist_id in cursor.fetchall():
+            self.artists[dimension_key(name)] = artist_id
+        cursor.execute("SELECT Title, ArtistID, AlbumID FROM albums ORDER BY AlbumID DESC")
+        for title, artist_id, album_id in cursor.fetchall():
+            self.albums[(dimension_key(title), artist_id)] = album_id
+        self._loaded = True
+
+    def resolve(self, cursor, items):
+        """items 为 [(歌手, 专辑, 专辑艺术家)]，返回 [(ArtistID, AlbumID)]；缺失的行各用一次 executemany 创建"""
+        with self._lock:
+            if not self._loaded:
+                self._load(cursor)
+            staged_artists, staged_albums = self._staged.setdefault(cursor, ({}, {}))
+        artists = ChainMap(staged_artists, self.artists)
+        albums = ChainMap(staged_albums, self.albums)
+        now = datetime.now()
+
+        # 插入和查回都在调用方的连接上进行，不占用锁；已提交的映射只在 commit 时加锁更新
+        names = {}
+        for artist, _, album_artist in items:
+            for name in (artist, album_artist):
+                if dimension_key(name) not in artists:
+                    names.setdefault(dimension_key(name), name)
+        if names:
+            cursor.executemany("INSERT INTO artists (Name, CreateTime, UpdateTime) VALUES (%s, %s, %s)",
+                               [(name, now, now) for name in names.values()])
+            # 不依赖自增 ID 连续，插入后按名称查回
+            for name, artist_id in self._select(cursor, "SELECT Name, ArtistID FROM artists WHERE Name IN ({}) "
+                                                        "ORDER BY ArtistID DESC", list(names.values())):
+                staged_artists[dimension_key(name)] = artist_id
+
+        titles = {}
+        for _, album, album_artist in items:
+            key = (dimension_key(album), artists[dimension_key(album_artist)])
+            if key not in albums:
+                titles.setdefault(key, album)
+        if titles:
+            cursor.executemany("INSERT INTO albums (Title, ArtistID, CreateTime, UpdateTime) "
+                               "VALUES (%s, %s, %s, %s)",
+                               [(title, artist_id, now, now) for (_, artist_id), title in titles.items()])
+            rows = self._select(cursor, "SELECT Title, ArtistID, AlbumID FROM albums WHERE Title IN ({}) "
+                                        "ORDER BY AlbumID DESC", list({t for t in titles.values()}))
+            for title, artist_id, album_id in rows:
+                staged_albums[(dimension_key(title), artist_id)] = album_id
+
+        return [(artists[dimension_key(artist)],
+                 albums[(dimension_key(album), artists[dimension_key(album_artist)])])
+                for artist, album, album_artist in items]
+
+    def commit(self, cursor):
+        """事务提交后调用，把这个游标新建的 ID 发布给所有写入方"""
+        with self._lock:
+            staged_artists, staged_albums = self._staged.pop(cursor, ({}, {}))
+            self.artists.update(staged_artists)
+            self.albums.update(staged_albums)
+
+    def rollback(self, cursor):
+        """事务回滚后调用，丢弃这个游标新建但未提交的 ID"""
+        with self._lock:
+            self._staged.pop(cursor, None)
+
+    @staticmethod
+    def _select(cursor, query, values, chunk=1000):
+        rows = []
+        for i in range(0, len(values), chunk):
+            part = values[i:i + chunk]
+            cursor.execute(query.format(','.join(['%s'] * len(part))), part)
+            rows.extend(cursor.fetchall())
+        return rows
+
+def dimension_item(tags):
+    return tags['artist'], tags['album'], tags['album_artist'] or tags['artist']
+
+
+def load_config(config_path):
+    """读取全局默认配置：{"cover": 封面路径, "language": 语言}"""
+    config = {'cover': None, 'language': DEFAULT_LANGUAGE}
+    if config_path:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config.update(json.load(f))
+    return config
+
+
+class Defaults:
+    """按目录查找 ingest.json，目录配置覆盖全局配置"""
+
+    def __init__(self, config):
+        self.config = config
+        self._dirs = {}
+
+    def for_file(self, file_path):
+        directory = os.path.dirname(file_path)
+        if directory not in self._dirs:
+            merged = dict(self.config)
+            sidecar = os.path.join(directory, SIDECAR_NAME)
+            if os.path.exists(sidecar):
+                with open(sidecar, 'r', encoding='utf-8') as f:
+                    merged.update(json.load(f))
+            self._dirs[directory] = merged
+        return self._dirs[directory]
+
+
+def iter_audio_files(folder_path):
+    """按固定顺序遍历目录，每次导入的顺序一致"""
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            if file.lower().endswith(AUDIO_EXTENSIONS):
+                yield os.path.join(root, file)
+
+
+def safe_read_tags(file_path):
+    """在子进程中解析标签，出错时返回错误信息而不是抛出异常"""
+    try:
+        return read_song_tags(file_path), None
+    except Exception as e:
+        return None, f'{file_path}: {e}'
+
+
+def load_checkpoint(checkpoint_path, folder_path):
+    """返回上次导入该目录时已处理的文件数，没有该目录的检查点时返回 None"""
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint.get('done', 0) if checkpoint.get('folder') == folder_path else None
+
+
+def save_checkpoint(checkpoint_path, folder_path, done):
+    """原子写入检查点：本次已处理的文件数；续传时按数据库中已有的 FilePath 跳过，不依赖文件顺序"""
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(checkpoint_path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'folder': folder_path, 'done': done, 'time': datetime.now().isoformat()}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def committed_paths(cursor, folder_path):
+    """目录下已经入库的文件路径"""
+    cursor.execute("SELECT FilePath FROM songs WHERE FilePath LIKE %s", (os.path.join(folder_path, '') + '%',))
+    return {path for path, in cursor.fetchall()}
+
+
+class BatchWriter:
+    """单一写入者：攒够一批后 executemany 插入/更新并提交"""
+
+    def __init__(self, db, batch_size=500, track_ids=False, dimensions=None, sidecars=None, invalidations=None):
+        self.db = db
+        self.cursor = db.cursor()
+        self.batch_size = batch_size
+        self.sidecars = sidecars  # SidecarBuilder，提交后为本批歌曲生成元数据副本
+        self.invalidations = invalidations  # InvalidationBus，提交后通知各进程清理这些歌曲、专辑、歌手的缓存
+        self.track_ids = track_ids or sidecars is not None  # 提交后查询新插入歌曲的 SongID
+        self.dimensions = dimensions or DimensionCache()
+        self.sidecar_futures = []
+        self.pending = []  # (标签, 默认配置, 要更新的 SongID)
+        self.insert_ids = {}  # 文件路径 -> 插入时使用的 SongID
+        self.written = 0
+
+    def add(self, tags, defaults, song_id=None, insert_id=None):
+        """song_id 不为空时原地更新该歌曲，否则插入新歌曲，insert_id 不为空时以它作为新歌曲的 SongID；
+        返回是否该提交了"""
+        self.pending.append((tags, defaults, song_id))
+        if insert_id is not None and not song_id:
+            self.insert_ids[tags['file_path']] = insert_id
+        return len(self.pending) >= self.batch_size
+
+    def flush(self):
+        """一次解析整批的艺术家和专辑，写入并提交，track_ids 时返回 {文件路径: 新插入的 SongID}"""
+        if not self.pending:
+            return {}
+        now = datetime.now()
+        rows, id_rows, updates = [], [], []
+        try:
+            ids = self.dimensions.resolve(self.cursor, [dimension_item(tags) for tags, _, _ in self.pending])
+            for (tags, defaults, song_id), (artist_id, album_id) in zip(self.pending, ids):
+                if song_id:
+                    updates.append(song_update_row(tags, artist_id, album_id, now, song_id))
+                    continue
+                row = song_row(tags, artist_id, album_id, defaults.get('cover'),
+                               defaults.get('language') or DEFAULT_LANGUAGE, now)
+                insert_id = self.insert_ids.get(tags['file_path'])
+                if insert_id is None:
+                    rows.append(row)
+                else:
+                    id_rows.append((insert_id,) + row)
+            inserted = {}
+            if rows:
+                self.cursor.executemany(SONG_INSERT, rows)
+                if self.track_ids:
+                    inserted = self._inserted_ids([row[SONG_FILE_PATH_INDEX] for row in rows])
+            if id_rows:
+                self.cursor.executemany(SONG_INSERT_WITH_ID, id_rows)
+                inserted.update((row[SONG_FILE_PATH_INDEX + 1], row[0]) for row in id_rows)
+            if updates:
+                self.cursor.executemany(SONG_UPDATE, updates)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            self.dimensions.rollback(self.cursor)
+            raise
+        self.dimensions.commit(self.cursor)
+        if self.invalidations is not None:
+            tags = []
+            for (_, _, song_id), (artist_id, album_id) in zip(self.pending, ids):
+                if song_id:
+                    # 重新入库的文件封面可能变了，按歌曲ID提取的封面也要重新生成
+                    tags += [f'song:{song_id}', f'cover:{song_id}']
+                tags += [f'album:{album_id}', f'artist:{artist_id}']
+            try:
+                self.invalidations.invalidate(*tags)
+            except Exception as e:
+                print('发送失效通知失败:', e)
+        if self.sidecars is not None:
+            items = [(song_id or inserted.get(tags['file_path']), tags['file_path'], tags['lyrics'],
+                      defaults.get('cover')) for tags, defaults, song_id in self.pending]
+            self.sidecar_futures += self.sidecars.submit([item for item in items if item[0]])
+        self.written += len(self.pending)
+        self.pending = []
+        self.insert_ids = {}
+        return inserted
+
+    def _inserted_ids(self, paths):
+        return dict(DimensionCache._select(self.cursor, "SELECT FilePath, MAX(SongID) FROM songs "
+                                                        "WHERE FilePath IN ({}) GROUP BY FilePath", paths))
+
+    def close(self):
+        self.cursor.close()
+
+
+class Progress:
+    """定期打印进度和吞吐量"""
+
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.start = time.monotonic()
+        self._last = self.start
+
+    def report(self, done, errors, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed else 0.0
+        eta = (self.total - done) / rate if rate else 0.0
+        print(f'[ingest] {done}/{self.total} 文件, 错误 {errors}, {rate:.1f} 文件/秒, 已用 {elapsed:.0f}s, 预计剩余 {eta:.0f}s')
+
+
+def batch_ingest(folder_path, config_path=None, workers=None, batch_size=500, checkpoint_path=CHECKPOINT_PATH,
+                 sidecars=None, invalidations=None):
+    """非交互批量导入：多进程解析标签，单连接批量写入，每批提交并记录检查点"""
+    folder_path = os.path.abspath(folder_path)
+    files = list(iter_audio_files(folder_path))
+    defaults = Defaults(load_config(config_path))
+    done, errors = 0, 0
+
+    db = get_db_connection().get_connection()
+    writer = BatchWriter(db, batch_size, sidecars=sidecars, invalidations=invalidations)
+    try:
+        if load_checkpoint(checkpoint_path, folder_path) is not None:
+            # 上次导入中断过：目录里的文件可能有增减，按路径跳过已提交的文件，而不是按上次的位置
+            existing = committed_paths(writer.cursor, folder_path)
+            remaining = [path for path in files if path not in existing]
+            print(f'从检查点继续，跳过已入库的 {len(files) - len(remaining)} 个文件')
+            files = remaining
+        progress = Progress(len(files))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(safe_read_tags, files, chunksize=32)
+            for tags, error in results:
+                done += 1
+                if error:
+                    errors += 1
+                    print('解析失败:', error)
+                elif writer.add(tags, defaults.for_file(tags['file_path'])):
+                    writer.flush()
+                    save_checkpoint(checkpoint_path, folder_path, done)
+                progress.report(done, errors)
+        writer.flush()
+        save_checkpoint(checkpoint_path, folder_path, done)
+    finally:
+        writer.close()
+        db.close()
+    if sidecars is not None:
+        sidecars.wait(writer.sidecar_futures)
+    progress.report(done, errors, force=True)
+    return writer.written, errors
+
+
+def scan_files(folder_path):
+    """递归遍历目录，返回 (路径, 大小, 修改时间)，只做 stat 不读文件内容；
+    遍历途中被删除或移走的子目录和文件直接跳过，folder_path 本身不存在时抛出异常"""
+    stack = [folder_path]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = os.scandir(directory)
+        except (FileNotFoundError, NotADirectoryError):
+            if directory == folder_path:
+                raise
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(AUDIO_EXTENSIONS):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, st.st_size, st.st_mtime_ns
+
+
+def sync_library(folder_path, config_path=None, workers=None, batch_size=500, manifest_path=MANIFEST_PATH,
+                 sidecars=None, invalidations=None):
+    """增量同步：只解析新增或内容变化的文件，按指纹识别移动的文件，标记文件已丢失的歌曲"""
+    folder_path = os.path.abspath(folder_path)
+    manifest = Manifest(manifest_path)
+    known = manifest.entries(os.path.join(folder_path, ''))
+    defaults = Defaults(load_config(config_path))
+    stats = Counter()
+    start = time.monotonic()
+
+    db = get_db_connection().get_connection()
+    writer = BatchWriter(db, batch_size, track_ids=True, sidecars=sidecars, invalidations=invalidations)
+    cursor = writer.cursor
+    try:
+        # 数据库里已有但清单里没有的文件（例如用旧方式导入的）直接认领，避免重复插入
+        cursor.execute("SELECT FilePath, SongID FROM songs WHERE FilePath LIKE %s ORDER BY SongID",
+                       (os.path.join(folder_path, '') + '%',))
+        db_paths = dict(cursor.fetchall())
+
+        seen = set()
+        to_parse = []  # (路径, 大小, 修改时间, 指纹, 要更新的 SongID)
+        new_files = []
+        restored = []  # 重新出现的文件对应的 SongID
+        for path, size, mtime_ns in scan_files(folder_path):
+            seen.add(path)
+            entry = known.get(path)
+            if entry and entry[0] == size and entry[1] == mtime_ns:
+                if entry[4]:
+                    restored.append(entry[3])
+                    manifest.upsert(path, size, mtime_ns, entry[2], entry[3])
+                stats['unchanged'] += 1
+                continue
+            file_hash = partial_hash(path, size)
+            if entry and entry[2] == file_hash:
+                # 只有修改时间变了，内容没变
+                manifest.upsert(path, size, mtime_ns, file_hash, entry[3])
+                if entry[4]:
+                    restored.append(entry[3])
+                stats['unchanged'] += 1
+            elif entry:
+                to_parse.append((path, size, mtime_ns, file_hash, entry[3]))
+            else:
+                new_files.append((path, size, mtime_ns, file_hash))
+
+        # 清单里有但这次没扫描到的文件：可能被移动，否则标记为丢失
+        gone = {path: entry for path, entry in known.items() if path not in seen}
+        gone_by_hash = {entry[2]: path for path, entry in gone.items()}
+        moves = []
+        for path, size, mtime_ns, file_hash in new_files:
+            old_path = gone_by_hash.pop(file_hash, None)
+            if old_path is not None and gone[old_path][3]:
+                song_id = gone.pop(old_path)[3]
+                moves.append((path, datetime.now(), song_id))
+                manifest.remove(old_path)
+                manifest.upsert(path, size, mtime_ns, file_hash, song_id)
+            elif path in db_paths:
+                manifest.upsert(path, size, mtime_ns, file_hash, db_paths[path])
+                stats['adopted'] += 1
+            else:
+                to_parse.append((path, size, mtime_ns, file_hash, None))
+
+        if moves:
+            cursor.executemany("UPDATE songs SET FilePath = %s, UpdateTime = %s, Orphaned = 0 WHERE SongID = %s",
+                               moves)
+        if restored:
+            cursor.executemany("UPDATE songs SET Orphaned = 0 WHERE SongID = %s", [(i,) for i in restored])
+        orphans = [(entry[3],) for entry in gone.values() if entry[3] and not entry[4]]
+        if orphans:
+            cursor.executemany("UPDATE songs SET Orphaned = 1 WHERE SongID = %s", orphans)
+        manifest.mark_missing(list(gone))
+        db.commit()
+        manifest.commit()
+        stats.update(moved=len(moves), restored=len(restored), orphaned=len(orphans))
+        changed = [song_id for _, _, song_id in moves] + restored + [song_id for song_id, in orphans]
+        if invalidations is not None and changed:
+            # 路径和丢失标记已提交，通知各进程清理这些歌曲的缓存
+            try:
+                invalidations.invalidate(*[f'song:{song_id}' for song_id in changed])
+            except Exception as e:
+                print('发送失效通知失败:', e)
+
+        # 只解析新增和内容变化的文件
+        pending = {item[0]: item for item in to_parse}
+
+        def flush():
+            for path, song_id in writer.flush().items():
+                item = pending.get(path)
+                if item:
+                    manifest.upsert(path, item[1], item[2], item[3], song_id)
+            manifest.commit()
+
+        if to_parse:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(safe_read_tags, [item[0] for item in to_parse], chunksize=32)
+                for item, (tags, error) in zip(to_parse, results):
+                    path, size, mtime_ns, file_hash, song_id = item
+                    if error:
+                        stats['errors'] += 1
+                        print('解析失败:', error)
+                        continue
+                    stats['updated' if song_id else 'inserted'] += 1
+                    if song_id:
+                        manifest.upsert(path, size, mtime_ns, file_hash, song_id)
+                    if writer.add(tags, defaults.for_file(path), song_id):
+                        flush()
+        flush()
+    finally:
+        writer.close()
+        db.close()
+        manifest.close()
+    if sidecars is not None:
+        sidecars.wait(writer.sidecar_futures)
+
+    print(f"[sync] 用时 {time.monotonic() - start:.1f}s: " + ', '.join(f'{k} {v}' for k, v in sorted(stats.items())))
+    return stats
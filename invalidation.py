@@ -0,0 +1,272 @@
+import fcntl
+import functools
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from flask import Response, make_response, request
+
+try:
+    import redis
+except ImportError:  # redis 为可选依赖，未配置 INVALIDATION_REDIS_URL 时使用本机共享内存
+    redis = None
+
+INVALIDATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'invalidation')
+VERSION_SLOTS = 65536  # 共享内存中的标签版本槽位数，不同标签落到同一槽位只会多失效一些缓存
+EVENT_LOG_MAX_BYTES = 1024 * 1024  # 事件日志超过这个大小后轮换
+EVENT_LOG_ROTATIONS = 8  # 保留的旧日志文件数，读取方落后超过这么多个文件时才会丢事件
+POLL_INTERVAL = 1  # 各进程读取失效事件的间隔（秒）
+REDIS_STREAM_MAXLEN = 10000
+SEQUENCE_TAG = '*'  # 每次失效都会递增的全局标签
+TAGGED_CACHE_TIMEOUT = 24 * 60 * 60  # 有失效通知后缓存时间可以放长
+
+
+class LocalBackend:
+    """同一台机器上的多个进程共享：标签版本存放在内存映射文件里，失效事件追加到日志文件；
+    轮换出的旧文件按代数命名为 events.log.<代数>，保留最近 EVENT_LOG_ROTATIONS 个。
+    读取位置记为 (代数, 偏移量)，不用 inode，删除的文件 inode 被复用也不会读错文件"""
+
+    def __init__(self, root=INVALIDATION_DIR, slots=VERSION_SLOTS):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.slots = slots
+        self._versions_path = os.path.join(root, 'versions.bin')
+        self._log_path = os.path.join(root, 'events.log')
+        fd = os.open(self._versions_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < slots * 8:
+                os.ftruncate(fd, slots * 8)
+            self._map = mmap.mmap(fd, slots * 8)
+        finally:
+            os.close(fd)
+        self._lock_file = open(os.path.join(root, 'write.lock'), 'w')
+        self._thread_lock = threading.Lock()
+
+    def _slot(self, tag):
+        return zlib.crc32(tag.encode('utf-8')) % self.slots * 8
+
+    def versions(self, tags):
+        return [struct.unpack_from('<Q', self._map, self._slot(tag))[0] for tag in tags]
+
+    def _rotated(self, generation):
+        return f'{self._log_path}.{generation}'
+
+    def _generations(self):
+        """已轮换出的旧文件的代数，从小到大"""
+        prefix = os.path.basename(self._log_path) + '.'
+        return sorted(int(name[len(prefix):]) for name in os.listdir(self.root)
+                      if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+    def _position(self, generations):
+        # 当前日志的代数 = 最新的旧文件代数 + 1
+        try:
+            size = os.path.getsize(self._log_path)
+        except FileNotFoundError:
+            size = 0
+        return (generations[-1] + 1 if generations else 0), size
+
+    def invalidate(self, tags):
+        line = (json.dumps(tags, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                for slot in {self._slot(tag) for tag in tags}:
+                    struct.pack_into('<Q', self._map, slot, struct.unpack_from('<Q', self._map, slot)[0] + 1)
+                if os.path.exists(self._log_path) and os.path.getsize(self._log_path) > EVENT_LOG_MAX_BYTES:
+                    generations = self._generations()
+                    generation = self._position(generations)[0]
+                    os.replace(self._log_path, self._rotated(generation))
+                    for old in generations:
+                        if old <= generation - EVENT_LOG_ROTATIONS:
+                            os.remove(self._rotated(old))
+                with open(self._log_path, 'ab') as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _locked(self, func, *args):
+        # 读取期间不让写入方轮换，代数和文件的对应关系保持不变
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_SH)
+            try:
+                return func(*args)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def position(self):
+        """(当前日志的代数, 已读到的位置)"""
+        return self._locked(lambda: self._position(self._generations()))
+
+    def events(self, position, timeout):
+        """返回 (position 之后的失效标签列表, 新位置)；日志轮换过时先按从旧到新读完轮换出的文件"""
+        time.sleep(timeout)
+        return self._locked(self._read, position)
+
+    def _read(self, position):
+        generation, offset = position
+        generations = self._generations()
+        current, size = self._position(generations)
+        events = []
+        if generation != current:
+            if generation < current:
+                if generation not in generations:
+                    print(f'失效事件日志已轮换超过 {EVENT_LOG_ROTATIONS} 个文件，之前的事件已丢失')
+                for old in generations:
+                    if old >= generation:
+                        with open(self._rotated(old), 'rb') as f:
+                            f.seek(offset if old == generation else 0)
+                            events += self._parse(f.read())[0]
+            offset = 0
+        if size > offset:
+            with open(self._log_path, 'rb') as f:
+                f.seek(offset)
+                parsed, consumed = self._parse(f.read(size - offset))
+            events += parsed
+            offset += consumed
+        return events, (current, offset)
+
+    @staticmethod
+    def _parse(data):
+        # 最后一行可能还没写完，留到下次读
+        end = data.rfind(b'\n') + 1
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events, end
+
+
+class RedisBackend:
+    """多台机器共享：标签版本是 Redis 计数器，失效事件写入 Redis Stream，兼容 Redis 协议的服务均可"""
+
+    def __init__(self, url, prefix='zymusic:'):
+        if redis is None:
+            raise RuntimeError('使用 Redis 失效通知需要安装 redis')
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.stream = prefix + 'invalidations'
+
+    def versions(self, tags):
+        if not tags:
+            return []
+        return [int(value or 0) for value in self.client.mget([self.prefix + 'tag:' + tag for tag in tags])]
+
+    def invalidate(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.xadd(self.stream, {'tags': json.dumps(tags, ensure_ascii=False)}, maxlen=REDIS_STREAM_MAXLEN,
+                  approximate=True)
+        pipe.execute()
+
+    def position(self):
+        last = self.client.xrevrange(self.stream, count=1)
+        return last[0][0] if last else '0-0'
+
+    def events(self, position, timeout):
+        result = self.client.xread({self.stream: position}, block=int(timeout * 1000), count=1000)
+        events = []
+        for _, entries in result or []:
+            for entry_id, fields in entries:
+                events.append(json.loads(fields[b'tags']))
+                position = entry_id
+        return events, position
+
+
+class InvalidationBus:
+    """按标签失效：写入方 invalidate('song:1', 'playlist:2')，所有进程的标签版本随之变化，
+    并在后台线程中收到事件，调用按标签类型注册的处理函数清理各自的派生数据"""
+
+    def __init__(self, backend, poll_interval=POLL_INTERVAL):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self._handlers = {}  # 标签类型 -> [处理函数(标签值)]
+        self._thread = None
+        self._stats = {'published': 0, 'received': 0, 'handler_errors': 0}
+
+    def on(self, kind, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def invalidate(self, *tags):
+        tags = list(dict.fromkeys(tags))
+        if tags:
+            self.backend.invalidate(tags + [SEQUENCE_TAG])
+            self._stats['published'] += len(tags)
+
+    def versions(self, tags):
+        return self.backend.versions(tags)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='invalidation', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        position = self.backend.position()
+        while True:
+            try:
+                events, position = self.backend.events(position, self.poll_interval)
+            except Exception as e:
+                print('读取失效事件失败:', e)
+                time.sleep(self.poll_interval)
+                continue
+            for tags in events:
+                self.dispatch(tags)
+
+    def dispatch(self, tags):
+        for tag in tags:
+            if tag == SEQUENCE_TAG:
+                continue
+            self._stats['received'] += 1
+            kind, _, value = tag.partition(':')
+            for handler in self._handlers.get(kind, ()):
+                try:
+                    handler(value)
+                except Exception as e:
+                    self._stats['handler_errors'] += 1
+                    print(f'处理失效事件 {tag} 失败:', e)
+
+    def stats(self):
+        return dict(self._stats, backend=type(self.backend).__name__)
+
+
+def invalidation_bus():
+    """按环境变量选择后端：配置了 INVALIDATION_REDIS_URL 时用 Redis，否则用本机共享内存"""
+    url = os.getenv('INVALIDATION_REDIS_URL')
+    return InvalidationBus(RedisBackend(url) if url else LocalBackend())
+
+
+def tagged_cache(cache, bus, tags, timeout=TAGGED_CACHE_TIMEOUT):
+    """代替 cache.cached 缓存视图响应：tags(响应 JSON) 返回这份响应依赖的标签，
+    缓存时记下各标签的版本，读取时任一标签的版本变化就重新生成"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = 'tagged:' + request.full_path
+            entry = cache.get(key)
+            if entry is not None:
+                entry_tags, versions, body, status, mimetype = entry
+                if bus.versions(entry_tags) == versions:
+                    return Response(body, status=status, mimetype=mimetype)
+
+            [sequence] = bus.versions([SEQUENCE_TAG])
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                entry_tags = list(dict.fromkeys(tags(response.get_json(silent=True))))
+                versions = bus.versions(entry_tags + [SEQUENCE_TAG])
+                # 生成期间有过失效时不知道响应是否已过时，不缓存
+                if versions.pop() == sequence:
+                    cache.set(key, (entry_tags, versions, response.get_data(), response.status_code,
+                                    response.mimetype), timeout=timeout)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,187 @@
+import array
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # brotli 为可选依赖，未安装时只提供 gzip
+    brotli = None
+
+LRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lrc')
+
+_TIME_TAG_RE = re.compile(r'\[(\d{1,3}):(\d{1,2})(?:[.:](\d{1,3}))?\]')
+_OFFSET_RE = re.compile(r'^\[offset:\s*([+-]?\d+)\s*\]', re.IGNORECASE | re.MULTILINE)
+
+
+def resolve_lyrics(song_id, stored=None, fallback=None, lrc_dir=LRC_DIR):
+    """所有歌词接口共用的来源优先级：lrc/<id>.lrc（保存或编辑过的歌词），其次 stored（songs.Lyrics，
+    入库时取自文件内嵌歌词），最后 fallback（在线歌曲信息里的歌词）；stored 和 fallback 可以是函数，用到时才调用"""
+    lrc_path = os.path.join(lrc_dir, f'{song_id}.lrc')
+    if os.path.exists(lrc_path):
+        with open(lrc_path, 'r', encoding='utf-8', errors='replace') as f:
+            return f.read()
+    for source in (stored, fallback):
+        text = source() if callable(source) else source
+        if text:
+            return text
+    return None
+
+
+def parse_lrc(text):
+    """解析 LRC 歌词，返回按时间排序的 [(毫秒, 歌词)]；一行多个时间标签时展开为多行，支持 [offset:]"""
+    if not text:
+        return []
+    offset_match = _OFFSET_RE.search(text)
+    offset = int(offset_match.group(1)) if offset_match else 0
+
+    lines = []
+    for raw in text.splitlines():
+        tags = []
+        pos = 0
+        while True:
+            match = _TIME_TAG_RE.match(raw, pos)
+            if not match:
+                break
+            tags.append(match)
+            pos = match.end()
+        if not tags:
+            continue
+        content = raw[pos:].strip()
+        for match in tags:
+            minutes, seconds, fraction = match.groups()
+            fraction = fraction or '0'
+            # 两位小数是百分之一秒，三位是毫秒
+            ms = int(fraction) * 10 ** (3 - len(fraction))
+            # offset 为正表示歌词提前显示
+            lines.append((max(0, (int(minutes) * 60 + int(seconds)) * 1000 + ms - offset), content))
+    lines.sort(key=lambda line: line[0])
+    return lines
+
+
+def merge_translation(lines, sub_lines, tolerance=300):
+    """把翻译歌词按时间对齐到原歌词上，返回 [(毫秒, 歌词, 翻译)]；时间相差 tolerance 毫秒以内视为同一行"""
+    sub_times = [ms for ms, _ in sub_lines]
+    merged = []
+    for ms, text in lines:
+        translation = None
+        i = bisect.bisect_left(sub_times, ms)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(sub_times)]
+        if candidates:
+            j = min(candidates, key=lambda k: abs(sub_times[k] - ms))
+            if abs(sub_times[j] - ms) <= tolerance and sub_lines[j][1]:
+                translation = sub_lines[j][1]
+        merged.append((ms, text, translation))
+    return merged
+
+
+class ParsedLyrics:
+    """解析后的歌词：时间轴为有序数组，按播放位置二分查找；完整响应体和压缩结果只生成一次"""
+
+    __slots__ = ('times', 'texts', 'translations', 'etag', 'loaded_at', '_bodies')
+
+    def __init__(self, merged):
+        self.times = array.array('q', (ms for ms, _, _ in merged))
+        self.texts = [text for _, text, _ in merged]
+        self.translations = [translation for _, _, translation in merged]
+        self.loaded_at = time.monotonic()
+        self._bodies = {}
+        self.etag = hashlib.sha1(self.body()).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.times)
+
+    def lines(self, start=0, end=None):
+        end = len(self.times) if end is None else end
+        return [[self.times[i], self.texts[i], self.translations[i]] for i in range(start, end)]
+
+    def index_at(self, position):
+        """播放位置（毫秒）对应的当前行，第一行之前返回 -1"""
+        return bisect.bisect_right(self.times, position) - 1
+
+    def window(self, position, before=2, after=5):
+        """返回 (当前行序号, 窗口起始序号, 窗口内的行)"""
+        index = self.index_at(position)
+        start = max(0, index - before)
+        end = min(len(self.times), index + after + 1)
+        return index, start, self.lines(start, end)
+
+    def body(self, encoding=None):
+        """完整歌词的 JSON 响应体，encoding 为 None/'gzip'/'br'"""
+        body = self._bodies.get(encoding)
+        if body is None:
+            if encoding is None:
+                body = json.dumps({'code': 200, 'lines': self.lines()}, ensure_ascii=False,
+                                  separators=(',', ':')).encode('utf-8')
+            else:
+                body = compress(self.body(), encoding)
+            self._bodies[encoding] = body
+        return body
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def pick_encoding(accept_encoding):
+    """按 Accept-Encoding 选择压缩方式，安装了 brotli 时优先 br"""
+    accept_encoding = accept_encoding or ''
+    if brotli is not None and 'br' in accept_encoding:
+        return 'br'
+    if 'gzip' in accept_encoding:
+        return 'gzip'
+    return None
+
+
+class LyricsStore:
+    """歌词 LRU 缓存：loader(song_id) 返回 (LRC 原文, 翻译 LRC)，每首歌只解析一次"""
+
+    def __init__(self, loader, max_items=2000, ttl=10 * 60, missing_ttl=60):
+        self.loader = loader
+        self.max_items = max_items
+        self.ttl = ttl  # 条目有效期，过期后重新加载以便读到数据库里的修改
+        self.missing_ttl = missing_ttl  # 没有歌词的歌曲多久后再查
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # 歌曲ID -> ParsedLyrics 或 (None, 加载时间)
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, song_id):
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(song_id)
+            if item is not None:
+                loaded_at = item.loaded_at if isinstance(item, ParsedLyrics) else item[1]
+                ttl = self.ttl if isinstance(item, ParsedLyrics) else self.missing_ttl
+                if now - loaded_at < ttl:
+                    self._items.move_to_end(song_id)
+                    self._stats['hits'] += 1
+                    return item if isinstance(item, ParsedLyrics) else None
+            self._stats['misses'] += 1
+
+        text, sub_text = self.loader(song_id)
+        lines = parse_lrc(text)
+        parsed = ParsedLyrics(merge_translation(lines, parse_lrc(sub_text))) if lines else None
+
+        with self._lock:
+            self._items[song_id] = parsed if parsed is not None else (None, now)
+            self._items.move_to_end(song_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                self._stats['evictions'] += 1
+        return parsed
+
+    def invalidate(self, song_id):
+        with self._lock:
+            self._items.pop(song_id, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, items=len(self._items), max_items=self.max_items)
@@ -1,6 +1,8 @@
-import json
 import logging
 import os
+import random
+import re
+import threading
 import time
 import uuid
 from contextlib import asynccontextmanager
@@ -12,20 +14,43 @@ import mysql
 import requests
 from PIL import Image
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, send_file, abort, make_response, session
+from flask import Flask, jsonify, request, send_file, abort, make_response, session, Response
 from flask_caching import Cache
 from flask_cors import CORS
-from flask_jwt_extended import (JWTManager, jwt_required, create_access_token, get_jwt_identity, )
-from mutagen.id3 import ID3, APIC
-from mutagen.mp3 import MP3
-
-from database import test_database_connection, get_db_connection
+from flask_jwt_extended import (JWTManager, jwt_required, create_access_token, get_jwt_identity,
+                                verify_jwt_in_request, )
+
+from audio_stream import send_audio, audio_mimetype
+from catalog import Catalog, CHECK_INTERVAL
+from covers import CoverRenditions, MIMETYPES as COVER_MIMETYPES, SOURCE_EXTENSIONS, SOURCE_MIMETYPES, source_mimetype
+from database import test_database_connection, get_db_connection, pool_stats
+from disk_cache import DiskCache
+from hls import HlsPackager, SEGMENT_NAME_RE, PLAYLIST_MIMETYPE, SEGMENT_MIMETYPE
+from http_client import http_client
+from ingest import ensure_schema as ensure_song_schema
+from invalidation import invalidation_bus, tagged_cache
+from lyrics import LyricsStore, pick_encoding, resolve_lyrics
+from music_fetcher import MusicFetcher
+from play_events import PlayEventPipeline
+from ranking import TrendingRanker, HALF_LIFE_HOURS, RANKING_INTERVAL
+from recommender import Recommender, TOP_K, BUILD_INTERVAL
+from refresher import BackgroundRefresher
+from repository import (parse_page_args, playlist_songs, hot_songs, songs_by_ids, song_details, catalog_page,
+                        iter_catalog)
+from search_index import CatalogSearch
+from sidecar import SidecarBuilder
+from tags import read_cover
+from transcode import Transcoder, pick_bitrate
+from watcher import LibraryWatcher
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=3)
 CORS(app)
 cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache', 'CACHE_DEFAULT_TIMEOUT': 300})
+# 写入方发布 song:/playlist:/album:/artist:/cover: 标签的失效通知，各工作进程据此清理自己的缓存
+invalidations = invalidation_bus()
+invalidations.start()
 
 # 配置JWT
 app.config["JWT_SECRET_KEY"] = "super-secret"
@@ -106,6 +131,29 @@ def login():
         db.close()
 
 
+@app.route('/api/status/db', methods=['GET'])
+def db_pool_status():
+    """ 数据库连接池使用情况和等待统计 """
+    return jsonify(pool_stats() or {"message": "pool not initialized"}), 200
+
+
+@app.route('/api/status/http', methods=['GET'])
+def http_client_status():
+    """ 出站 HTTP 请求按上游主机的延迟、错误和熔断状态 """
+    return jsonify(http_client.stats()), 200
+
+
+@app.route('/api/status/cache', methods=['GET'])
+def disk_cache_status():
+    """ 磁盘缓存命中、未命中和淘汰统计 """
+    return jsonify({"search": search_cache.stats(), "song_info": song_info_cache.stats(),
+                    "search_refresh": search_refresher.stats(), "transcode": transcoder.stats(),
+                    "sidecar": sidecar_builder.stats(), "lyrics": lyrics_store.stats(),
+                    "play_events": play_events.stats(), "ranking": trending_ranker.stats(),
+                    "recommender": recommender.stats(), "catalog": catalog.stats(),
+                    "invalidation": invalidations.stats()}), 200
+
+
 @app.route('/protected')
 @jwt_required()
 def protected():
@@ -266,67 +314,98 @@ def login_status():
 @app.route('/api/Recommend', methods=['GET'])
 def api_Recommend():
     pageType = request.args.get('pageType') or 'al'
-    db = get_db_connection().get_connection()
-    cursor = db.cursor()
-
-    # 定义一个函数来执行查询并返回结果
-    def execute_query(query):
-        try:
-            cursor.execute(query)
-            results = cursor.fetchall()
-            if results:
-                return results
-        except Exception:
-            return 'error', 404
-        finally:
-            cursor.close()
-            db.close()
 
-    # 根据不同的 pageType 执行不同的查询
+    # 根据不同的 pageType 查询不同的列表
     if pageType == 'al':
-        return execute_query("SELECT AlbumID,Title,ReleaseDate FROM albums;")
+        return catalog_response('albums')
     elif pageType == 'pl':
-        return execute_query("SELECT PlaylistID,Name,Description FROM playlists;")
+        return catalog_response('playlists')
     else:
         return 'error', 404
 
 
-CACHE_DIR = 'temp/search'  # 缓存目录
+CACHE_DIR = os.path.join(base_dir, 'temp', 'search')  # 缓存目录
 CACHE_EXPIRY = 24 * 60 * 60  # 缓存过期时间，单位为秒（24小时）
+CACHE_STALE = 7 * 24 * 60 * 60  # 过期后仍可先返回旧数据的时间（7天）
+SEARCH_TIMEOUT = 3  # 首次搜索等待上游的时间（秒）
+search_cache = DiskCache(CACHE_DIR, ttl=CACHE_EXPIRY, stale_ttl=CACHE_STALE,
+                         max_bytes=int(os.getenv('SEARCH_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+search_cache.start()
+
+
+def refresh_search(kw):
+    """从API请求搜索结果并写入缓存"""
+    search_api_url = f'{API_URL}search?keywords={kw}'
+    response = http_client.get(search_api_url, timeout=SEARCH_TIMEOUT, retries=0)
+    data = response.json()
+    search_cache.set(kw, data)
+    return data
 
 
-@app.route('/api/search', methods=['GET'])
-def api_search():
-    kw = request.args.get('keyword')
-    if kw:
-        # 构建缓存文件路径
-        cache_file_path = os.path.join(CACHE_DIR, f"{kw}.json")
-
-        # 检查缓存文件是否存在及有效性
-        if os.path.exists(cache_file_path):
-            file_mod_time = os.path.getmtime(cache_file_path)
-            current_time = time.time()
-
-            # 如果缓存文件未过期，直接读取缓存
-            if (current_time - file_mod_time) < CACHE_EXPIRY:
-                with open(cache_file_path, 'r') as cache_file:
-                    data = json.load(cache_file)
-                return data
-
-        # 如果缓存无效或不存在，从API请求数据
+def search_needs_refresh(kw):
+    """缓存不存在或一小时内过期的关键字需要预热"""
+    _, expires = search_cache.get_entry(kw)
+    return expires is None or expires - time.time() < 60 * 60
+
+
+search_refresher = BackgroundRefresher(refresh_search, search_needs_refresh)
+search_refresher.start()
+
+# 旧库升级：补齐入库、同步和歌曲详情查询用到的 songs 列，需在曲库快照和搜索索引之前完成
+try:
+    ensure_song_schema()
+except Exception as e:
+    print('检查歌曲表结构失败:', e)
+
+catalog = Catalog(interval=int(os.getenv('CATALOG_CHECK_INTERVAL', CHECK_INTERVAL)),
+                  build=os.getenv('CATALOG_BUILD', '1') == '1',
+                  on_build=lambda path: invalidations.invalidate('catalog'))
+catalog.start()
+
+SEARCH_INDEX_SYNC_INTERVAL = int(os.getenv('SEARCH_INDEX_SYNC_INTERVAL', 60))  # 本地索引增量同步间隔（秒）
+catalog_search = CatalogSearch()
+
+
+def sync_search_index():
+    """后台线程：首次全量建立本地搜索索引，之后定期增量同步"""
+    while True:
         try:
-            search_api_url = f'{API_URL}search?keywords={kw}'
-            response = requests.get(search_api_url, timeout=3)  # 设置超时时间为3秒
-            data = response.json()
-            # print(data)
+            count = catalog_search.sync()
+            if count:
+                print(f'本地搜索索引同步了 {count} 首歌曲')
+        except Exception as e:
+            print('本地搜索索引同步失败:', e)
+        time.sleep(SEARCH_INDEX_SYNC_INTERVAL)
 
-            # 将新获取的数据写入缓存文件
-            os.makedirs(CACHE_DIR, exist_ok=True)  # 创建缓存目录（如果不存在）
-            with open(cache_file_path, 'w') as cache_file:
-                json.dump(data, cache_file)
 
-        except (requests.exceptions.Timeout, requests.exceptions.ProxyError):
-            data = {}
+threading.Thread(target=sync_search_index, daemon=True).start()
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    kw = request.args.get('keyword')
+    if not kw:
+        return {}
+
+    # 优先查本地曲库索引，未命中时才请求上游
+    if catalog_search.ready:
+        local_result = catalog_search.search(kw)
+        if local_result:
+            return local_result
+
+    search_refresher.record(kw)
+    data, expires = search_cache.get_entry(kw)
+    if data is not None:
+        # 缓存已过期时先返回旧数据，后台刷新
+        if expires < time.time():
+            search_refresher.schedule(kw)
+        return data
+
+    # 没有缓存时等待上游，同一关键字的并发请求只会请求一次
+    try:
+        data = search_refresher.refresh_now(kw, timeout=SEARCH_TIMEOUT)
+    except Exception:
+        data = {}
 
     return data
 
@@ -341,40 +420,42 @@ def api_singer():
             return jsonify({'error': 'No singer found'}), 404
         return jsonify({"歌手": singer_data})
 
-    all_singers = get_all_singer()
+    limit, cursor = parse_page_args(request.args)
+    if request.args.get('stream') == '1':
+        return stream_json_response(iter_catalog('singers', cursor), key="歌手")
+
+    all_singers, next_cursor = get_all_singer(limit, cursor)
     if isinstance(all_singers, dict) and all_singers.get('error'):
         return jsonify({'error': 'No singers found'}), 404
-    return jsonify({"歌手": all_singers})
+    result = {"歌手": all_singers}
+    if next_cursor:
+        result["nextCursor"] = next_cursor
+    return jsonify(result)
 
 
-def get_all_singer():
+def get_all_singer(limit=None, cursor=None):
     try:
-        db = get_db_connection().get_connection()
-        cursor = db.cursor()
-        query = "SELECT DISTINCT artists.ArtistID, artists.Name FROM songs INNER JOIN artists ON songs.ArtistID = artists.ArtistID;"
-        cursor.execute(query)
-        playlists = cursor.fetchall()
-        if playlists:
-            print(playlists)
-            return playlists  # 返回字典对象
+        singers, next_cursor = catalog_page('singers', limit, cursor)
+        if singers:
+            return singers, next_cursor
         else:
-            return {'error': 'No playlists found'}
+            return {'error': 'No playlists found'}, None
     except Exception as e:
-        return {'error': str(e)}
-    finally:
-        cursor.close()
-        db.close()
+        return {'error': str(e)}, None
 
 
 def singer_detail(uid):
     if uid:
+        # 优先读曲库快照，快照中还没有的歌手再查数据库
+        songs = catalog.artist_songs(int(uid)) if str(uid).isdigit() else None
+        if songs is not None:
+            return songs if songs else {'error': 'No playlists found'}
         try:
             db = get_db_connection().get_connection()
             cursor = db.cursor()
-            query = "SELECT songs.SongID, songs.Title, artists.Name FROM songs INNER JOIN artists ON songs.ArtistID = artists.ArtistID WHERE artists.ArtistID = {};".format(
-                uid)
+            query = "SELECT songs.SongID, songs.Title, artists.Name FROM songs INNER JOIN artists ON songs.ArtistID = artists.ArtistID WHERE artists.ArtistID = %s;"
             print(query)
-            cursor.execute(query)
+            cursor.execute(query, (uid,))
             playlists = cursor.fetchall()
             if playlists:
                 return playlists
@@ -389,13 +470,24 @@ def singer_detail(uid):
         return {'error': '歌手不存在'}
 
 
+def playlist_detail_tags(data):
+    """歌单/专辑详情依赖的标签：歌单或专辑本身，以及其中每首歌；专辑详情来自曲库快照，快照更新后也要失效"""
+    kind = 'playlist' if request.args.get('pageType') == 'pl' else 'album'
+    rows = (data or {}).get("歌曲列表") or []
+    tags = [f"{kind}:{request.args.get('pid')}"] + [f'song:{row[0]}' for row in rows if isinstance(row, list) and row]
+    return tags + ['catalog'] if kind == 'album' else tags
+
+
 @app.route('/api/Detail', methods=['GET'])
-@cache.cached(timeout=300, query_string=True)  # 使用缓存装饰器，并设置超时时间为300秒（5分钟）
+@tagged_cache(cache, invalidations, playlist_detail_tags)  # 按歌单、专辑、歌曲标签失效，可以缓存得更久
 def api_PlayListDetail():
     pid = request.args.get('pid')
     pageType = request.args.get('pageType')
     if pid and pageType == 'pl':
-        converted_playlist = {"歌曲列表": song_name(pid).json}
+        song_list = song_name(pid)
+        converted_playlist = {"歌曲列表": song_list.json}
+        if song_list.headers.get('X-Next-Cursor'):
+            converted_playlist["nextCursor"] = song_list.headers['X-Next-Cursor']
         return jsonify(converted_playlist)  # 使用 jsonify 返回 JSON 响应
     elif pid and pageType == 'al':
         converted_playlist = {"歌曲列表": album_detail(pid).json}
@@ -406,6 +498,9 @@ def api_PlayListDetail():
 
 def album_detail(pid):
     if pid:
+        songs = catalog.album_songs(int(pid)) if str(pid).isdigit() else None
+        if songs is not None:
+            return jsonify(songs)
         try:
             db = get_db_connection().get_connection()
             cursor = db.cursor()
@@ -453,41 +548,69 @@ def list_by_uid(uid, list_id):
     return abort(404, description="暂无推荐")
 
 
+trending_ranker = TrendingRanker(half_life_hours=float(os.getenv('RANKING_HALF_LIFE_HOURS', HALF_LIFE_HOURS)),
+                                 interval=int(os.getenv('RANKING_INTERVAL', RANKING_INTERVAL)))
+trending_ranker.start()
+
+
 @app.route('/api/toplist', methods=['GET'])
 def api_topLists():
-    db = get_db_connection().get_connection()
-    cursor = db.cursor()
+    limit, cursor = parse_page_args(request.args)
     try:
-        cursor.execute("SELECT TargetID FROM `hot` WHERE Type='SONG';")
-        results = cursor.fetchall()
-        hot_id_list = []
-        if results:
-            for i in results:
-                hot_id_list.append(i[0])
-            str_list = ','.join(str(x) for x in hot_id_list)
-            hot_song_list = song_name_list(str_list)
-            return jsonify(hot_song_list)
+        # 优先使用内存中的榜单快照，还没加载完成时查数据库
+        page = trending_ranker.page(limit, cursor)
+        hot_song_list, next_cursor = page if page is not None else hot_songs(limit, cursor)
     except Exception:
         return 'error', 404
-    finally:
-        cursor.close()
-        db.close()
+    return paged_response(hot_song_list, next_cursor)
 
 
-@app.route('/api/album', methods=['GET'])
-def api_album():
-    db = get_db_connection().get_connection()
-    cursor = db.cursor()
+def paged_response(rows, next_cursor):
+    """返回 JSON 列表，还有下一页时通过 X-Next-Cursor 响应头返回游标"""
+    response = jsonify(rows)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+STREAM_BATCH_ROWS = 200  # 流式输出时每次发送的行数
+
+
+def stream_json_response(rows, key=None):
+    """边读边序列化输出 JSON 数组，传 key 时输出 {key: [...]}"""
+
+    def generate():
+        yield '{' + app.json.dumps(key) + ':[' if key else '['
+        batch = []
+        first = True
+        for row in rows:
+            batch.append(app.json.dumps(row))
+            if len(batch) >= STREAM_BATCH_ROWS:
+                yield ('' if first else ',') + ','.join(batch)
+                first = False
+                batch = []
+        if batch:
+            yield ('' if first else ',') + ','.join(batch)
+        yield ']}' if key else ']'
+
+    return Response(generate(), mimetype='application/json')
+
+
+def catalog_response(name):
+    """目录列表：stream=1 时流式输出完整列表，否则按 limit/cursor 分页"""
+    limit, cursor = parse_page_args(request.args)
+    if request.args.get('stream') == '1':
+        return stream_json_response(iter_catalog(name, cursor))
     try:
-        cursor.execute("SELECT AlbumID,Title,ReleaseDate FROM albums;")
-        results = cursor.fetchall()
-        if results:
-            return results
+        rows, next_cursor = catalog_page(name, limit, cursor)
     except Exception:
         return 'error', 404
-    finally:
-        cursor.close()
-        db.close()
+    return paged_response(rows, next_cursor)
+
+
+@app.route('/api/album', methods=['GET'])
+def api_album():
+    return catalog_response('albums')
 
 
 @app.route('/api/userSongList', methods=['GET'])
@@ -615,6 +738,18 @@ base_dir = os.path.dirname(os.path.abspath(__file__))
 musics_dir = os.path.join(base_dir, 'storage')
 
 
+sidecar_builder = SidecarBuilder(workers=int(os.getenv('SIDECAR_WORKERS', 2)),
+                                 lyrics_fallback=lambda song_id: online_lyrics(song_id))
+sidecar_builder.store.start()
+# 歌曲重新入库或歌词被编辑后删除旧的元数据副本，/api/song_meta 下次请求时重新生成
+invalidations.on('song', lambda song_id: sidecar_builder.invalidate(song_id))
+
+# 设置 LIBRARY_WATCH=1 时在进程内监听 storage 目录，新文件入库后立即同步搜索索引（多进程部署时只在一个进程开启）
+if os.getenv('LIBRARY_WATCH', '0') == '1':
+    LibraryWatcher(musics_dir, on_ingested=lambda count: catalog_search.sync(), sidecars=sidecar_builder,
+                   invalidations=invalidations).start()
+
+
 def file_exists(path):
     """检查文件是否存在"""
     return os.path.exists(path)
@@ -624,7 +759,7 @@ def download_music_file(id, music_file_path):
     """从外链下载音乐文件并保存到本地"""
     download_url = f"http://music.163.com/song/media/outer/url?id={id}"
     try:
-        response = requests.get(download_url, stream=True)
+        response = http_client.get(download_url, stream=True)
         response.raise_for_status()  # 检查请求是否成功
 
         # 创建存储目录（如果不存在）
@@ -645,9 +780,12 @@ def download_music_file(id, music_file_path):
 def fetch_song_from_db(db, song_id):
     """从数据库查找音乐文件路径"""
     cursor = db.cursor()
-    query = "SELECT FilePath FROM songs WHERE SongID = %s;"
-    cursor.execute(query, (song_id,))
-    return cursor.fetchone()
+    try:
+        query = "SELECT FilePath FROM songs WHERE SongID = %s;"
+        cursor.execute(query, (song_id,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
 
 
 def insert_song_into_db(db, song_id, song_name, song_cover, song_lrc):
@@ -665,62 +803,248 @@ def insert_song_into_db(db, song_id, song_name, song_cover, song_lrc):
         db.rollback()  # 如果插入失败，执行回滚操作
     else:
         db.commit()  # 提交事
+        catalog_search.add_song(song_id, song_name)  # 新歌立即加入本地搜索索引
+
+
+def local_song_path(id):
+    """返回歌曲的本地文件路径：先找 storage 下的缓存，再查数据库，都不存在时返回 None"""
+    music_file_path = os.path.join(musics_dir, f"{id}.mp3")
+    if file_exists(music_file_path):
+        return music_file_path
+
+    # 从数据库查找音乐文件路径，查询完立即归还连接
+    with get_db_connection().get_connection() as db:
+        music_file_path_from_db = fetch_song_from_db(db, id)
+    if music_file_path_from_db and music_file_path_from_db[0] and file_exists(music_file_path_from_db[0]):
+        return music_file_path_from_db[0]
+    return None
+
+
+def recorded_format(id, source_path):
+    """入库时记录的 (码率 kbps, 编码格式)；记录的文件不是 source_path 或没有记录时返回 (None, None)，由转码器探测"""
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT FilePath, Bitrate, Codec FROM songs WHERE SongID = %s", (id,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+    if not row or row[0] != source_path or not row[1]:
+        return None, None
+    return row[1], row[2]
 
 
 @app.route('/music/<int:id>.mp3')
 def file(id):
     """处理音乐文件请求"""
-    music_file_path = os.path.join(musics_dir, f"{id}.mp3")
-
-    # 检查本地音乐文件是否存在
-    if file_exists(music_file_path):
+    music_file_path = local_song_path(id)
+    if music_file_path:
         print('正在请求的是', id)
-        return send_file(music_file_path, mimetype="audio/mp3")
-
-    # 从数据库查找音乐文件路径
-    db = get_db_connection().get_connection()  # 获取连接
-    music_file_path_from_db = fetch_song_from_db(db, id)
-
-    # 检查数据库返回的文件路径
-    if music_file_path_from_db:
-        music_file_path_from_db = music_file_path_from_db[0]
-        if file_exists(music_file_path_from_db):
-            print('正在重新请求的是', id)
-            return send_file(music_file_path_from_db, mimetype="audio/mp3")
-    db.close()  # 确保在函数结束时关闭连接
+        return send_audio(music_file_path, mimetype=audio_mimetype(music_file_path))
     # 如果未找到音乐文件，尝试从外部API获取
-    return play_music_data_from_api(id, music_file_path)  # 将本地路径传递给函数
+    return play_music_data_from_api(id, os.path.join(musics_dir, f"{id}.mp3"))  # 将本地路径传递给函数
 
 
-def play_music_data_from_api(song_id, local_file_path):
-    """从API获取音乐数据并保存到本地"""
-    byfuns_url = f"https://www.byfuns.top/api/1/?id={song_id}"
+TRANSCODE_DIR = os.path.join(base_dir, 'temp', 'renditions')
+transcoder = Transcoder(TRANSCODE_DIR, max_bytes=int(os.getenv('TRANSCODE_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024)),
+                        workers=int(os.getenv('TRANSCODE_WORKERS', 2)))
 
+
+@app.route('/rendition/<int:id>.mp3')
+def rendition(id):
+    """按 br 参数（64/128/192 kbps）返回低码率版本，弱网客户端使用；无法转码时返回原文件"""
     try:
-        # 从API获取音乐的直链
-        response = requests.get(byfuns_url)
-
-        if response.status_code == 200:
-            music_url = response.text.strip()  # 假设API返回的是直接的音乐链接
-
-            # 从音乐链接下载音乐数据
-            music_response = requests.get(music_url)
-            if music_response.status_code == 200:
-                # 将音乐文件保存到指定位置
-                with open(local_file_path, 'wb') as f:
-                    f.write(music_response.content)
-                # 返回下载的文件
-                return send_file(local_file_path, mimetype="audio/mp3")
-            else:
-                print(f"Failed to download the music file from {music_url}. Status Code: {music_response.status_code}")
-                return jsonify({"error": "无法下载音乐文件"}), 500  # 返回500错误，明确告知下载失败
-        else:
-            print(f"Failed to get music URL from API. Status Code: {response.status_code}")
-            return jsonify({"error": "无法获取音乐链接"}), 500  # 返回500错误
+        bitrate = pick_bitrate(int(request.args.get('br', 128)))
+    except ValueError:
+        return jsonify({"error": "br 参数无效"}), 400
+
+    source_path = local_song_path(id)
+    if source_path is None:
+        # 本地还没有这首歌，先走在线获取，下载完成后再请求即可得到转码版本
+        return file(id)
+    try:
+        source_bitrate, codec = recorded_format(id, source_path)
+    except Exception as e:
+        print('查询歌曲码率失败:', e)
+        source_bitrate, codec = None, None
+    if not transcoder.needs_transcode(source_path, bitrate, source_bitrate, codec):
+        return send_audio(source_path, mimetype=audio_mimetype(source_path))
 
+    try:
+        rendition_path = transcoder.get(id, source_path, bitrate)
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return jsonify({"error": "发生错误"}), 500
+        print(f'转码失败 {id}@{bitrate}k:', e)
+        rendition_path = None
+    if rendition_path is None:
+        # 转码超时或失败时先返回原文件，不让客户端一直等待
+        return send_audio(source_path, mimetype=audio_mimetype(source_path))
+    return send_audio(rendition_path, mimetype="audio/mp3")
+
+
+hls_packager = HlsPackager(transcoder)
+HLS_PLAYLIST_MAX_AGE = 60  # 播放列表缓存时间（秒）
+HLS_SEGMENT_MAX_AGE = 365 * 24 * 60 * 60  # 分片地址带原文件签名，内容不会变化
+
+
+def hls_source(id):
+    """HLS 接口共用：返回本地文件路径，或者 (错误响应, 状态码)"""
+    if not hls_packager.available:
+        return None, (jsonify({"error": "HLS 不可用，请使用 /music/<id>.mp3"}), 503)
+    source_path = local_song_path(id)
+    if source_path is None:
+        # 本地还没有这首歌：后台开始在线获取，客户端稍后重试
+        music_fetcher.fetch(id, os.path.join(musics_dir, f"{id}.mp3"))
+        response = jsonify({"error": "歌曲准备中，请稍后重试"})
+        response.headers['Retry-After'] = '2'
+        return None, (response, 503)
+    return source_path, None
+
+
+@app.route('/hls/<int:id>/master.m3u8')
+def hls_master(id):
+    """HLS 主播放列表，列出 64/128/192 kbps 三档，播放器按网络情况切换"""
+    source_path, error = hls_source(id)
+    if error:
+        return error
+    response = Response(hls_packager.master_playlist(), mimetype=PLAYLIST_MIMETYPE)
+    response.headers['Cache-Control'] = f'public, max-age={HLS_PLAYLIST_MAX_AGE}'
+    return response
+
+
+@app.route('/hls/<int:id>/<int:br>/index.m3u8')
+def hls_media(id, br):
+    if br not in hls_packager.bitrates:
+        abort(404)
+    source_path, error = hls_source(id)
+    if error:
+        return error
+    try:
+        playlist = hls_packager.media_playlist(id, source_path, br)
+    except Exception as e:
+        print(f'生成 HLS 播放列表失败 {id}/{br}:', e)
+        return jsonify({"error": "生成播放列表失败"}), 500
+    if playlist is None:
+        response = jsonify({"error": "播放列表生成中，请稍后重试"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    response = Response(playlist, mimetype=PLAYLIST_MIMETYPE)
+    response.headers['Cache-Control'] = f'public, max-age={HLS_PLAYLIST_MAX_AGE}'
+    return response
+
+
+@app.route('/hls/<int:id>/<int:br>/<segment>.ts')
+def hls_segment(id, br, segment):
+    """HLS 分片：第一次请求时生成，之后作为不可变对象交给 CDN/nginx 缓存"""
+    match = SEGMENT_NAME_RE.match(segment)
+    if br not in hls_packager.bitrates or not match:
+        abort(404)
+    source_path, error = hls_source(id)
+    if error:
+        return error
+    try:
+        segment_path = hls_packager.segment(id, source_path, br, match.group(1), int(match.group(2)))
+    except LookupError:
+        abort(404)  # 原文件已变化，播放器重新拉取播放列表即可
+    except Exception as e:
+        print(f'生成 HLS 分片失败 {id}/{br}/{segment}:', e)
+        return jsonify({"error": "生成分片失败"}), 500
+    if segment_path is None:
+        response = jsonify({"error": "分片生成中，请稍后重试"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    response = send_audio(segment_path, mimetype=SEGMENT_MIMETYPE)
+    response.headers['Cache-Control'] = f'public, max-age={HLS_SEGMENT_MAX_AGE}, immutable'
+    return response
+
+
+TRANSCODE_PREWARM_TOP = int(os.getenv('TRANSCODE_PREWARM_TOP', 0))  # 预转码热门榜前 N 首，0 表示不预转码
+TRANSCODE_PREWARM_INTERVAL = 6 * 60 * 60
+
+
+def prewarm_renditions():
+    """后台线程：定期为 hot 表中最热门的歌曲预先生成各档码率"""
+    while True:
+        try:
+            rows, _ = hot_songs(limit=TRANSCODE_PREWARM_TOP)
+            items = [(row[0], local_song_path(row[0])) for row in rows]
+            transcoder.prewarm([(song_id, path) + recorded_format(song_id, path) for song_id, path in items if path])
+        except Exception as e:
+            print('预转码热门歌曲失败:', e)
+        time.sleep(TRANSCODE_PREWARM_INTERVAL)
+
+
+if TRANSCODE_PREWARM_TOP > 0 and transcoder.available:
+    threading.Thread(target=prewarm_renditions, daemon=True).start()
+
+
+MUSIC_URL_API = os.getenv('MUSIC_URL_API', 'https://www.byfuns.top/api/1/?id={}')  # 返回音乐直链的API
+FETCH_START_TIMEOUT = 15  # 等待上游开始返回数据的最长时间（秒）
+
+
+def resolve_music_url(song_id):
+    """从API获取音乐的直链"""
+    response = http_client.get(MUSIC_URL_API.format(song_id))
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Failed to get music URL from API. Status Code: {response.status_code}")
+    return response.text.strip()  # 假设API返回的是直接的音乐链接
+
+
+music_fetcher = MusicFetcher(resolve_music_url, session=http_client)
+
+
+def play_music_data_from_api(song_id, local_file_path):
+    """从API获取音乐数据，同一首歌的并发请求共享一个下载，边下载边返回给客户端"""
+    download = music_fetcher.fetch(song_id, local_file_path)
+
+    if not download.wait_started(FETCH_START_TIMEOUT):
+        if download.error is None:
+            return jsonify({"error": "获取音乐文件超时"}), 504
+        print(f"An error occurred: {download.error}")
+        return jsonify({"error": "无法下载音乐文件"}), 500  # 返回500错误，明确告知下载失败
+
+    if download.done and file_exists(local_file_path):
+        return send_audio(local_file_path, mimetype="audio/mp3")
+
+    # 下载进行中，边下载边转发
+    headers = {'Cache-Control': 'no-store'}
+    if download.total is not None:
+        headers['Content-Length'] = str(download.total)
+    return Response(download.iter_bytes(), mimetype="audio/mp3", headers=headers, direct_passthrough=True)
+
+
+COVER_MAX_AGE = 24 * 60 * 60  # 按歌曲ID访问的封面版本缓存时间（秒）
+RENDITION_MAX_AGE = 365 * 24 * 60 * 60  # 按内容哈希访问的封面版本缓存时间（秒）
+RENDITION_NAME_RE = re.compile(r'^[0-9a-f]{16}_\d+\.(jpg|webp|avif)$')
+cover_renditions = CoverRenditions(os.path.join(base_dir, 'cover', 'renditions'))
+
+
+def send_cover(cover_path):
+    """发送封面；带 ?size= 时返回对应尺寸的版本，格式按 Accept 协商，版本还没生成好时先返回原图"""
+    size = request.args.get('size', type=int)
+    if size:
+        fmt = cover_renditions.negotiate(request.headers.get('Accept'))
+        rendition = cover_renditions.render(cover_path, size, fmt)
+        if rendition:
+            name, path = rendition
+            response = send_file(path, mimetype=COVER_MIMETYPES[fmt], etag=name, max_age=COVER_MAX_AGE)
+            response.headers['Vary'] = 'Accept'
+            response.headers['Content-Location'] = f'/cover/r/{name}'
+            return response
+    return send_file(cover_path, mimetype=source_mimetype(cover_path))
+
+
+@app.route('/cover/r/<name>')
+def cover_rendition(name):
+    """按内容哈希命名的封面版本，内容不会变化，可以长期缓存"""
+    if not RENDITION_NAME_RE.match(name):
+        abort(404)
+    path = cover_renditions.path(name)
+    if not os.path.exists(path):
+        abort(404)
+    mimetype = COVER_MIMETYPES['jpeg' if name.endswith('.jpg') else name.rsplit('.', 1)[1]]
+    response = send_file(path, mimetype=mimetype, etag=name, max_age=RENDITION_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route('/singer/<id>.png')
@@ -729,14 +1053,14 @@ def singer_img(id):
     cover_file_path = os.path.join(covers_dir, f'{id}.png')
 
     if os.path.exists(cover_file_path):
-        return send_file(cover_file_path, mimetype='image/png')
+        return send_cover(cover_file_path)
 
     cover_file_path1 = get_cover_from_file(id, covers_dir)
     if cover_file_path1:
-        return send_file(cover_file_path1, mimetype='image/png')
+        return send_cover(cover_file_path1)
 
     default_cover_path = os.path.join(covers_dir, '0.png')
-    return send_file(default_cover_path, mimetype='image/png')
+    return send_cover(default_cover_path)
 
 
 def get_cover_from_api(song_id, local_file_path):
@@ -746,12 +1070,12 @@ def get_cover_from_api(song_id, local_file_path):
 
     try:
         # 从API获取音乐cover
-        music_cover = requests.get(url)
+        music_cover = http_client.get(url)
         if music_cover.status_code == 200:
             with open(local_file_path, 'wb') as f:
                 f.write(music_cover.content)
             # 返回下载的文件
-            return send_file(local_file_path, mimetype='image/png')
+            return send_cover(local_file_path)
         else:
             print(f"Failed to download the music file from {url}. Status Code: {music_cover.status_code}")
             return jsonify({"error": "无法下载音乐文件"}), 500  # 返回500错误，明确告知下载失败
@@ -760,38 +1084,53 @@ def get_cover_from_api(song_id, local_file_path):
         return jsonify({"error": "发生错误"}), 500
 
 
+def remove_extracted_cover(song_id):
+    """删除从音频文件提取的封面，下次请求时重新提取；封面版本按内容哈希命名，不需要清理"""
+    if song_id.isdigit() and int(song_id) <= 100000:
+        for ext in SOURCE_MIMETYPES:
+            try:
+                os.remove(os.path.join(base_dir, 'cover', f'{song_id}.{ext}'))
+            except FileNotFoundError:
+                pass
+
+
+invalidations.on('cover', remove_extracted_cover)
+
+
 @app.route('/music_cover/<int:id>.png')
 def cover_file(id):
     covers_dir = os.path.join(base_dir, 'cover')
     cover_file_path = os.path.join(covers_dir, f'{id}.png')  # 使用 'id' 作为文件名
     if os.path.exists(cover_file_path):
-        return send_file(cover_file_path, mimetype='image/png')
+        return send_cover(cover_file_path)
     if id > 100000:
         return get_cover_from_api(id, cover_file_path)
     else:
         cover_file_path1 = get_cover_from_file(id, covers_dir)
         if cover_file_path1:
-            return send_file(cover_file_path1, mimetype='image/png')
+            return send_cover(cover_file_path1)
 
         default_cover_path = os.path.join(covers_dir, '0.png')
-        return send_file(default_cover_path, mimetype='image/png')
+        return send_cover(default_cover_path)
 
 
-def get_song_info(song_id):
-    cache_file_path = f'temp/info_{song_id}.json'
+SONG_INFO_EXPIRY = 3 * 24 * 60 * 60  # 歌曲信息缓存三天
+song_info_cache = DiskCache(os.path.join(base_dir, 'temp', 'info'), ttl=SONG_INFO_EXPIRY,
+                            max_bytes=int(os.getenv('SONG_INFO_CACHE_MAX_BYTES', 256 * 1024 * 1024)))
+song_info_cache.start()
 
-    # 检查缓存文件是否存在以及是否有效（有效期为三天）
-    if os.path.exists(cache_file_path):
-        file_mod_time = os.path.getmtime(cache_file_path)
-        if time.time() - file_mod_time < 3 * 24 * 60 * 60:  # 三天有效期
-            with open(cache_file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+
+def get_song_info(song_id):
+    # 检查缓存是否存在以及是否有效（有效期为三天）
+    cached = song_info_cache.get(str(song_id))
+    if cached is not None:
+        return cached
 
     # 如果缓存不存在或已过期，发送请求获取数据
     url = f"https://api.paugram.com/netease/?id={song_id}"
 
     try:
-        response = requests.get(url)
+        response = http_client.get(url)
         response_json = response.json()
 
         if 'id' in response_json:  # 检查返回的 JSON 是否包含 id
@@ -801,10 +1140,8 @@ def get_song_info(song_id):
                       'lyric': song_info.get('lyric', ''),  # 使用 get 方法以防缺少字段
                       'sub_lyric': song_info.get('sub_lyric', '')}
 
-            # 将数据写入缓存文件
-            os.makedirs(os.path.dirname(cache_file_path), exist_ok=True)  # 确保目录存在
-            with open(cache_file_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, ensure_ascii=False, indent=4)
+            # 将数据写入缓存
+            song_info_cache.set(str(song_id), result)
 
             return result
         else:
@@ -814,44 +1151,41 @@ def get_song_info(song_id):
         return {'error': str(e)}
 
 
-def get_cover_from_file(id, covers_dir):
-    # 生成封面文件路径
-    cover_file_path = os.path.join(covers_dir, f'{id}.png')
+def extracted_cover_path(id, covers_dir):
+    """已经从音频文件提取出的封面原图路径（扩展名随原格式），不存在时返回 None"""
+    for ext in SOURCE_MIMETYPES:
+        cover_file_path = os.path.join(covers_dir, f'{id}.{ext}')
+        if os.path.exists(cover_file_path):
+            return cover_file_path
+    return None
 
-    # 检查封面文件是否已经存在
-    if os.path.exists(cover_file_path):
-        return cover_file_path
 
-    # 获取数据库连接
-    db = get_db_connection().get_connection()
-    cursor = db.cursor()
-    query = "SELECT FilePath FROM songs WHERE SongID = %s;"
+def get_cover_from_file(id, covers_dir):
+    # 检查封面文件是否已经提取过
+    cover_file_path = extracted_cover_path(id, covers_dir)
+    if cover_file_path:
+        return cover_file_path
 
-    # 执行查询并获取结果
-    cursor.execute(query, (id,))
-    song_file_path = cursor.fetchone()
+    # 查询歌曲文件路径，查询完立即归还连接
+    with get_db_connection().get_connection() as db:
+        song_file_path = fetch_song_from_db(db, id)
 
     if song_file_path and song_file_path[0]:  # 确保结果存在并且不是 None
         song_file_path = song_file_path[0]  # 提取路径字符串
         if os.path.exists(song_file_path):  # 检查音频文件是否存在
-            audio = MP3(song_file_path, ID3=ID3)
-            for tag in audio.tags.values():
-                if isinstance(tag, APIC):
-                    cover_data = tag.data
-                    cover_mime = tag.mime
-
-                    if cover_mime == 'image/jpeg':  # 如果封面是 JPEG 格式，转换为 PNG 格式
-                        img = Image.open(BytesIO(cover_data))
-                        png_buffer = BytesIO()
-                        img.save(png_buffer, format='PNG')
-                        png_data = png_buffer.getvalue()
-                        with open(cover_file_path, 'wb') as f:
-                            f.write(png_data)
-                        return cover_file_path
-                    elif cover_mime == 'image/png':  # 如果封面已经是 PNG 格式，直接返回
-                        with open(cover_file_path, 'wb') as f:
-                            f.write(cover_data)
-                        return cover_file_path
+            cover = read_cover(song_file_path)  # 支持 MP3、FLAC、M4A、OGG/Opus 的内嵌封面
+            if cover:
+                cover_data, cover_mime = cover
+                ext = SOURCE_EXTENSIONS.get((cover_mime or '').lower())
+                if ext:  # 常见格式按原样保存，原图不重新编码，尺寸版本由 cover_renditions 生成
+                    cover_file_path = os.path.join(covers_dir, f'{id}.{ext}')
+                    with open(cover_file_path, 'wb') as f:
+                        f.write(cover_data)
+                else:  # 浏览器不一定支持的格式（BMP、TIFF 等）转换为 PNG
+                    cover_file_path = os.path.join(covers_dir, f'{id}.png')
+                    with Image.open(BytesIO(cover_data)) as img:
+                        img.save(cover_file_path, format='PNG')
+                return cover_file_path
 
     return None  # 如果没有找到封面，返回 None
 
@@ -865,9 +1199,52 @@ async def async_db_connection():
         db.close()
 
 
+MUSIC_INFO_BATCH_MAX = 500
+SONG_DETAIL_CACHE_TIMEOUT = 300
+
+
+invalidations.on('song', lambda song_id: cache.delete(f'song_detail:{song_id}'))
+
+
+def cached_song_details(song_ids):
+    """先查进程内的单曲缓存，只有未命中的歌曲才查数据库；返回 {歌曲ID: 歌曲信息}"""
+    keys = [f'song_detail:{song_id}' for song_id in song_ids]
+    details = {song_id: detail for song_id, detail in zip(song_ids, cache.get_many(*keys)) if detail is not None}
+    missing = [song_id for song_id in song_ids if song_id not in details]
+    if missing:
+        fetched = song_details(missing)
+        cache.set_many({f'song_detail:{song_id}': detail for song_id, detail in fetched.items()},
+                       timeout=SONG_DETAIL_CACHE_TIMEOUT)
+        details.update(fetched)
+    return details
+
+
+@app.route('/music_info/batch')
+def music_info_batch():
+    """批量获取歌曲信息：/music_info/batch?ids=1,2,3，返回歌手名和专辑名；按传入顺序返回，不存在的ID放在 missing 中"""
+    try:
+        song_ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        return jsonify({"code": 400, "error": "ids 参数无效"}), 400
+    if not song_ids or len(song_ids) > MUSIC_INFO_BATCH_MAX:
+        return jsonify({"code": 400, "error": f"ids 需要 1-{MUSIC_INFO_BATCH_MAX} 个歌曲ID"}), 400
+
+    try:
+        details = cached_song_details(song_ids)
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"code": 500, "error": "获取歌曲信息失败"}), 500
+
+    return jsonify({"code": 200, "songs": [details[song_id] for song_id in song_ids if song_id in details],
+                    "missing": [song_id for song_id in song_ids if song_id not in details]})
+
+
 @app.route('/music_info/<int:id>')
 def music_info(id):
     if id:
+        song_info = catalog.song_info(id)
+        if song_info is not None:
+            return jsonify(song_info)
         try:
             with get_db_connection().get_connection() as db:  # 假设你有一个同步的数据库连接函数 db_connection
                 cursor = db.cursor()
@@ -902,6 +1279,98 @@ def music_info(id):
         return jsonify({"error": "Invalid song id"})
 
 
+play_events = PlayEventPipeline(os.path.join(base_dir, 'temp', 'play_events'),
+                                flush_interval=int(os.getenv('PLAY_EVENTS_FLUSH_INTERVAL', 5)))
+play_events.start()
+PLAY_EVENTS_MAX_BATCH = 100
+
+
+def current_user_id():
+    """登录用户的ID：优先 JWT，其次会话，未登录返回 None"""
+    try:
+        verify_jwt_in_request(optional=True)
+        identity = get_jwt_identity()
+    except Exception:
+        identity = None
+    return identity or session.get('user_id')
+
+
+@app.route('/api/play', methods=['POST'])
+def api_play():
+    """播放器上报播放事件：{"id": 歌曲ID, "ms": 已播放毫秒数} 或 {"events": [...]}，异步聚合写库"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"code": 400, "error": "播放事件格式无效"}), 400
+    events = data['events'] if isinstance(data.get('events'), list) else [data]
+    if not events or len(events) > PLAY_EVENTS_MAX_BATCH:
+        return jsonify({"code": 400, "error": f"一次最多上报 {PLAY_EVENTS_MAX_BATCH} 条播放事件"}), 400
+
+    # 先校验整批事件，全部有效后再记录：否则前面的事件已经计入，客户端重试整批时会重复计数
+    parsed = []
+    try:
+        for event in events:
+            played_ms = event.get('ms')
+            parsed.append((int(event['id']), int(played_ms) if played_ms is not None else None))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"code": 400, "error": "播放事件格式无效"}), 400
+
+    user_id = current_user_id()
+    accepted = sum(play_events.record(song_id, user_id, played_ms) for song_id, played_ms in parsed)
+    return jsonify({"code": 202, "accepted": accepted}), 202
+
+
+SONG_META_MAX_IDS = 200
+SONG_META_MAX_AGE = 60 * 60
+
+
+def schedule_sidecars(song_ids):
+    """为还没有元数据副本的歌曲在后台生成副本"""
+    rows = {}
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            placeholders = ','.join(['%s'] * len(song_ids))
+            cursor.execute(f"SELECT SongID, FilePath, Lyrics, CoverImagePath FROM songs WHERE SongID IN ({placeholders})",
+                           list(song_ids))
+            rows = {row[0]: row for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+    items = []
+    for song_id in song_ids:
+        _, file_path, lyrics, cover_path = rows.get(song_id, (song_id, None, None, None))
+        if not file_path or not file_exists(file_path):
+            file_path = os.path.join(musics_dir, f"{song_id}.mp3")
+        if file_exists(file_path):
+            items.append((song_id, file_path, lyrics, cover_path))
+    sidecar_builder.submit(items)
+
+
+@app.route('/api/song_meta')
+def song_meta():
+    """批量获取歌曲的元数据副本（时长、码率、波形峰值、歌词时间轴、封面哈希）：/api/song_meta?ids=1,2,3
+    还没生成的歌曲返回 null，并在后台开始生成"""
+    try:
+        song_ids = list(dict.fromkeys(int(i) for i in request.args.get('ids', '').split(',') if i.strip()))
+    except ValueError:
+        return jsonify({"code": 400, "error": "ids 参数无效"}), 400
+    if not song_ids or len(song_ids) > SONG_META_MAX_IDS:
+        return jsonify({"code": 400, "error": f"ids 需要 1-{SONG_META_MAX_IDS} 个歌曲ID"}), 400
+
+    sidecars = sidecar_builder.get_many(song_ids)
+    missing = [song_id for song_id, sidecar in sidecars.items() if sidecar is None]
+    if missing:
+        try:
+            schedule_sidecars(missing)
+        except Exception as e:
+            print('安排生成元数据副本失败:', e)
+
+    response = jsonify({"code": 200, "data": {str(song_id): sidecar for song_id, sidecar in sidecars.items()}})
+    # 全部命中时可以缓存，有缺失时让客户端稍后重新获取
+    response.headers['Cache-Control'] = f'public, max-age={SONG_META_MAX_AGE}' if not missing else 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
 @app.route('/api/lrc/<int:song_id>')
 def get_lrc(song_id):
     if song_id:
@@ -923,11 +1392,11 @@ def get_lrc(song_id):
                     return response
 
                 else:
-                    tmp_file_dir = os.path.join(base_dir, 'temp', f'info_{song_id}.json')
-                    with open(tmp_file_dir, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        lrc_content = data['lyric']
-                        save_lyrics(lrc_content, song_id)
+                    data = song_info_cache.get(str(song_id))
+                    if not data or not data.get('lyric'):
+                        return make_response("Lyrics not found.", 404)
+                    lrc_content = data['lyric']
+                    save_lyrics(lrc_content, song_id)
 
                     response = make_response(lrc_content)
                     response.headers.set('Content-Disposition', 'attachment', filename=f"{song_id}.lrc")
@@ -943,26 +1412,80 @@ def save_lyrics(lyrics, song_id):
     lrc_file_dir = os.path.join(base_dir, 'lrc', f'{song_id}.lrc')
     with open(lrc_file_dir, 'w', encoding='utf-8') as f:
         f.write(lyrics)
+    lyrics_store.invalidate(song_id)
+    invalidations.invalidate(f'song:{song_id}')
 
 
-def song_name_list(ids):
-    if ids:
-        db = get_db_connection().get_connection()
+def load_song_lyrics(song_id):
+    with get_db_connection().get_connection() as db:
         cursor = db.cursor()
         try:
-            print(ids)
-            query = "SELECT songs.SongID, songs.Title, artists.Name FROM songs JOIN artists ON songs.ArtistID = artists.ArtistID WHERE songs.SongID IN ({})".format(
-                ids)
+            cursor.execute("SELECT Lyrics FROM songs WHERE SongID = %s;", (song_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+        finally:
+            cursor.close()
 
-            cursor.execute(query)
-            song_data = cursor.fetchall()
-            print(song_data)
-            return song_data
+
+def online_lyrics(song_id, key='lyric'):
+    return (song_info_cache.get(str(song_id)) or {}).get(key)
+
+
+def load_lyric_sources(song_id):
+    """返回 (LRC 原文, 翻译 LRC)：原文按 resolve_lyrics 的优先级查 lrc/<id>.lrc、songs.Lyrics、歌曲信息缓存，
+    与元数据副本一致；翻译来自歌曲信息缓存的 sub_lyric"""
+    text = resolve_lyrics(song_id, lambda: load_song_lyrics(song_id), lambda: online_lyrics(song_id))
+    return text, online_lyrics(song_id, 'sub_lyric')
+
+
+lyrics_store = LyricsStore(load_lyric_sources, max_items=int(os.getenv('LYRICS_CACHE_ITEMS', 2000)))
+invalidations.on('song', lambda song_id: lyrics_store.invalidate(int(song_id)))
+LYRICS_MAX_AGE = 60 * 60
+
+
+@app.route('/api/lyrics/<int:song_id>')
+def get_lyrics(song_id):
+    """解析后的歌词 [[毫秒, 歌词, 翻译], ...]；传 t=播放位置(毫秒) 时只返回当前行前后 before/after 行"""
+    try:
+        position = request.args.get('t', type=int)
+        before = min(max(request.args.get('before', 2, type=int), 0), 50)
+        after = min(max(request.args.get('after', 5, type=int), 0), 50)
+        lyrics = lyrics_store.get(song_id)
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"code": 500, "error": "获取歌词失败"}), 500
+    if lyrics is None:
+        return jsonify({"code": 404, "error": "Lyrics not found."}), 404
+
+    if position is not None:
+        index, start, lines = lyrics.window(position, before, after)
+        response = jsonify({"code": 200, "index": index, "start": start, "total": len(lyrics), "lines": lines})
+        response.headers['Cache-Control'] = f'public, max-age={LYRICS_MAX_AGE}'
+        response.add_etag()
+        return response.make_conditional(request)
+
+    # 完整歌词：同一份歌词不论压缩方式都用同一个弱 ETag
+    etag = lyrics.etag
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': f'public, max-age={LYRICS_MAX_AGE}',
+               'Vary': 'Accept-Encoding'}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    encoding = pick_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(lyrics.body(encoding), mimetype='application/json', headers=headers)
+
+
+def song_name_list(ids):
+    if ids:
+        try:
+            song_ids = [int(song_id) for song_id in str(ids).split(',')]
+            rows, missing = catalog.songs_by_ids(song_ids)
+            if missing:
+                rows.update((row[0], row) for row in songs_by_ids(missing))
+            return [rows[song_id] for song_id in song_ids if song_id in rows]
         except Exception as e:
             return 'error', 404
-        finally:
-            cursor.close()
-            db.close()
 
 
 @app.route('/song/name/', methods=['GET'])
@@ -973,25 +1496,13 @@ def song_name(id=0, pid=0, uid=0):
         song_data = song_name_list(id)
         return jsonify(song_data)
     if pid:
-        db = get_db_connection().get_connection()
-        cursor = db.cursor()
+        # 一次 JOIN 查询，按加入歌单的顺序返回，传 limit/cursor 时分页
+        limit, cursor = parse_page_args(request.args)
         try:
-            query = "SELECT SongID FROM `playlist_songs` WHERE PlayListID = {}".format(pid)
-            print(query)
-            cursor.execute(query)
-            list_data = cursor.fetchall()
-            playlist = []
-            for i in list_data:
-                playlist.append(i[0])
-            print(playlist)
-            str_list = ','.join(str(x) for x in playlist)
-            playlist_back = song_name_list(str_list)
-            return jsonify(playlist_back)
+            playlist_back, next_cursor = playlist_songs(pid, limit, cursor)
         except Exception as e:
             return 'error', 404
-        finally:
-            cursor.close()
-            db.close()
+        return paged_response(playlist_back, next_cursor)
     if uid and not pid and not id:
         db = get_db_connection().get_connection()
         cursor = db.cursor()
@@ -1073,29 +1584,83 @@ def artist_detail():
     return jsonify(data)
 
 
+recommender = Recommender(interval=int(os.getenv('RECOMMEND_BUILD_INTERVAL', BUILD_INTERVAL)),
+                          build=os.getenv('RECOMMEND_BUILD', '1') == '1')
+recommender.start()
+RECOMMEND_LIMIT = 30
+
+
+def recommend_limit():
+    return max(1, min(request.args.get('limit', RECOMMEND_LIMIT, type=int), TOP_K))
+
+
+def scored_songs(pairs):
+    """[(歌曲ID, 分数)] 转为歌曲信息列表，保持顺序"""
+    details = cached_song_details([song_id for song_id, _ in pairs]) if pairs else {}
+    return [dict(details[song_id], score=score) for song_id, score in pairs if song_id in details]
+
+
+def trending_pairs(limit):
+    """没有个性化结果时用热门榜单代替"""
+    page = trending_ranker.page(limit)
+    return [(row[0], 0) for row in page[0]] if page else []
+
+
 @app.route('/simi/artist')
 def simi_artist():
-    artist_id = request.args.get('id')
-    data = {"similarArtists": []}
+    artist_id = request.args.get('id', type=int)
+    index = recommender.index
+    pairs = index.similar_artists(artist_id, recommend_limit()) if index and artist_id else []
+    data = {"similarArtists": [{"id": similar_id, "name": index.artist_names.get(similar_id), "score": score}
+                               for similar_id, score in pairs]}
     return jsonify(data)
 
 
+@app.route('/simi/song')
+def simi_song():
+    song_id = request.args.get('id', type=int)
+    index = recommender.index
+    pairs = index.similar_songs(song_id, recommend_limit()) if index and song_id else []
+    return jsonify({"songs": scored_songs(pairs)})
+
+
 @app.route('/simi/playlist')
 def simi_playlist():
-    song_id = request.args.get('id')
-    data = {"playlists": []}
+    song_id = request.args.get('id', type=int)
+    index = recommender.index
+    pairs = index.song_playlists(song_id, recommend_limit()) if index and song_id else []
+    data = {"playlists": [{"id": playlist_id, "name": index.playlist_names.get(playlist_id), "score": score}
+                          for playlist_id, score in pairs]}
     return jsonify(data)
 
 
 @app.route('/recommend/resource')
 def recommend_resource():
-    data = {"playlists": [{"id": 1, "name": "Playlist 1"}, {"id": 2, "name": "Playlist 2"}, ]}
+    """推荐歌单：登录用户按播放记录推荐，否则取热门第一首歌所在的歌单"""
+    index = recommender.index
+    user_id = current_user_id()
+    limit = recommend_limit()
+    pairs = index.user_playlists(int(user_id), limit) if index and user_id else []
+    if index and not pairs:
+        for song_id, _ in trending_pairs(1):
+            pairs = index.song_playlists(song_id, limit)
+    data = {"playlists": [{"id": playlist_id, "name": index.playlist_names.get(playlist_id), "score": score}
+                          for playlist_id, score in pairs]}
     return jsonify(data)
 
 
 @app.route('/recommend/songs')
 def recommend_songs():
-    data = {"songs": [{"id": 1, "name": "Song 1"}, {"id": 2, "name": "Song 2"}, ]}
+    """每日推荐：登录用户听过的歌曲的相似歌曲，没有记录时返回热门歌曲"""
+    index = recommender.index
+    user_id = current_user_id()
+    limit = recommend_limit()
+    pairs = index.user_songs(int(user_id), limit) if index and user_id else []
+    try:
+        data = {"songs": scored_songs(pairs or trending_pairs(limit))}
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"code": 500, "error": "获取推荐歌曲失败"}), 500
     return jsonify(data)
 
 
@@ -1119,10 +1684,22 @@ def history_recommend_songs_detail():
     return jsonify(data)
 
 
+PERSONAL_FM_TRACKS = 3
+
+
 @app.route('/personal_fm')
 def personal_fm():
-    data = {"tracks": [{"id": 1, "name": "Personal FM Track 1"}, {"id": 2, "name": "Personal FM Track 2"}, ]}
-    return jsonify(data)
+    """私人 FM：从推荐候选中随机取几首，每次请求结果不同"""
+    index = recommender.index
+    user_id = current_user_id()
+    pairs = index.user_songs(int(user_id)) if index and user_id else []
+    pairs = pairs or trending_pairs(TOP_K)
+    try:
+        tracks = scored_songs(random.sample(pairs, min(PERSONAL_FM_TRACKS, len(pairs))))
+    except Exception as e:
+        print(f"Error: {e}")
+        return jsonify({"code": 500, "error": "获取私人FM失败"}), 500
+    return jsonify({"tracks": tracks})
 
 
 @app.route('/daily_signin', methods=['POST'])
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import sqlite3
+
+PARTIAL_HASH_BYTES = 64 * 1024  # 计算指纹时读取文件开头和结尾各 64KB
+
+
+def partial_hash(path, size):
+    """文件指纹：文件大小 + 开头和结尾各 64KB 的 SHA-1，足以识别移动过的文件而不必读完整个文件"""
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES * 2:
+            f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+        elif size > PARTIAL_HASH_BYTES:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """曲库文件清单（SQLite）：路径、大小、修改时间、指纹和对应的 SongID"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                                 path TEXT PRIMARY KEY,
+                                 size INTEGER NOT NULL,
+                                 mtime_ns INTEGER NOT NULL,
+                                 hash TEXT NOT NULL,
+                                 song_id INTEGER,
+                                 missing INTEGER NOT NULL DEFAULT 0)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS files_hash ON files (hash)")
+        self.conn.commit()
+
+    def entries(self, prefix):
+        """返回 {路径: (大小, 修改时间, 指纹, SongID, 是否丢失)}，只包含 prefix 目录下的文件"""
+        rows = self.conn.execute("SELECT path, size, mtime_ns, hash, song_id, missing FROM files "
+                                 "WHERE path >= ? AND path < ?", (prefix, prefix + '￿'))
+        return {row[0]: row[1:] for row in rows}
+
+    def upsert(self, path, size, mtime_ns, file_hash, song_id):
+        self.conn.execute("INSERT INTO files (path, size, mtime_ns, hash, song_id, missing) VALUES (?, ?, ?, ?, ?, 0) "
+                          "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                          "hash = excluded.hash, song_id = excluded.song_id, missing = 0",
+                          (path, size, mtime_ns, file_hash, song_id))
+
+    def remove(self, path):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def mark_missing(self, paths):
+        self.conn.executemany("UPDATE files SET missing = 1 WHERE path = ?", [(path,) for path in paths])
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,159 @@
+import os
+import threading
+
+import requests
+
+CHUNK_SIZE = 64 * 1024  # 下载和转发的块大小
+MAX_RESUME_ATTEMPTS = 3  # 下载中断后最多续传次数
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+
+
+class Download:
+    """一次正在进行的下载，边写入 .part 临时文件边供等待的客户端读取"""
+
+    def __init__(self, song_id, final_path):
+        self.song_id = song_id
+        self.final_path = final_path
+        self.part_path = final_path + '.part'
+        self.total = None  # 文件总大小，上游未返回时为 None
+        self.written = 0  # 已写入临时文件的字节数
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+        self._started = threading.Event()
+
+    def wait_started(self, timeout=None):
+        """等待上游响应头到达（或下载失败），返回是否已开始"""
+        self._started.wait(timeout)
+        return self._started.is_set() and self.error is None
+
+    def _progress(self, written):
+        with self._cond:
+            self.written = written
+            self._cond.notify_all()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+        self._started.set()
+
+    def iter_bytes(self):
+        """从临时文件读取已下载的数据，追上写入进度时等待新数据，下载结束后返回；
+        下载失败时抛出异常，让 WSGI 服务器中断响应，客户端不会把截断的数据当成完整文件"""
+        pos = 0
+        try:
+            f = open(self.part_path, 'rb')
+        except FileNotFoundError:
+            # 下载已完成并重命名
+            f = open(self.final_path, 'rb')
+        with f:
+            while True:
+                with self._cond:
+                    while self.written <= pos and not self.done:
+                        self._cond.wait(1)
+                    available = self.written - pos
+                    if available <= 0 and self.done:
+                        if self.error is not None:
+                            raise IOError(f'下载歌曲 {self.song_id} 失败: {self.error}') from self.error
+                        return
+                while available > 0:
+                    chunk = f.read(min(CHUNK_SIZE, available))
+                    if not chunk:
+                        break
+                    pos += len(chunk)
+                    available -= len(chunk)
+                    yield chunk
+
+
+class MusicFetcher:
+    """按歌曲ID合并并发请求：同一首歌同时只有一个下载，流式写入临时文件，完成后原子重命名"""
+
+    def __init__(self, resolve_url, session=None):
+        # resolve_url(song_id) 返回音乐直链，失败时抛出 requests.RequestException
+        self.resolve_url = resolve_url
+        self.session = session or requests
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def fetch(self, song_id, final_path):
+        """返回该歌曲正在进行的下载，没有则启动一个新的下载线程"""
+        with self._lock:
+            download = self._inflight.get(song_id)
+            if download is None:
+                download = Download(song_id, final_path)
+                self._inflight[song_id] = download
+                threading.Thread(target=self._run, args=(download,), daemon=True).start()
+            return download
+
+    def _run(self, download):
+        try:
+            os.makedirs(os.path.dirname(download.final_path), exist_ok=True)
+            music_url = self.resolve_url(download.song_id)
+            for attempt in range(MAX_RESUME_ATTEMPTS + 1):
+                try:
+                    self._download(download, music_url)
+                    break
+                except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                    if attempt == MAX_RESUME_ATTEMPTS:
+                        raise
+                    print(f'下载歌曲 {download.song_id} 中断，从 {download.written} 字节处续传:', e)
+            os.replace(download.part_path, download.final_path)
+            print('从外链下载并保存了音乐文件:', download.final_path)
+            download._finish()
+        except Exception as e:
+            print(f'下载歌曲 {download.song_id} 失败:', e)
+            download._finish(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(download.song_id, None)
+
+    def _download(self, download, music_url):
+        """下载到临时文件；临时文件已有内容时用 Range 续传"""
+        offset = os.path.getsize(download.part_path) if os.path.exists(download.part_path) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+        with self.session.get(music_url, headers=headers, stream=True,
+                              timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+            response.raise_for_status()
+            if offset and response.status_code == 206 and _range_start(response) == offset:
+                mode = 'ab'
+                total = _range_total(response)
+            else:
+                if download.written:
+                    # 已有客户端读取了部分数据，从头下载会导致数据错乱
+                    raise requests.HTTPError(f'上游不支持续传: {response.status_code}')
+                # 上游不支持续传，从头下载
+                offset, mode = 0, 'wb'
+                length = response.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() else None
+
+            with open(download.part_path, mode) as f:
+                download.total = total
+                download._progress(offset)
+                download._started.set()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    f.write(chunk)
+                    f.flush()
+                    offset += len(chunk)
+                    download._progress(offset)
+
+        if download.total is not None and offset < download.total:
+            raise requests.ConnectionError(f'下载不完整: {offset}/{download.total}')
+
+
+def _range_start(response):
+    """解析 Content-Range: bytes start-end/total 中的 start"""
+    try:
+        return int(response.headers.get('Content-Range', '').split(' ')[1].split('-')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _range_total(response):
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
@@ -0,0 +1,258 @@
+import glob
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from database import get_db_connection
+
+FLUSH_INTERVAL = 5  # 聚合写库的间隔（秒）
+BUFFER_SIZE = 100000  # 内存环形缓冲区最多保留的事件数
+MIN_PLAY_MS = 30 * 1000  # 播放不足 30 秒视为跳过，不计入播放次数
+
+PLAY_COUNT_UPDATE = "UPDATE songs SET PlayCount = COALESCE(PlayCount, 0) + %s WHERE SongID = %s"
+PLAY_STATS_UPSERT = """
+                    INSERT INTO play_stats (SongID, PlayHour, Plays)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE Plays = Plays + VALUES(Plays)
+                    """
+USER_PLAYS_UPSERT = """
+                    INSERT INTO user_song_plays (UserID, SongID, Plays, LastPlayed)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE Plays = Plays + VALUES(Plays),
+                                            LastPlayed = GREATEST(LastPlayed, VALUES(LastPlayed))
+                    """
+
+# 旧库升级：按小时和按用户聚合的播放表
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS play_stats
+    (
+        SongID   int           not null comment '歌曲ID',
+        PlayHour datetime      not null comment '播放时间（按小时取整）',
+        Plays    int default 0 not null comment '该小时播放次数',
+        primary key (SongID, PlayHour),
+        index idx_play_hour (PlayHour)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_song_plays
+    (
+        UserID     int           not null comment '用户ID',
+        SongID     int           not null comment '歌曲ID',
+        Plays      int default 0 not null comment '播放次数',
+        LastPlayed datetime      null comment '最后播放时间',
+        primary key (UserID, SongID),
+        index SongID (SongID)
+    )
+    """,
+]
+
+
+def ensure_schema():
+    """创建播放统计用到的表，已存在时不做任何事"""
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            db.commit()
+        finally:
+            cursor.close()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PlayEventPipeline:
+    """播放事件写后聚合：事件先进内存环形缓冲区并追加到本地日志，后台线程定期按歌曲/小时/用户聚合后批量写库
+
+    日志按进程分文件，每次写库前轮换为 .flushing 文件，写库提交后才删除；写库失败或进程崩溃时，
+    剩下的文件会在下一次写库时（或被其他进程认领后）重放，保证至少写入一次。"""
+
+    def __init__(self, spool_dir, flush_interval=FLUSH_INTERVAL, buffer_size=BUFFER_SIZE, on_flush=None):
+        self.spool_dir = spool_dir
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush  # on_flush(各歌曲本次新增的播放次数)
+        self._buffer = deque(maxlen=buffer_size)
+        self._overflowed = False  # 缓冲区溢出时这一轮改为从日志文件读取事件
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spool = None
+        self._thread = None
+        self._schema_ready = False
+        self._stats = {'received': 0, 'skipped': 0, 'flushed': 0, 'flushes': 0, 'failures': 0, 'overflows': 0}
+        self._pid = os.getpid()
+        os.makedirs(spool_dir, exist_ok=True)
+        # 进程号可能被复用（例如容器里总是 1），同名的旧日志也要先轮换出来重放
+        if os.path.exists(self._spool_path()):
+            os.replace(self._spool_path(), self._flushing_path())
+        self._claim_orphans()
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, f'events-{self._pid}.log')
+
+    def _flushing_path(self):
+        return os.path.join(self.spool_dir, f'events-{self._pid}-{time.time_ns()}.flushing')
+
+    def _claim_orphans(self):
+        """认领已退出进程留下的日志（多个进程共用日志目录时，重命名保证只有一个进程认领）"""
+        for path in glob.glob(os.path.join(self.spool_dir, 'events-*')):
+            try:
+                pid = int(os.path.basename(path).split('-')[1].split('.')[0])
+            except (IndexError, ValueError):
+                continue
+            if pid == self._pid and path == self._spool_path():
+                continue
+            if pid != self._pid and _pid_alive(pid):
+                continue
+            if pid == self._pid and path.endswith('.flushing'):
+                continue
+            try:
+                os.replace(path, self._flushing_path())
+            except FileNotFoundError:
+                pass
+
+    def _open_spool(self):
+        if self._spool is None:
+            self._spool = open(self._spool_path(), 'a', encoding='utf-8')
+        return self._spool
+
+    def record(self, song_id, user_id=None, played_ms=None, timestamp=None):
+        """记录一次播放，返回是否计入（播放时间过短的跳过）"""
+        self._stats['received'] += 1
+        if played_ms is not None and played_ms < MIN_PLAY_MS:
+            self._stats['skipped'] += 1
+            return False
+        event = (int(song_id), int(user_id) if user_id else None, int(timestamp or time.time()))
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self._overflowed = True
+                self._stats['overflows'] += 1
+            self._buffer.append(event)
+            spool = self._open_spool()
+            spool.write(json.dumps(event) + '\n')
+            spool.flush()
+        return True
+
+    def start(self):
+        if self._thread is None:
+            # 榜单和推荐也读这两张表，启动时就建好；失败时在第一次写库前重试
+            try:
+                self._ensure_schema()
+            except Exception as e:
+                print('检查播放统计表结构失败:', e)
+            self._thread = threading.Thread(target=self._run, name='play-events', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self._stats['failures'] += 1
+                print('播放事件写库失败，稍后重试:', e)
+
+    def flush(self):
+        """轮换日志并把事件聚合写库，返回写入的事件数"""
+        with self._flush_lock:
+            current = None
+            with self._lock:
+                buffered = list(self._buffer)
+                self._buffer.clear()
+                overflowed, self._overflowed = self._overflowed, False
+                if self._spool is not None:
+                    self._spool.close()
+                    self._spool = None
+                    current = self._flushing_path()
+                    os.replace(self._spool_path(), current)
+
+            # 本轮轮换出的日志与内存中的事件相同，直接用内存里的；缓冲区溢出丢过事件时以文件为准。
+            # 之前失败或崩溃留下的日志按文件重放。
+            self._claim_orphans()
+            paths = sorted(glob.glob(os.path.join(self.spool_dir, f'events-{self._pid}-*.flushing')))
+            events = [] if overflowed else buffered
+            for path in paths:
+                if path != current or overflowed:
+                    events += self._read_spool(path)
+            if not events:
+                for path in paths:
+                    os.remove(path)
+                return 0
+
+            self._ensure_schema()
+            song_plays = self._write(events)
+            for path in paths:
+                os.remove(path)
+            self._stats['flushed'] += len(events)
+            self._stats['flushes'] += 1
+            if self.on_flush:
+                self.on_flush(song_plays)
+            return len(events)
+
+    def _ensure_schema(self):
+        if not self._schema_ready:
+            ensure_schema()
+            self._schema_ready = True
+
+    @staticmethod
+    def _read_spool(path):
+        events = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    song_id, user_id, timestamp = json.loads(line)
+                except (ValueError, TypeError):
+                    continue  # 崩溃时可能留下写了一半的最后一行
+                events.append((song_id, user_id, timestamp))
+        return events
+
+    @staticmethod
+    def _write(events):
+        """按歌曲、(歌曲, 小时)、(用户, 歌曲) 聚合后各用一次 executemany 写入，同一事务提交"""
+        song_plays = Counter()
+        hourly = Counter()
+        user_plays = Counter()
+        last_played = {}
+        for song_id, user_id, timestamp in events:
+            song_plays[song_id] += 1
+            hour = datetime.fromtimestamp(timestamp - timestamp % 3600)
+            hourly[(song_id, hour)] += 1
+            if user_id:
+                user_plays[(user_id, song_id)] += 1
+                last_played[(user_id, song_id)] = max(last_played.get((user_id, song_id), 0), timestamp)
+
+        with get_db_connection().get_connection() as db:
+            cursor = db.cursor()
+            try:
+                # 按主键顺序写入，减少并发写入时的死锁
+                cursor.executemany(PLAY_COUNT_UPDATE, [(plays, song_id) for song_id, plays in sorted(song_plays.items())])
+                cursor.executemany(PLAY_STATS_UPSERT,
+                                   [(song_id, hour, plays) for (song_id, hour), plays in sorted(hourly.items())])
+                if user_plays:
+                    cursor.executemany(USER_PLAYS_UPSERT,
+                                       [(user_id, song_id, plays, datetime.fromtimestamp(last_played[(user_id, song_id)]))
+                                        for (user_id, song_id), plays in sorted(user_plays.items())])
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
+        return song_plays
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._buffer)
+        pending_files = len(glob.glob(os.path.join(self.spool_dir, f'events-{self._pid}-*.flushing')))
+        return dict(self._stats, buffered=buffered, pending_files=pending_files)
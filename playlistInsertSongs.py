@@ -1,4 +1,5 @@
 from database import get_db_connection
+from invalidation import invalidation_bus
 
 # 连接数据库
 mydb = get_db_connection().get_connection()
@@ -26,6 +27,8 @@ else:
 
     # 提交更改
     mydb.commit()
+    # 通知后端进程清理该歌单的缓存
+    invalidation_bus().invalidate(f'playlist:{playlistId}')
 
     print(f"成功插入数据，从 {start_value} 到 {end_value}")
 
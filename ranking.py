@@ -0,0 +1,207 @@
+import bisect
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+
+from database import column_exists, get_db_connection, index_columns
+
+HALF_LIFE_HOURS = 24  # 热度半衰期：一天前的一次播放只算半次
+WINDOW_HOURS = 7 * 24  # 只统计最近 7 天的播放，更早的衰减后几乎为 0
+TOPLIST_SIZE = 200  # 榜单长度
+RANKING_INTERVAL = 10 * 60  # 重新计算榜单的间隔（秒）
+
+# 每小时的播放次数乘以按距今小时数计算的衰减系数后求和
+TRENDING_QUERY = """
+                 SELECT SongID, SUM(Plays * EXP(-%s * TIMESTAMPDIFF(SECOND, PlayHour, %s) / 3600)) AS Score
+                 FROM play_stats
+                 WHERE PlayHour >= %s
+                 GROUP BY SongID
+                 ORDER BY Score DESC, SongID
+                 LIMIT %s
+                 """
+GENERATION_QUERY = "SELECT Generation, UpdateTime FROM hot_generation WHERE Type = %s"
+SNAPSHOT_QUERY = """
+                 SELECT hot.Position, hot.HotID, songs.SongID, songs.Title, artists.Name
+                 FROM hot
+                          JOIN songs ON songs.SongID = hot.TargetID
+                          JOIN artists ON songs.ArtistID = artists.ArtistID
+                 WHERE hot.Type = 'SONG' AND hot.Generation = %s
+                 ORDER BY hot.Position, hot.HotID
+                 """
+
+
+# 旧库升级：hot 表加上 Generation 列，唯一键改为 (Generation, TargetID, Type)，并建好 hot_generation 指针表
+SCHEMA_STATEMENTS = [
+    """
+    CREATE TABLE IF NOT EXISTS hot_generation
+    (
+        Type       enum ('SONG', 'ARTIST', 'ALBUM', 'PLAYLIST') not null comment '类型'
+            primary key,
+        Generation int default 0                                not null comment '当前生效的榜单代号',
+        UpdateTime timestamp                                    null comment '计算时间'
+    )
+    """,
+    "INSERT IGNORE INTO hot_generation (Type, Generation) VALUES ('SONG', 0)",
+]
+
+
+def ensure_schema():
+    """检查并补齐榜单分代所需的表结构，重复执行无副作用；返回执行过的升级语句数"""
+    applied = 0
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            if not column_exists(cursor, 'hot', 'Generation'):
+                # 旧数据都归到第 0 代，和 hot_generation 的初始值一致，升级后榜单照常可读
+                cursor.execute("ALTER TABLE hot ADD COLUMN Generation int default 0 not null comment '榜单代号'")
+                applied += 1
+            columns = index_columns(cursor, 'hot', 'unique_target_type')
+            if 'Generation' not in columns:
+                drop = "DROP INDEX unique_target_type, " if columns else ""
+                cursor.execute(f"ALTER TABLE hot {drop}ADD CONSTRAINT unique_target_type "
+                               "UNIQUE (Generation, TargetID, Type)")
+                applied += 1
+            for statement in SCHEMA_STATEMENTS:
+                cursor.execute(statement)
+            db.commit()
+        finally:
+            cursor.close()
+    if applied:
+        print(f'热门榜单表结构已升级（{applied} 项）')
+    return applied
+
+
+class HotSnapshot:
+    """某一代榜单的内存快照，按 (Position, HotID) 排序，分页游标与 hot_songs 相同"""
+
+    __slots__ = ('generation', 'updated', 'rows', '_keys')
+
+    def __init__(self, generation, updated, rows):
+        self.generation = generation
+        self.updated = updated
+        self.rows = [tuple(row[2:]) for row in rows]
+        self._keys = [(row[0], row[1]) for row in rows]
+
+    def page(self, limit=None, cursor=None):
+        start = 0
+        if cursor:
+            position, _, hot_id = cursor.partition(':')
+            start = bisect.bisect_right(self._keys, (int(position), int(hot_id)))
+        end = len(self.rows) if limit is None else start + limit
+        next_cursor = None
+        if end < len(self.rows):
+            next_cursor = '{}:{}'.format(*self._keys[end - 1])
+        return self.rows[start:end], next_cursor
+
+
+class TrendingRanker:
+    """定时按播放记录计算带时间衰减的热度，把新一代榜单写入 hot 表后切换 hot_generation 指针；
+    读者只读指针指向的那一代，不会看到写了一半的榜单。最新一代同时保存在内存中供 /api/toplist 使用。"""
+
+    def __init__(self, half_life_hours=HALF_LIFE_HOURS, window_hours=WINDOW_HOURS, size=TOPLIST_SIZE,
+                 interval=RANKING_INTERVAL):
+        self.decay = math.log(2) / half_life_hours
+        self.window_hours = window_hours
+        self.size = size
+        self.interval = interval
+        self.snapshot = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'runs': 0, 'swaps': 0, 'reloads': 0, 'failures': 0, 'last_duration': None}
+
+    def start(self):
+        if self._thread is None:
+            # 在开始对外提供榜单之前升级表结构，repository.hot_songs 依赖 hot_generation
+            try:
+                ensure_schema()
+            except Exception as e:
+                print('检查热门榜单表结构失败:', e)
+            self._thread = threading.Thread(target=self._run, name='ranking', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                self._stats['failures'] += 1
+                print('计算热门榜单失败:', e)
+            time.sleep(self.interval)
+
+    def run(self, force=False):
+        """需要时重新计算榜单，然后确保内存快照是最新一代；返回当前快照"""
+        with self._lock:
+            started = time.monotonic()
+            self._stats['runs'] += 1
+            generation = self._materialize(force)
+            self._stats['last_duration'] = round(time.monotonic() - started, 3)
+            if self.snapshot is None or self.snapshot.generation != generation:
+                self._load(generation)
+            return self.snapshot
+
+    def _materialize(self, force):
+        """在一个事务里写入新一代榜单并切换指针，返回当前代号。
+        多个进程同时运行时由指针行的行锁串行化，距上次计算不足 interval 时直接使用别的进程算好的结果。"""
+        now = datetime.now().replace(microsecond=0)
+        with get_db_connection().get_connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(GENERATION_QUERY + " FOR UPDATE", ('SONG',))
+                row = cursor.fetchone()
+                generation, updated = row if row else (0, None)
+                if not force and updated and (now - updated).total_seconds() < self.interval:
+                    db.rollback()
+                    return generation
+
+                cursor.execute(TRENDING_QUERY, (self.decay, now, now - timedelta(hours=self.window_hours), self.size))
+                scores = cursor.fetchall()
+                if not scores:
+                    # 还没有播放记录时保留原有榜单
+                    db.rollback()
+                    return generation
+
+                new_generation = generation + 1
+                cursor.executemany(
+                    "INSERT INTO hot (TargetID, Type, Position, UpdateTime, Generation) VALUES (%s, 'SONG', %s, %s, %s)",
+                    [(song_id, position, now, new_generation) for position, (song_id, _) in enumerate(scores, 1)])
+                cursor.execute("INSERT INTO hot_generation (Type, Generation, UpdateTime) VALUES (%s, %s, %s) "
+                               "ON DUPLICATE KEY UPDATE Generation = VALUES(Generation), "
+                               "UpdateTime = VALUES(UpdateTime)", ('SONG', new_generation, now))
+                # 只保留上一代，正在读上一代的请求不受影响
+                cursor.execute("DELETE FROM hot WHERE Type = 'SONG' AND Generation < %s", (generation,))
+                db.commit()
+                self._stats['swaps'] += 1
+                return new_generation
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def _load(self, generation):
+        with get_db_connection().get_connection() as db:
+            cursor = db.cursor()
+            try:
+                cursor.execute(GENERATION_QUERY, ('SONG',))
+                row = cursor.fetchone()
+                updated = row[1] if row else None
+                cursor.execute(SNAPSHOT_QUERY, (generation,))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+        self.snapshot = HotSnapshot(generation, updated, rows)
+        self._stats['reloads'] += 1
+
+    def page(self, limit=None, cursor=None):
+        """从内存快照分页；快照还没加载时返回 None，由调用方回退到数据库"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        return snapshot.page(limit, cursor)
+
+    def stats(self):
+        snapshot = self.snapshot
+        return dict(self._stats, generation=snapshot.generation if snapshot else None,
+                    updated=str(snapshot.updated) if snapshot and snapshot.updated else None,
+                    songs=len(snapshot.rows) if snapshot else 0)
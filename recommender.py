@@ -0,0 +1,406 @@
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from database import get_db_connection
+from versions import build_lock, current_version, new_version, publish
+
+RECOMMEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'recommender')
+TOP_K = 50  # 每首歌/每个歌手/每个用户保存的候选数
+BUILD_INTERVAL = 30 * 60  # 增量更新的间隔（秒）
+FULL_REBUILD_INTERVAL = 24 * 60 * 60  # 全量重建的间隔（秒），用来清掉从歌单里删掉的歌曲
+
+PLAYLIST = 0  # 共现集合类型：歌单
+USER = 1  # 共现集合类型：用户的播放记录
+
+PLAYLIST_SONGS_QUERY = ("SELECT PlaylistSongID, PlaylistID, SongID FROM playlist_songs "
+                        "WHERE PlaylistSongID > %s AND SongID IS NOT NULL ORDER BY PlaylistSongID")
+USER_PLAYS_QUERY = "SELECT UserID, SongID, Plays, LastPlayed FROM user_song_plays WHERE LastPlayed >= %s"
+SONG_ARTISTS_QUERY = ("SELECT SongID, ArtistID FROM songs "
+                      "WHERE COALESCE(UpdateTime, CreateTime) >= %s AND ArtistID IS NOT NULL")
+EPOCH = datetime(1970, 1, 2)
+
+# 对外提供查询的数组，都按第一列的ID排序，加载时用内存映射打开
+SERVING_ARRAYS = ('song_ids', 'song_neighbors', 'song_scores', 'song_playlists', 'song_playlist_scores',
+                  'artist_ids', 'artist_neighbors', 'artist_scores',
+                  'user_ids', 'user_songs', 'user_song_scores', 'user_playlists', 'user_playlist_scores')
+
+
+def _top_k(matrix, k, row_ids=None, exclude=None):
+    """取稀疏矩阵每行最大的 k 个值，返回 (列号, 分数)，不足 k 个用 -1 补齐；
+    row_ids 为各行对应的列号，用来排除自身；exclude 为同行数的稀疏矩阵，其中非零的列也排除"""
+    matrix = matrix.tocsr()
+    rows = matrix.shape[0]
+    cols = np.full((rows, k), -1, dtype=np.int32)
+    scores = np.zeros((rows, k), dtype=np.float32)
+    if exclude is not None:
+        exclude = exclude.tocsr()
+    for i in range(rows):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        if start == end:
+            continue
+        idx = matrix.indices[start:end]
+        val = matrix.data[start:end]
+        keep = val > 0
+        if row_ids is not None:
+            keep &= idx != row_ids[i]
+        if exclude is not None:
+            keep &= ~np.isin(idx, exclude.indices[exclude.indptr[i]:exclude.indptr[i + 1]])
+        idx, val = idx[keep], val[keep]
+        if len(idx) > k:
+            part = np.argpartition(-val, k)[:k]
+            idx, val = idx[part], val[part]
+        order = np.argsort(-val, kind='stable')
+        cols[i, :len(idx)] = idx[order]
+        scores[i, :len(idx)] = val[order]
+    return cols, scores
+
+
+def _to_ids(cols, ids):
+    """把列号换成ID，-1 保持不变"""
+    if not len(ids):
+        return np.full(cols.shape, -1, dtype=np.int64)
+    return np.where(cols >= 0, ids[np.maximum(cols, 0)], -1).astype(np.int64)
+
+
+def _neighbor_matrix(cols, scores, size):
+    """把每行的候选转成稀疏矩阵，对角线为 1（自身也参与打分）"""
+    rows = np.repeat(np.arange(len(cols)), cols.shape[1])
+    mask = cols.ravel() >= 0
+    matrix = sparse.csr_matrix((scores.ravel()[mask], (rows[mask], cols.ravel()[mask])), shape=(size, size))
+    return matrix + sparse.identity(size, dtype=np.float32, format='csr')
+
+
+class _State:
+    """增量更新所需的中间结果：集合-歌曲矩阵、歌曲共现矩阵、每首歌的近邻和读取进度"""
+
+    def __init__(self):
+        self.songs = []  # 列号 -> 歌曲ID
+        self.song_col = {}
+        self.song_artist = {}  # 歌曲ID -> 歌手ID
+        self.baskets = []  # 行号 -> (类型, ID)
+        self.basket_row = {}
+        self.baskets_matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.cooccurrence = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.neighbor_cols = np.zeros((0, TOP_K), dtype=np.int32)
+        self.neighbor_scores = np.zeros((0, TOP_K), dtype=np.float32)
+        self.playlist_song_id = 0
+        self.playlist_rows = 0
+        self.played_after = EPOCH
+        self.songs_after = EPOCH
+        self.full_built = time.time()
+
+    @classmethod
+    def load(cls, path):
+        state = cls()
+        with open(os.path.join(path, 'state.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = np.load(os.path.join(path, 'state.npz'))
+        state.songs = arrays['songs'].tolist()
+        state.song_col = {song_id: col for col, song_id in enumerate(state.songs)}
+        state.song_artist = dict(zip(arrays['artist_songs'].tolist(), arrays['artist_ids'].tolist()))
+        state.baskets = list(zip(arrays['basket_types'].tolist(), arrays['basket_keys'].tolist()))
+        state.basket_row = {basket: row for row, basket in enumerate(state.baskets)}
+        state.neighbor_cols = arrays['neighbor_cols']
+        state.neighbor_scores = arrays['neighbor_scores']
+        state.baskets_matrix = sparse.load_npz(os.path.join(path, 'baskets.npz')).tocsr()
+        state.cooccurrence = sparse.load_npz(os.path.join(path, 'cooccurrence.npz')).tocsr()
+        state.playlist_song_id = meta['playlist_song_id']
+        state.playlist_rows = meta['playlist_rows']
+        state.played_after = datetime.fromisoformat(meta['played_after'])
+        state.songs_after = datetime.fromisoformat(meta['songs_after'])
+        state.full_built = meta['full_built']
+        return state
+
+    def save(self, path):
+        artist_songs = np.array(list(self.song_artist), dtype=np.int64)
+        np.savez(os.path.join(path, 'state.npz'),
+                 songs=np.array(self.songs, dtype=np.int64),
+                 artist_songs=artist_songs,
+                 artist_ids=np.array([self.song_artist[s] for s in artist_songs.tolist()], dtype=np.int64),
+                 basket_types=np.array([t for t, _ in self.baskets], dtype=np.int8),
+                 basket_keys=np.array([key for _, key in self.baskets], dtype=np.int64),
+                 neighbor_cols=self.neighbor_cols, neighbor_scores=self.neighbor_scores)
+        sparse.save_npz(os.path.join(path, 'baskets.npz'), self.baskets_matrix)
+        sparse.save_npz(os.path.join(path, 'cooccurrence.npz'), self.cooccurrence)
+        with open(os.path.join(path, 'state.json'), 'w', encoding='utf-8') as f:
+            json.dump({'playlist_song_id': self.playlist_song_id, 'playlist_rows': self.playlist_rows,
+                       'played_after': self.played_after.isoformat(), 'songs_after': self.songs_after.isoformat(),
+                       'full_built': self.full_built}, f)
+
+    def _col(self, song_id):
+        col = self.song_col.get(song_id)
+        if col is None:
+            col = self.song_col[song_id] = len(self.songs)
+            self.songs.append(song_id)
+        return col
+
+    def _row(self, basket):
+        row = self.basket_row.get(basket)
+        if row is None:
+            row = self.basket_row[basket] = len(self.baskets)
+            self.baskets.append(basket)
+        return row
+
+    def apply(self, playlist_rows, user_plays):
+        """写入新的歌单歌曲和播放记录，增量更新共现矩阵，返回近邻需要重算的歌曲列号"""
+        updates = {}  # (行号, 列号) -> 新的权重
+        for playlist_song_id, playlist_id, song_id in playlist_rows:
+            updates[(self._row((PLAYLIST, playlist_id)), self._col(song_id))] = 1.0
+            self.playlist_song_id = max(self.playlist_song_id, playlist_song_id)
+        self.playlist_rows += len(playlist_rows)
+        for user_id, song_id, plays, last_played in user_plays:
+            # 播放次数取对数，避免单曲循环的歌曲主导共现
+            updates[(self._row((USER, user_id)), self._col(song_id))] = float(np.log1p(plays or 0))
+            self.played_after = max(self.played_after, last_played)
+        if not updates:
+            return np.zeros(0, dtype=np.int64)
+
+        shape = (len(self.baskets), len(self.songs))
+        old = self.baskets_matrix
+        old.resize(shape)
+        self.cooccurrence.resize((shape[1], shape[1]))
+        self.neighbor_cols = np.vstack([self.neighbor_cols, np.full((shape[1] - len(self.neighbor_cols), TOP_K), -1,
+                                                                    dtype=np.int32)])
+        self.neighbor_scores = np.vstack([self.neighbor_scores,
+                                          np.zeros((shape[1] - len(self.neighbor_scores), TOP_K), dtype=np.float32)])
+
+        keys = np.array(list(updates), dtype=np.int64).reshape(-1, 2)
+        values = np.array(list(updates.values()), dtype=np.float32)
+        mask = sparse.csr_matrix((np.ones(len(values), dtype=np.float32), (keys[:, 0], keys[:, 1])), shape=shape)
+        replaced = sparse.csr_matrix((values, (keys[:, 0], keys[:, 1])), shape=shape)
+        new = (old - old.multiply(mask) + replaced).tocsr()
+        new.eliminate_zeros()
+
+        # 共现矩阵 = 集合-歌曲矩阵的转置乘以自身；只有改动过的集合对应的项会变化
+        rows = np.unique(keys[:, 0])
+        old_rows, new_rows = old[rows], new[rows]
+        self.cooccurrence = (self.cooccurrence + new_rows.T @ new_rows - old_rows.T @ old_rows).tocsr()
+        self.cooccurrence.eliminate_zeros()
+        self.baskets_matrix = new
+
+        # 这些集合里的歌曲共现和向量长度都变了，与它们共现的歌曲的相似度也随之变化
+        touched = np.union1d(old_rows.indices, new_rows.indices)
+        return np.union1d(touched, self.cooccurrence[touched].indices)
+
+    def update_neighbors(self, cols):
+        """按余弦相似度重算指定歌曲的近邻"""
+        if not len(cols):
+            return
+        norms = np.sqrt(self.cooccurrence.diagonal())
+        inverse = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        similarity = sparse.diags(inverse[cols]) @ self.cooccurrence[cols] @ sparse.diags(inverse)
+        self.neighbor_cols[cols], self.neighbor_scores[cols] = _top_k(similarity, TOP_K, row_ids=cols)
+
+    def basket_rows(self, kind, keys=None):
+        """某一类集合的 (行号, ID)，keys 不为空时只保留其中的ID"""
+        rows = [(row, key) for row, (basket_kind, key) in enumerate(self.baskets)
+                if basket_kind == kind and (keys is None or key in keys)]
+        return np.array([row for row, _ in rows], dtype=np.int64), np.array([key for _, key in rows], dtype=np.int64)
+
+
+def _serving_arrays(state, public_playlists):
+    """由中间结果生成对外查询的数组"""
+    songs = np.array(state.songs, dtype=np.int64)
+    size = len(songs)
+    order = np.argsort(songs)
+    arrays = {'song_ids': songs[order],
+              'song_neighbors': _to_ids(state.neighbor_cols, songs)[order],
+              'song_scores': state.neighbor_scores[order]}
+    neighbors = _neighbor_matrix(state.neighbor_cols, state.neighbor_scores, size)
+
+    # 相似歌手：把歌曲列合并到所属歌手后同样计算余弦相似度
+    artist_of = np.array([state.song_artist.get(song_id, -1) for song_id in state.songs], dtype=np.int64)
+    artists, artist_cols = np.unique(artist_of[artist_of >= 0], return_inverse=True)
+    known = np.flatnonzero(artist_of >= 0)
+    to_artist = sparse.csr_matrix((np.ones(len(known), dtype=np.float32), (known, artist_cols)),
+                                  shape=(size, len(artists)))
+    artist_baskets = state.baskets_matrix @ to_artist
+    artist_cooccurrence = (artist_baskets.T @ artist_baskets).tocsr()
+    norms = np.sqrt(artist_cooccurrence.diagonal())
+    inverse = sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0))
+    artist_neighbors, artist_scores = _top_k(inverse @ artist_cooccurrence @ inverse, TOP_K,
+                                             row_ids=np.arange(len(artists)))
+    arrays.update(artist_ids=artists, artist_neighbors=_to_ids(artist_neighbors, artists), artist_scores=artist_scores)
+
+    # 歌曲所在的歌单：包含这首歌及其近邻的公开歌单，按相似度之和排序
+    playlist_rows, playlists = state.basket_rows(PLAYLIST, public_playlists)
+    playlist_songs = state.baskets_matrix[playlist_rows]
+    playlist_songs.data[:] = 1
+    song_playlists = (neighbors @ playlist_songs.T).tocsr()
+    cols, scores = _top_k(song_playlists, TOP_K)
+    arrays.update(song_playlists=_to_ids(cols, playlists)[order], song_playlist_scores=scores[order])
+
+    # 每日推荐：用户听过的歌曲的近邻按播放权重加权求和，去掉已经听过的
+    user_rows, users = state.basket_rows(USER)
+    user_order = np.argsort(users)
+    plays = state.baskets_matrix[user_rows]
+    cols, scores = _top_k(plays @ neighbors, TOP_K, exclude=plays)
+    arrays.update(user_ids=users[user_order], user_songs=_to_ids(cols, songs)[user_order],
+                  user_song_scores=scores[user_order])
+    cols, scores = _top_k(plays @ song_playlists, TOP_K)
+    arrays.update(user_playlists=_to_ids(cols, playlists)[user_order], user_playlist_scores=scores[user_order])
+    return arrays
+
+
+def _fetch_all(cursor, query, params=()):
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def build(root=RECOMMEND_DIR, full=False):
+    """读取上次构建之后新增的歌单歌曲和播放记录，增量更新后写入新版本目录并切换；返回新版本目录"""
+    current = current_version(root)
+    state = None
+    if current and not full:
+        try:
+            state = _State.load(current)
+        except (OSError, ValueError, KeyError) as e:
+            print('读取推荐模型中间结果失败，全量重建:', e)
+    if state and time.time() - state.full_built > FULL_REBUILD_INTERVAL:
+        state = None
+
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            if state:
+                # 歌单里删过歌曲时行数对不上，只能全量重建
+                cursor.execute("SELECT COUNT(*) FROM playlist_songs "
+                               "WHERE PlaylistSongID <= %s AND SongID IS NOT NULL", (state.playlist_song_id,))
+                if cursor.fetchone()[0] != state.playlist_rows:
+                    state = None
+            if state is None:
+                state = _State()
+            playlist_rows = _fetch_all(cursor, PLAYLIST_SONGS_QUERY, (state.playlist_song_id,))
+            user_plays = _fetch_all(cursor, USER_PLAYS_QUERY, (state.played_after,))
+            started = datetime.now().replace(microsecond=0)
+            song_artists = _fetch_all(cursor, SONG_ARTISTS_QUERY, (state.songs_after,))
+            artist_names = dict(_fetch_all(cursor, "SELECT ArtistID, Name FROM artists"))
+            public_playlists = dict(_fetch_all(cursor, "SELECT PlaylistID, Name FROM playlists WHERE Public = 1"))
+        finally:
+            cursor.close()
+
+    state.song_artist.update(song_artists)
+    state.songs_after = started
+    state.update_neighbors(state.apply(playlist_rows, user_plays))
+    arrays = _serving_arrays(state, public_playlists)
+
+    os.makedirs(root, exist_ok=True)
+    path = new_version(root)
+    try:
+        for name in SERVING_ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), arrays[name])
+        with open(os.path.join(path, 'names.json'), 'w', encoding='utf-8') as f:
+            json.dump({'artists': {artist_id: artist_names.get(artist_id) for artist_id in arrays['artist_ids'].tolist()},
+                       'playlists': public_playlists}, f, ensure_ascii=False)
+        state.save(path)
+        publish(root, path)
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    return path
+
+
+class RecommendIndex:
+    """推荐结果的只读视图：数组以内存映射方式打开，每次查询只做一次二分查找和 k 个元素的读取"""
+
+    def __init__(self, path):
+        self.path = path
+        self.arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in SERVING_ARRAYS}
+        with open(os.path.join(path, 'names.json'), 'r', encoding='utf-8') as f:
+            names = json.load(f)
+        self.artist_names = {int(key): name for key, name in names['artists'].items()}
+        self.playlist_names = {int(key): name for key, name in names['playlists'].items()}
+
+    def _find(self, key, target_id):
+        ids = self.arrays[key + '_ids']
+        i = int(np.searchsorted(ids, target_id))
+        return i if i < len(ids) and ids[i] == target_id else None
+
+    def _pairs(self, key, target_id, targets, scores, limit):
+        i = self._find(key, target_id)
+        if i is None:
+            return []
+        return [(int(target), round(float(score), 4))
+                for target, score in zip(self.arrays[targets][i, :limit], self.arrays[scores][i, :limit])
+                if target >= 0]
+
+    def similar_songs(self, song_id, limit=TOP_K):
+        return self._pairs('song', song_id, 'song_neighbors', 'song_scores', limit)
+
+    def similar_artists(self, artist_id, limit=TOP_K):
+        return self._pairs('artist', artist_id, 'artist_neighbors', 'artist_scores', limit)
+
+    def song_playlists(self, song_id, limit=TOP_K):
+        return self._pairs('song', song_id, 'song_playlists', 'song_playlist_scores', limit)
+
+    def user_songs(self, user_id, limit=TOP_K):
+        return self._pairs('user', user_id, 'user_songs', 'user_song_scores', limit)
+
+    def user_playlists(self, user_id, limit=TOP_K):
+        return self._pairs('user', user_id, 'user_playlists', 'user_playlist_scores', limit)
+
+    def stats(self):
+        return {'version': os.path.basename(self.path), 'songs': len(self.arrays['song_ids']),
+                'artists': len(self.arrays['artist_ids']), 'users': len(self.arrays['user_ids'])}
+
+
+class Recommender:
+    """后台定期增量构建推荐模型并切换到最新版本；多个进程共用目录时由文件锁保证同时只有一个进程构建"""
+
+    def __init__(self, root=RECOMMEND_DIR, interval=BUILD_INTERVAL, build=True):
+        self.root = root
+        self.interval = interval
+        self.build_enabled = build
+        self.index = None
+        self._thread = None
+        self._stats = {'builds': 0, 'failures': 0, 'last_duration': None}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='recommender', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.reload()
+                if self.build_enabled:
+                    self.build()
+            except Exception as e:
+                self._stats['failures'] += 1
+                print('构建推荐模型失败:', e)
+            time.sleep(self.interval)
+
+    def build(self, full=False):
+        with build_lock(self.root) as locked:
+            if not locked:
+                return None
+            started = time.monotonic()
+            path = build(self.root, full)
+            self._stats['builds'] += 1
+            self._stats['last_duration'] = round(time.monotonic() - started, 3)
+        self.reload()
+        return path
+
+    def reload(self):
+        """CURRENT 指向新版本时重新打开"""
+        path = current_version(self.root)
+        if path and (self.index is None or self.index.path != path):
+            self.index = RecommendIndex(path)
+        return self.index
+
+    def stats(self):
+        index = self.index
+        return dict(self._stats, **(index.stats() if index else {}))
+
+
+if __name__ == '__main__':
+    print('推荐模型已写入', build(full='--full' in sys.argv))
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundRefresher:
+    """后台刷新缓存：同一个键同时只有一次刷新，按请求频率预热热门键"""
+
+    def __init__(self, refresh, needs_refresh, workers=2, prewarm_top=20, prewarm_interval=600):
+        # refresh(key) 从上游获取数据并写入缓存，返回新数据
+        # needs_refresh(key) 判断缓存是否即将过期
+        self.refresh = refresh
+        self.needs_refresh = needs_refresh
+        self.prewarm_top = prewarm_top
+        self.prewarm_interval = prewarm_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresher')
+        self._lock = threading.Lock()
+        self._pending = {}  # 键 -> Future
+        self._counts = Counter()  # 请求频率，每轮预热后减半
+        self._prewarm_thread = None
+
+    def record(self, key):
+        """记录一次请求，用于统计热门键"""
+        with self._lock:
+            self._counts[key] += 1
+
+    def schedule(self, key):
+        """提交一次后台刷新，已有相同键的刷新在进行时直接复用"""
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._run, key)
+                self._pending[key] = future
+            return future
+
+    def refresh_now(self, key, timeout=None):
+        """同步等待刷新结果，并发请求同一个键时只会调用一次上游"""
+        return self.schedule(key).result(timeout)
+
+    def _run(self, key):
+        try:
+            return self.refresh(key)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def start(self):
+        """启动预热线程"""
+        if self._prewarm_thread is None:
+            self._prewarm_thread = threading.Thread(target=self._prewarm_loop, daemon=True)
+            self._prewarm_thread.start()
+
+    def _prewarm_loop(self):
+        while True:
+            time.sleep(self.prewarm_interval)
+            try:
+                self.prewarm()
+            except Exception as e:
+                print('缓存预热失败:', e)
+
+    def prewarm(self):
+        """刷新即将过期的热门键，然后把请求频率减半，让热度随时间衰减"""
+        with self._lock:
+            hot_keys = [key for key, _ in self._counts.most_common(self.prewarm_top)]
+            for key in list(self._counts):
+                self._counts[key] //= 2
+                if not self._counts[key]:
+                    del self._counts[key]
+        for key in hot_keys:
+            if self.needs_refresh(key):
+                self.schedule(key)
+        return hot_keys
+
+    def stats(self):
+        with self._lock:
+            return {'pending': len(self._pending), 'tracked_keys': len(self._counts),
+                    'top': self._counts.most_common(10)}
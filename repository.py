@@ -0,0 +1,146 @@
+from database import get_db_connection
+
+MAX_PAGE_SIZE = 1000  # 单页最多返回的行数
+
+
+def parse_page_args(args):
+    """从请求参数读取 limit 和 cursor，limit 未传时返回 None（不分页）"""
+    limit = args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return limit, args.get('cursor')
+
+
+def _query(query, params=()):
+    """使用服务端预处理语句执行查询"""
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor(prepared=True)
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def _page(rows, limit, make_cursor):
+    """多查了一行用来判断是否还有下一页，返回 (去掉排序键的行, 下一页游标)"""
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = make_cursor(rows[-1])
+    return rows, next_cursor
+
+
+def playlist_songs(playlist_id, limit=None, cursor=None):
+    """歌单歌曲，一次 JOIN 查询，按加入歌单的顺序排列；返回 ([(SongID, Title, 歌手名), ...], 下一页游标)"""
+    query = ("SELECT ps.PlaylistSongID, songs.SongID, songs.Title, artists.Name FROM playlist_songs ps "
+             "JOIN songs ON songs.SongID = ps.SongID "
+             "JOIN artists ON songs.ArtistID = artists.ArtistID "
+             "WHERE ps.PlaylistID = %s AND ps.PlaylistSongID > %s ORDER BY ps.PlaylistSongID")
+    params = [int(playlist_id), int(cursor or 0)]
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    rows, next_cursor = _page(_query(query, params), limit, lambda row: str(row[0]))
+    return [tuple(row[1:]) for row in rows], next_cursor
+
+
+def hot_songs(limit=None, cursor=None):
+    """热门歌曲榜单（当前生效的一代），按 Position 排序；游标格式为 "Position:HotID\""""
+    query = ("SELECT hot.Position, hot.HotID, songs.SongID, songs.Title, artists.Name FROM hot "
+             "JOIN hot_generation ON hot_generation.Type = hot.Type AND hot_generation.Generation = hot.Generation "
+             "JOIN songs ON songs.SongID = hot.TargetID "
+             "JOIN artists ON songs.ArtistID = artists.ArtistID "
+             "WHERE hot.Type = 'SONG'")
+    params = []
+    if cursor:
+        position, _, hot_id = cursor.partition(':')
+        query += " AND (hot.Position, hot.HotID) > (%s, %s)"
+        params += [int(position), int(hot_id)]
+    query += " ORDER BY hot.Position, hot.HotID"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+
+    rows, next_cursor = _page(_query(query, params), limit, lambda row: f'{row[0]}:{row[1]}')
+    return [tuple(row[2:]) for row in rows], next_cursor
+
+
+def songs_by_ids(song_ids):
+    """按ID列表查询歌曲，返回顺序与传入的ID顺序一致"""
+    song_ids = [int(song_id) for song_id in song_ids]
+    if not song_ids:
+        return []
+    placeholders = ','.join(['%s'] * len(song_ids))
+    query = ("SELECT songs.SongID, songs.Title, artists.Name FROM songs "
+             "JOIN artists ON songs.ArtistID = artists.ArtistID "
+             f"WHERE songs.SongID IN ({placeholders})")
+    rows = {row[0]: tuple(row) for row in _query(query, song_ids)}
+    return [rows[song_id] for song_id in song_ids if song_id in rows]
+
+
+SONG_DETAIL_COLUMNS = ('id', 'title', 'artistId', 'artist', 'albumId', 'album', 'genre', 'duration', 'releaseDate',
+                       'language', 'playCount', 'bitrate', 'codec', 'createTime', 'updateTime')
+
+
+def song_details(song_ids):
+    """一次查询多首歌曲的详细信息，附带歌手名和专辑名，返回 {SongID: dict}"""
+    song_ids = [int(song_id) for song_id in song_ids]
+    if not song_ids:
+        return {}
+    placeholders = ','.join(['%s'] * len(song_ids))
+    query = ("SELECT songs.SongID, songs.Title, songs.ArtistID, artists.Name, songs.AlbumID, albums.Title, "
+             "songs.Genre, songs.Duration, songs.ReleaseDate, songs.Language, songs.PlayCount, songs.Bitrate, "
+             "songs.Codec, songs.CreateTime, songs.UpdateTime FROM songs "
+             "LEFT JOIN artists ON songs.ArtistID = artists.ArtistID "
+             "LEFT JOIN albums ON songs.AlbumID = albums.AlbumID "
+             f"WHERE songs.SongID IN ({placeholders})")
+    return {row[0]: dict(zip(SONG_DETAIL_COLUMNS, row)) for row in _query(query, song_ids)}
+
+
+# 目录类列表：按主键做 keyset 分页，顺序稳定
+CATALOG_QUERIES = {
+    'albums': ("SELECT AlbumID, Title, ReleaseDate FROM albums", "AlbumID"),
+    'playlists': ("SELECT PlaylistID, Name, Description FROM playlists", "PlaylistID"),
+    # 只列出有歌曲的歌手，等价于原来的 DISTINCT JOIN
+    'singers': ("SELECT ArtistID, Name FROM artists "
+                "WHERE EXISTS (SELECT 1 FROM songs WHERE songs.ArtistID = artists.ArtistID)", "ArtistID"),
+}
+
+
+def _catalog_query(name, limit, cursor):
+    select, key = CATALOG_QUERIES[name]
+    joiner = ' AND ' if ' WHERE ' in select else ' WHERE '
+    query = f"{select}{joiner}{key} > %s ORDER BY {key}"
+    params = [int(cursor or 0)]
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit + 1)
+    return query, params
+
+
+def catalog_page(name, limit=None, cursor=None):
+    """返回 (行列表, 下一页游标)，游标为本页最后一行的主键"""
+    query, params = _catalog_query(name, limit, cursor)
+    rows, next_cursor = _page(_query(query, params), limit, lambda row: str(row[0]))
+    return [tuple(row) for row in rows], next_cursor
+
+
+def iter_catalog(name, cursor=None, batch_size=500):
+    """用非缓冲游标逐批读取整个列表，不在内存中保存完整结果集"""
+    query, params = _catalog_query(name, None, cursor)
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor(buffered=False)
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            # 客户端提前断开时读完剩余结果，连接才能归还连接池
+            if db.unread_result:
+                db.consume_results()
+            cursor.close()
@@ -36,10 +36,21 @@ create table hot
     Type       enum ('SONG', 'ARTIST', 'ALBUM', 'PLAYLIST') null comment '类型',
     Position   int                                          null comment '位置',
     UpdateTime timestamp                                    null comment '更新时间',
+    Generation int default 0                                not null comment '榜单代号',
     constraint unique_target_type
-        unique (TargetID, Type)
+        unique (Generation, TargetID, Type)
 );
 
+create table hot_generation
+(
+    Type       enum ('SONG', 'ARTIST', 'ALBUM', 'PLAYLIST') not null comment '类型'
+        primary key,
+    Generation int default 0                                not null comment '当前生效的榜单代号',
+    UpdateTime timestamp                                    null comment '计算时间'
+);
+
+insert into hot_generation (Type, Generation) values ('SONG', 0);
+
 create table musictags
 (
     TagID   int auto_increment
@@ -76,7 +87,9 @@ create table songs
     BitDepth       int          null comment '位深',
     Channels       int          null comment '声道数',
     SampleRate     int          null comment '采样率',
-    Bitrate        int          null comment '比特率',
+    Bitrate        int          null comment '比特率（kbps）',
+    Codec          varchar(16)  null comment '编码格式（mp3、flac、aac、alac、vorbis、opus）',
+    Orphaned       tinyint(1)   default 0 null comment '文件是否已丢失',
     constraint songs_ibfk_1
         foreign key (ArtistID) references artists (ArtistID),
     constraint songs_ibfk_2
@@ -92,6 +105,9 @@ create index ArtistID
 create index idx_title
     on songs (Title);
 
+create index idx_file_path
+    on songs (FilePath);
+
 create table songtags
 (
     SongID int not null comment '歌曲ID',
@@ -288,3 +304,25 @@ create table vips
         foreign key (UserID) references users (UserID)
 );
 
+create table play_stats
+(
+    SongID   int           not null comment '歌曲ID',
+    PlayHour datetime      not null comment '播放时间（按小时取整）',
+    Plays    int default 0 not null comment '该小时播放次数',
+    primary key (SongID, PlayHour)
+);
+
+create index idx_play_hour
+    on play_stats (PlayHour);
+
+create table user_song_plays
+(
+    UserID     int           not null comment '用户ID',
+    SongID     int           not null comment '歌曲ID',
+    Plays      int default 0 not null comment '播放次数',
+    LastPlayed datetime      null comment '最后播放时间',
+    primary key (UserID, SongID)
+);
+
+create index SongID
+    on user_song_plays (SongID);
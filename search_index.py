@@ -0,0 +1,290 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from database import get_db_connection
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+PREFIX_EXPANSIONS = 50  # 前缀查询最多展开的词数
+FULL_SYNC_INTERVAL = 60 * 60  # 全量同步间隔（秒），用来移除已删除的歌曲
+
+_WORD_RE = re.compile(r'[0-9a-zÀ-ɏ]+|[぀-ヿ㐀-䶿一-鿿가-힯]+')
+_CJK_RE = re.compile(r'[぀-ヿ㐀-䶿一-鿿가-힯]')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def tokenize(text):
+    """索引分词：拉丁字母按单词切分，中日韩文字同时生成单字和双字（bigram）"""
+    tokens = []
+    for run in _WORD_RE.findall(normalize(text)):
+        if _CJK_RE.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def tokenize_query(text):
+    """查询分词：中日韩文字只用双字匹配（单个字时用单字），返回 (词列表, 最后一个词是否可作前缀)"""
+    tokens = []
+    runs = _WORD_RE.findall(normalize(text))
+    for run in runs:
+        if _CJK_RE.match(run):
+            tokens.extend([run] if len(run) == 1 else [run[i:i + 2] for i in range(len(run) - 1)])
+        else:
+            tokens.append(run)
+    prefix = bool(runs) and not _CJK_RE.match(runs[-1]) and not text.endswith(' ')
+    return tokens, prefix
+
+
+class InvertedIndex:
+    """内存倒排索引，BM25 排序，支持增量更新和前缀查询"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = defaultdict(dict)  # 词 -> {文档ID: 加权词频}
+        self._doc_terms = {}  # 文档ID -> {词: 加权词频}，更新文档时用于移除旧的倒排记录
+        self._doc_len = {}
+        self._total_len = 0.0
+        self._vocab = []  # 有序词表，用于前缀查询
+        self._vocab_dirty = False
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    def add(self, doc_id, fields):
+        """添加或更新文档，fields 为 [(文本, 权重), ...]"""
+        terms = defaultdict(float)
+        for text, weight in fields:
+            for token in tokenize(text):
+                terms[token] += weight
+        with self._lock:
+            self.remove(doc_id)
+            for term, tf in terms.items():
+                if term not in self._postings:
+                    self._vocab_dirty = True
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = terms
+            length = sum(terms.values())
+            self._doc_len[doc_id] = length
+            self._total_len += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                return
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+                        self._vocab_dirty = True
+            self._total_len -= self._doc_len.pop(doc_id, 0)
+
+    def _expand_prefix(self, prefix):
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        start = bisect.bisect_left(self._vocab, prefix)
+        expansions = []
+        for term in self._vocab[start:start + PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            expansions.append(term)
+        return expansions
+
+    def search(self, query, limit=30):
+        """返回 [(文档ID, 分数), ...]，所有查询词都必须命中（前缀词命中任一展开即可）"""
+        tokens, prefix = tokenize_query(query)
+        if not tokens:
+            return []
+        with self._lock:
+            n = len(self._doc_terms)
+            if not n:
+                return []
+            avg_len = self._total_len / n
+            groups = [[token] for token in tokens]
+            if prefix:
+                groups[-1] = self._expand_prefix(tokens[-1]) or groups[-1]
+
+            # 每组取出倒排表，从最短的组开始求交集，只给候选文档打分
+            group_postings = []
+            for group in groups:
+                postings = [(term, self._postings[term]) for term in group if term in self._postings]
+                if not postings:
+                    return []
+                group_postings.append(postings)
+            group_postings.sort(key=lambda postings: sum(len(p) for _, p in postings))
+
+            scores = None
+            for postings in group_postings:
+                group_scores = defaultdict(float)
+                for term, docs in postings:
+                    idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    candidates = docs.keys() if scores is None else (d for d in scores if d in docs)
+                    for doc_id in candidates:
+                        tf = docs[doc_id]
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc_id] / avg_len)
+                        group_scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                if scores is None:
+                    scores = group_scores
+                else:
+                    scores = {doc_id: score + group_scores[doc_id] for doc_id, score in scores.items()
+                              if doc_id in group_scores}
+                if not scores:
+                    return []
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class CatalogSearch:
+    """本地曲库搜索：歌曲、歌手、专辑三个倒排索引，按 UpdateTime 增量同步数据库"""
+
+    def __init__(self, full_sync_interval=FULL_SYNC_INTERVAL):
+        self.full_sync_interval = full_sync_interval
+        self.songs = InvertedIndex()
+        self.artists = InvertedIndex()
+        self.albums = InvertedIndex()
+        self._lock = threading.RLock()  # 保护下面的文档表，搜索请求和同步线程并发访问
+        self._song_docs = {}
+        self._artist_names = {}
+        self._album_docs = {}
+        self._artist_refs = defaultdict(int)  # 歌手ID -> 引用它的歌曲数
+        self._album_refs = defaultdict(int)
+        self._watermark = None  # 已同步的最大 UpdateTime（为空时取 CreateTime）
+        self._full_synced_at = 0.0
+        self._sync_lock = threading.Lock()
+        self.ready = False
+
+    def add_song(self, song_id, title, artist_id=None, artist='', album_id=None, album='', duration=None,
+                 composer='', lyricist='', genre=''):
+        """添加或更新一首歌，插入新歌后调用即可立即被搜索到"""
+        doc = {
+            'id': song_id,
+            'name': title,
+            'artists': [{'id': artist_id, 'name': artist}],
+            'album': {'id': album_id, 'name': album},
+            'duration': duration * 1000 if duration else 0,
+        }
+        with self._lock:
+            previous = self._song_docs.get(song_id)
+            self._song_docs[song_id] = doc
+            # 先加新引用再减旧引用，歌手和专辑不变时不会被移除后重新加入
+            self._ref(doc)
+            self._unref(previous)
+            self.songs.add(song_id, [(title, 3.0), (artist, 2.0), (album, 1.0), (composer, 0.5), (lyricist, 0.5),
+                                     (genre, 0.5)])
+            if artist_id is not None and artist and self._artist_names.get(artist_id) != artist:
+                self._artist_names[artist_id] = artist
+                self.artists.add(artist_id, [(artist, 1.0)])
+            if album_id is not None and album and album_id not in self._album_docs:
+                self._album_docs[album_id] = {'id': album_id, 'name': album,
+                                              'artist': {'id': artist_id, 'name': artist}}
+                self.albums.add(album_id, [(album, 2.0), (artist, 1.0)])
+
+    def _ref(self, doc):
+        artist_id, album_id = doc['artists'][0]['id'], doc['album']['id']
+        if artist_id is not None:
+            self._artist_refs[artist_id] += 1
+        if album_id is not None:
+            self._album_refs[album_id] += 1
+
+    def _unref(self, doc):
+        """减少歌曲对歌手和专辑的引用，没有歌曲引用的歌手和专辑从索引中移除"""
+        if doc is None:
+            return
+        artist_id, album_id = doc['artists'][0]['id'], doc['album']['id']
+        if artist_id is not None:
+            self._artist_refs[artist_id] -= 1
+            if self._artist_refs[artist_id] <= 0:
+                del self._artist_refs[artist_id]
+                self._artist_names.pop(artist_id, None)
+                self.artists.remove(artist_id)
+        if album_id is not None:
+            self._album_refs[album_id] -= 1
+            if self._album_refs[album_id] <= 0:
+                del self._album_refs[album_id]
+                self._album_docs.pop(album_id, None)
+                self.albums.remove(album_id)
+
+    def sync(self):
+        """从数据库同步新增或修改过的歌曲；首次调用和之后每隔 full_sync_interval 全量同步一次，
+        全量同步时移除数据库中已删除的歌曲"""
+        with self._sync_lock:
+            full = self._watermark is None or time.monotonic() - self._full_synced_at >= self.full_sync_interval
+            # 没有 UpdateTime 的行按 CreateTime 算，两者都为空的行只在全量同步时加入
+            query = ("SELECT songs.SongID, songs.Title, songs.ArtistID, artists.Name, songs.AlbumID, albums.Title, "
+                     "songs.Duration, songs.Composer, songs.Lyricist, songs.Genre, "
+                     "COALESCE(songs.UpdateTime, songs.CreateTime) "
+                     "FROM songs LEFT JOIN artists ON songs.ArtistID = artists.ArtistID "
+                     "LEFT JOIN albums ON songs.AlbumID = albums.AlbumID")
+            params = ()
+            if not full:
+                query += " WHERE COALESCE(songs.UpdateTime, songs.CreateTime) >= %s"
+                params = (self._watermark,)
+
+            started = time.monotonic()
+            with self._lock:
+                indexed = set(self._song_docs)
+            seen = set()
+            with get_db_connection().get_connection() as db:
+                cursor = db.cursor()
+                try:
+                    cursor.execute(query, params)
+                    count = 0
+                    for row in cursor:
+                        (song_id, title, artist_id, artist, album_id, album, duration, composer, lyricist, genre,
+                         update_time) = row
+                        self.add_song(song_id, title or '', artist_id, artist or '', album_id, album or '',
+                                      duration, composer or '', lyricist or '', genre or '')
+                        if update_time is not None and (self._watermark is None or update_time > self._watermark):
+                            self._watermark = update_time
+                        seen.add(song_id)
+                        count += 1
+                finally:
+                    cursor.close()
+            if full:
+                # 只移除同步开始前就在索引里的歌曲，同步期间 add_song 加入的新歌不受影响
+                for song_id in indexed - seen:
+                    self.remove_song(song_id)
+                self._full_synced_at = started
+            self.ready = True
+            return count
+
+    def remove_song(self, song_id):
+        """从索引中移除一首歌，没有其他歌曲引用的歌手和专辑一并移除"""
+        with self._lock:
+            doc = self._song_docs.pop(song_id, None)
+            if doc is None:
+                return
+            self.songs.remove(song_id)
+            self._unref(doc)
+
+    def search(self, keyword, limit=30):
+        """返回与上游搜索接口相同结构的结果，没有命中时返回 None"""
+        song_hits = self.songs.search(keyword, limit)
+        artist_hits = self.artists.search(keyword, 10)
+        album_hits = self.albums.search(keyword, 10)
+        with self._lock:
+            # 打分和取文档之间可能有歌曲被移除，找不到的跳过
+            songs = [self._song_docs[song_id] for song_id, _ in song_hits if song_id in self._song_docs]
+            artists = [{'id': artist_id, 'name': self._artist_names[artist_id]}
+                       for artist_id, _ in artist_hits if artist_id in self._artist_names]
+            albums = [self._album_docs[album_id] for album_id, _ in album_hits if album_id in self._album_docs]
+        if not songs:
+            return None
+        return {'code': 200, 'source': 'local',
+                'result': {'songs': songs, 'songCount': len(songs), 'artists': artists, 'albums': albums}}
@@ -0,0 +1,175 @@
+import array
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import mutagen
+
+from disk_cache import DiskCache
+from lyrics import parse_lrc, resolve_lyrics
+from tags import read_cover
+
+SIDECAR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp', 'sidecar')
+SIDECAR_TTL = 365 * 24 * 60 * 60  # 内容只在重新入库时变化，过期时间设长一些
+SIDECAR_VERSION = 1
+PEAK_POINTS = 200  # 进度条波形的点数
+PEAK_SAMPLE_RATE = 4000  # 计算波形时解码的采样率，足够看出响度起伏
+FFMPEG = os.getenv('FFMPEG_PATH', 'ffmpeg')
+
+
+def compute_peaks(source_path, duration, points=PEAK_POINTS, ffmpeg=FFMPEG):
+    """用 ffmpeg 解码为单声道 16 位 PCM，按时间等分取每段的峰值，归一化到 0-255；没有 ffmpeg 时返回 None"""
+    ffmpeg = shutil.which(ffmpeg)
+    if not ffmpeg or not duration:
+        return None
+    bucket = max(1, int(duration * PEAK_SAMPLE_RATE / points))
+    command = [ffmpeg, '-nostdin', '-v', 'error', '-i', source_path, '-map', '0:a:0', '-ac', '1',
+               '-ar', str(PEAK_SAMPLE_RATE), '-f', 's16le', '-']
+    peaks = []
+    pending = b''
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        while True:
+            chunk = proc.stdout.read(bucket * 2 * 64)
+            if not chunk:
+                break
+            pending += chunk
+            usable = len(pending) - len(pending) % (bucket * 2)
+            samples = array.array('h', pending[:usable])
+            pending = pending[usable:]
+            for i in range(0, len(samples), bucket):
+                part = samples[i:i + bucket]
+                peaks.append(max(max(part), -min(part)))
+        if pending[:len(pending) - len(pending) % 2]:
+            samples = array.array('h', pending[:len(pending) - len(pending) % 2])
+            peaks.append(max(max(samples), -min(samples)))
+    if proc.returncode != 0 or not peaks:
+        return None
+
+    # 解码长度和标签里的时长可能有出入，统一重采样到 points 个点
+    if len(peaks) != points:
+        step = len(peaks) / points
+        peaks = [max(peaks[int(i * step):max(int(i * step) + 1, int((i + 1) * step))]) for i in range(points)]
+    loudest = max(peaks) or 1
+    return [min(255, peak * 255 // loudest) for peak in peaks]
+
+
+def cover_hash(source_path, cover_path=None):
+    """封面内容哈希（前 16 位），优先内嵌封面，其次封面图片文件"""
+    try:
+        cover = read_cover(source_path)
+    except Exception:
+        cover = None
+    data = cover[0] if cover else None
+    if data is None and cover_path and os.path.isfile(cover_path):
+        with open(cover_path, 'rb') as f:
+            data = f.read()
+    return hashlib.sha1(data).hexdigest()[:16] if data else None
+
+
+def build_sidecar(song_id, source_path, lyrics=None, cover_path=None, lyrics_fallback=None):
+    """生成一首歌的元数据副本：时长、码率、波形峰值、解析后的歌词时间轴和封面哈希；
+    歌词按 resolve_lyrics 的优先级选取，与 /api/lyrics 一致"""
+    audio = mutagen.File(source_path)
+    if audio is None:
+        raise ValueError(f'不支持的音频格式: {source_path}')
+    duration = audio.info.length or 0
+    bitrate = getattr(audio.info, 'bitrate', 0) or 0
+    return {
+        'v': SIDECAR_VERSION,
+        'id': song_id,
+        'duration': int(duration * 1000),  # 毫秒
+        'bitrate': bitrate // 1000 or None,  # kbps
+        'peaks': compute_peaks(source_path, duration),
+        'lrc': [[ms, line] for ms, line in parse_lrc(resolve_lyrics(song_id, lyrics, lyrics_fallback))],
+        'cover': cover_hash(source_path, cover_path),
+    }
+
+
+class SidecarBuilder:
+    """在线程池中生成元数据副本（解码在 ffmpeg 子进程里完成），写入磁盘缓存"""
+
+    def __init__(self, store=None, workers=2, lyrics_fallback=None):
+        self.store = store or DiskCache(SIDECAR_DIR, ttl=SIDECAR_TTL, max_bytes=512 * 1024 * 1024)
+        self.lyrics_fallback = lyrics_fallback  # lyrics_fallback(歌曲ID) 返回在线歌曲信息里的歌词
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sidecar')
+        self._lock = threading.Lock()
+        self._pending = {}  # 歌曲ID -> Future
+        self._stale = set()  # 生成过程中被失效的歌曲ID，结果不写入缓存
+        self._stats = {'built': 0, 'failures': 0}
+
+    def get_many(self, song_ids):
+        return {song_id: self.store.get(str(song_id)) for song_id in song_ids}
+
+    def submit(self, items):
+        """items 为 [(歌曲ID, 文件路径, 内嵌歌词, 封面路径)]，同一首歌同时只生成一次"""
+        futures = []
+        with self._lock:
+            for song_id, source_path, lyrics, cover_path in items:
+                future = self._pending.get(song_id)
+                if future is None:
+                    future = self._executor.submit(self._build, song_id, source_path, lyrics, cover_path)
+                    self._pending[song_id] = future
+                futures.append(future)
+        return futures
+
+    def _build(self, song_id, source_path, lyrics, cover_path):
+        try:
+            fallback = (lambda: self.lyrics_fallback(song_id)) if self.lyrics_fallback else None
+            sidecar = build_sidecar(song_id, source_path, lyrics, cover_path, fallback)
+            with self._lock:
+                if song_id in self._stale:
+                    return None
+                self.store.set(str(song_id), sidecar)
+            self._stats['built'] += 1
+            return sidecar
+        except Exception as e:
+            self._stats['failures'] += 1
+            print(f'生成元数据副本失败 {song_id}:', e)
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(song_id, None)
+                self._stale.discard(song_id)
+
+    def invalidate(self, song_id):
+        """歌曲内容变化（重新入库、编辑歌词）后删除磁盘上的副本，下次请求时重新生成；
+        正在生成的旧副本不再写入"""
+        song_id = int(song_id)
+        with self._lock:
+            self.store.delete(str(song_id))
+            if song_id in self._pending:
+                self._stale.add(song_id)
+
+    def wait(self, futures):
+        wait(futures)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self._stats, pending=pending, store=self.store.stats())
+
+
+def backfill(missing_only=True, workers=None):
+    """为数据库中已有本地文件的歌曲补齐元数据副本"""
+    from database import get_db_connection
+
+    builder = SidecarBuilder(workers=workers or os.cpu_count() or 2)
+    with get_db_connection().get_connection() as db:
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT SongID, FilePath, Lyrics, CoverImagePath FROM songs WHERE FilePath IS NOT NULL")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    items = [row for row in rows if os.path.exists(row[1]) and not (missing_only and builder.store.get(str(row[0])))]
+    print(f'需要生成 {len(items)} 首歌曲的元数据副本')
+    builder.wait(builder.submit(items))
+    print(builder.stats())
+
+
+if __name__ == '__main__':
+    backfill(missing_only='--all' not in sys.argv)
@@ -0,0 +1,205 @@
+import base64
+import os
+
+import mutagen
+from mutagen.flac import Picture
+from mutagen.id3 import ID3
+from mutagen.mp4 import MP4, MP4Cover
+
+# mutagen 文件类型 -> 编码名称，写入 songs.Codec
+CODECS = {
+    'MP3': 'mp3',
+    'FLAC': 'flac',
+    'OggVorbis': 'vorbis',
+    'OggOpus': 'opus',
+    'OggFLAC': 'flac',
+}
+
+# MP4 原子名 -> 统一的字段名
+MP4_KEYS = {
+    'title': '\xa9nam', 'artist': '\xa9ART', 'genre': '\xa9gen', 'album': '\xa9alb', 'album_artist': 'aART',
+    'date': '\xa9day', 'composer': '\xa9wrt', 'comments': '\xa9cmt', 'lyrics': '\xa9lyr',
+}
+
+# Vorbis Comment（FLAC/Ogg）的字段名，按顺序取第一个存在的
+VORBIS_KEYS = {
+    'title': ('title',), 'artist': ('artist',), 'genre': ('genre',), 'album': ('album',),
+    'album_artist': ('albumartist', 'album artist'), 'date': ('date', 'year'), 'track': ('tracknumber',),
+    'disc': ('discnumber',), 'composer': ('composer',), 'lyricist': ('lyricist',),
+    'comments': ('comment', 'description'), 'lyrics': ('lyrics', 'unsyncedlyrics'),
+}
+
+
+def convert_id3_timestamp(year_tag):
+    try:
+        timestamp_str = year_tag.text[0]
+        # 处理不同格式的时间戳（YYYY、YYYY-MM-DD等）
+        return int(timestamp_str.split('-')[0]) if timestamp_str else None
+    except (TypeError, IndexError, AttributeError, ValueError):
+        return None
+
+
+def parse_year(value):
+    try:
+        return int(str(value).split('-')[0]) if value else None
+    except ValueError:
+        return None
+
+
+def parse_number(value):
+    """解析分轨格式（如"1/2"）并返回第一个数字"""
+    try:
+        return int(value.split('/')[0].strip()) if value else None
+    except (ValueError, AttributeError):
+        return None
+
+
+def _id3_fields(id3v2):
+    """ID3（MP3 等）"""
+    def text(frame_id):
+        frame = id3v2.get(frame_id)
+        return frame.text[0] if frame else None
+
+    # 评论（优先获取英文评论）
+    comments = None
+    comm_frame = id3v2.get("COMM::eng") or id3v2.get("COMM")
+    if comm_frame:
+        comments = comm_frame.text[0] if isinstance(comm_frame.text, list) else comm_frame.text
+
+    # 歌词处理
+    lyrics = None
+    uslt_frame = next((frame for frame in id3v2.getall("USLT") if frame), None)
+    if uslt_frame:
+        lyrics = uslt_frame.text if isinstance(uslt_frame.text, str) else uslt_frame.text[0]
+
+    return {
+        'title': text("TIT2"), 'artist': text("TPE1"), 'genre': text("TCON"), 'album': text("TALB"),
+        'album_artist': text("TPE2"), 'year': convert_id3_timestamp(id3v2.get("TDRC") or id3v2.get("TYER")),
+        'track_number': parse_number(text("TRCK")), 'disc_number': parse_number(text("TPOS")),
+        'composer': text("TCOM"), 'lyricist': text("TEXT"), 'comments': comments, 'lyrics': lyrics,
+    }
+
+
+def _mp4_fields(tags):
+    """MP4 原子（M4A/AAC/ALAC）"""
+    def text(key):
+        value = tags.get(MP4_KEYS[key])
+        return str(value[0]) if value else None
+
+    def pair(key):
+        value = tags.get(key)
+        return value[0][0] or None if value else None
+
+    fields = {key: text(key) for key in MP4_KEYS if key != 'date'}
+    fields.update(year=parse_year(text('date')), track_number=pair('trkn'), disc_number=pair('disk'),
+                  lyricist=None)
+    return fields
+
+
+def _vorbis_fields(tags):
+    """Vorbis Comment（FLAC/Ogg Vorbis/Opus）"""
+    def text(key):
+        for name in VORBIS_KEYS[key]:
+            value = tags.get(name)
+            if value:
+                return value[0]
+        return None
+
+    fields = {key: text(key) for key in VORBIS_KEYS if key not in ('date', 'track', 'disc')}
+    fields.update(year=parse_year(text('date')), track_number=parse_number(text('track')),
+                  disc_number=parse_number(text('disc')))
+    return fields
+
+
+def _codec(audio):
+    if isinstance(audio, MP4):
+        codec = getattr(audio.info, 'codec', '') or ''
+        return 'alac' if codec == 'alac' else 'aac'
+    return CODECS.get(type(audio).__name__, type(audio).__name__.lower())
+
+
+def open_audio(file_path):
+    audio = mutagen.File(file_path)
+    if audio is None:
+        raise ValueError(f'不支持的音频格式: {file_path}')
+    return audio
+
+
+def read_song_tags(file_path):
+    """读取音频文件的标签和技术信息，返回字典；支持 MP3、FLAC、M4A、OGG/Opus"""
+    audio = open_audio(file_path)
+    tags = audio.tags
+    if isinstance(tags, ID3):
+        fields = _id3_fields(tags)
+    elif isinstance(audio, MP4):
+        fields = _mp4_fields(tags or {})
+    elif tags is not None:
+        fields = _vorbis_fields(tags)
+    else:
+        fields = {}
+
+    # 基础信息
+    artist = fields.get('artist') or "Unknown Artist"
+    title = fields.get('title') or os.path.splitext(os.path.basename(file_path))[0]
+    lyricist = fields.get('lyricist')
+    if lyricist and len(lyricist) > 100:
+        lyricist = lyricist[:100]
+    year = fields.get('year')
+
+    # 音频技术信息
+    info = audio.info
+    bitrate = getattr(info, 'bitrate', None)
+    if not bitrate and info.length:
+        # 部分格式拿不到比特率时按文件大小估算
+        bitrate = int(os.path.getsize(file_path) * 8 / info.length)
+    return {
+        'file_path': file_path,
+        'title': title,
+        'artist': artist,
+        'genre': fields.get('genre') or "Unknown Genre",
+        'duration': int(info.length),
+        'album': fields.get('album') or "Unknown Album",
+        'album_artist': fields.get('album_artist') or artist,
+        'year': year,
+        'release_date': f"{year}-01-01" if year else None,
+        'track_number': fields.get('track_number'),
+        'disc_number': fields.get('disc_number'),
+        'composer': fields.get('composer'),
+        'lyricist': lyricist,
+        'comments': fields.get('comments'),
+        'lyrics': fields.get('lyrics'),
+        'channels': getattr(info, 'channels', None),
+        'bitrate': bitrate // 1000 if bitrate else None,  # kbps
+        'sample_rate': getattr(info, 'sample_rate', None),
+        'bit_depth': getattr(info, 'bits_per_sample', None),
+        'codec': _codec(audio),
+    }
+
+
+def read_cover(file_path):
+    """读取内嵌封面，返回 (图片数据, MIME 类型)，没有封面时返回 None"""
+    audio = open_audio(file_path)
+    tags = audio.tags
+    if tags is None:
+        return None
+    if isinstance(tags, ID3):
+        frame = next(iter(tags.getall("APIC")), None)
+        return (frame.data, frame.mime) if frame else None
+    if isinstance(audio, MP4):
+        covers = tags.get('covr')
+        if not covers:
+            return None
+        cover = covers[0]
+        return bytes(cover), 'image/png' if cover.imageformat == MP4Cover.FORMAT_PNG else 'image/jpeg'
+    # FLAC 的图片块，Ogg 的 METADATA_BLOCK_PICTURE 字段（base64 编码的 FLAC 图片块）
+    pictures = list(getattr(audio, 'pictures', None) or [])
+    for value in tags.get('metadata_block_picture', []):
+        try:
+            pictures.append(Picture(base64.b64decode(value)))
+        except (ValueError, TypeError):
+            continue
+    if not pictures:
+        return None
+    # 优先取封面（类型 3）
+    picture = next((p for p in pictures if p.type == 3), pictures[0])
+    return picture.data, picture.mime
@@ -0,0 +1,60 @@
+import pytest
+from flask import Flask
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+
+from audio_stream import parse_range, send_audio
+
+
+def test_parse_range_without_header():
+    assert parse_range(None, 100) is None
+    assert parse_range('items=0-10', 100) is None
+
+
+def test_parse_range_closed_and_open():
+    assert parse_range('bytes=0-9', 100) == (0, 9)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=90-200', 100) == (90, 99)
+
+
+def test_parse_range_suffix():
+    assert parse_range('bytes=-10', 100) == (90, 99)
+    assert parse_range('bytes=-500', 100) == (0, 99)
+
+
+def test_parse_range_invalid_is_ignored():
+    assert parse_range('bytes=abc-def', 100) is None
+    assert parse_range('bytes=20-10', 100) is None
+    assert parse_range('bytes=10', 100) is None
+
+
+def test_parse_range_unsatisfiable():
+    with pytest.raises(RequestedRangeNotSatisfiable):
+        parse_range('bytes=100-', 100)
+    with pytest.raises(RequestedRangeNotSatisfiable):
+        parse_range('bytes=-0', 100)
+    with pytest.raises(RequestedRangeNotSatisfiable):
+        parse_range('bytes=0-1,5-6', 100)
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'song.mp3'
+    path.write_bytes(bytes(range(256)) * 4)
+    app = Flask(__name__)
+    app.add_url_rule('/audio', 'audio', lambda: send_audio(str(path)))
+    return app.test_client()
+
+
+def test_send_audio_range(client):
+    response = client.get('/audio', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 10-19/1024'
+    assert response.data == bytes(range(10, 20))
+
+
+def test_send_audio_conditional(client):
+    etag = client.get('/audio').headers['ETag']
+    assert client.get('/audio', headers={'If-None-Match': etag}).status_code == 304
+    # If-Range 不匹配时返回完整文件
+    response = client.get('/audio', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200 and len(response.data) == 1024
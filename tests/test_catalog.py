@@ -0,0 +1,120 @@
+from datetime import date, datetime
+
+import pytest
+
+import catalog
+from catalog import PLAY_COUNT_QUERY, TABLES, Catalog, CatalogSnapshot, build
+
+# SongID, Title, ArtistID, AlbumID, Genre, Duration, ReleaseDate, FilePath, Lyrics, Language,
+# PlayCount, CreateTime, UpdateTime
+SONGS = [
+    (1, '晴天', 10, 100, '流行', 269, date(2003, 7, 31), '/music/晴天.flac', '故事的小黄花', '国语', 5,
+     datetime(2024, 1, 1, 8, 30, 15), datetime(2024, 2, 1, 9, 0)),
+    (2, '', 10, None, None, None, None, '/music/2.mp3', None, None, None, datetime(2024, 1, 2), None),
+    (3, 'Intro', 20, 100, 'Rock', 60, date(1969, 12, 31), '/music/3.mp3', '', 'English', 0,
+     datetime(1969, 12, 31, 23, 59, 59), None),
+    (4, '无名', 99, 200, None, 100, None, '/music/4.mp3', None, None, 0, datetime(2024, 1, 3), None),
+]
+ARTISTS = [(10, '周杰伦'), (20, 'Band')]
+ALBUMS = [(100, '叶惠美', 10), (200, '孤儿专辑', 99)]
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        tables = {TABLES['songs'][0]: SONGS, TABLES['artists'][0]: ARTISTS, TABLES['albums'][0]: ALBUMS}
+        if query in tables:
+            self.rows = tables[query]
+        elif query.startswith('SELECT COUNT(*)'):
+            self.rows = [(len(SONGS), self.db.max_id, None)]
+        elif query == PLAY_COUNT_QUERY:
+            self.rows = [(self.db.play_counts[params[0]],)] if params[0] in self.db.play_counts else []
+        else:
+            raise AssertionError(query)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self):
+        self.max_id = 4
+        self.play_counts = {row[0]: row[10] for row in SONGS}
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    monkeypatch.setattr(catalog, 'get_db_connection', lambda: fake)
+    return fake
+
+
+def test_columns_round_trip(db, tmp_path):
+    snapshot = CatalogSnapshot(build(str(tmp_path)))
+    for row in SONGS:
+        info = snapshot.song_info(row[0])
+        assert [info[key] for key in ('id', 'title', 'artist', 'album', 'genre', 'duration', 'releaseDate',
+                                      'filePath', 'lyrics', 'language', 'playCount', 'createTime',
+                                      'updateTime')] == list(row)
+    assert snapshot.stats()['songs'] == 4 and snapshot.stats()['albums'] == 2
+
+
+def test_grouped_lookups(db, tmp_path):
+    snapshot = CatalogSnapshot(build(str(tmp_path)))
+    # 与 JOIN artists 的结果一致：歌手不存在的歌曲不出现
+    assert snapshot.artist_songs(10) == [(1, '晴天', '周杰伦'), (2, '', '周杰伦')]
+    assert snapshot.artist_songs(20) == [(3, 'Intro', 'Band')]
+    assert snapshot.album_songs(100) == [(1, '晴天', '周杰伦'), (3, 'Intro', 'Band')]
+    assert snapshot.album_songs(200) == []
+    rows, missing = snapshot.songs_by_ids([3, 4, 1, 5])
+    assert rows == {3: (3, 'Intro', 'Band'), 1: (1, '晴天', '周杰伦')}
+    assert missing == [5]
+
+
+def test_missing_ids_fall_through(db, tmp_path):
+    library = Catalog(str(tmp_path), build=False)
+    # 还没有快照时都交给数据库
+    assert library.song_info(1) is None
+    assert library.artist_songs(10) is None
+    assert library.songs_by_ids([1, 2]) == ({}, [1, 2])
+
+    library.build_enabled = True
+    assert library.build()
+    assert library.song_info(9) is None
+    assert library.artist_songs(30) is None
+    assert library.album_songs(300) is None
+    assert library.song_info(1)['title'] == '晴天'
+    assert library.stats()['fallbacks'] == 6 and library.stats()['hits'] == 1
+
+
+def test_play_count_is_read_live(db, tmp_path):
+    library = Catalog(str(tmp_path))
+    library.build()
+    db.play_counts[1] = 42
+    assert library.song_info(1)['playCount'] == 42
+    # 快照生成后删除的歌曲交给数据库
+    del db.play_counts[1]
+    assert library.song_info(1) is None
+    # 签名没变时不重建
+    assert library.build() is None
@@ -0,0 +1,75 @@
+import os
+import time
+
+from PIL import Image
+
+import covers
+from covers import CoverRenditions, pick_size
+
+
+def wait_idle(renditions, timeout=10):
+    deadline = time.monotonic() + timeout
+    while renditions._pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not renditions._pending
+
+
+def test_pick_size():
+    assert pick_size(10) == 64
+    assert pick_size(64) == 64
+    assert pick_size(300) == 1024
+    assert pick_size(5000) == 1024
+
+
+def test_render_generates_in_background(tmp_path):
+    source = str(tmp_path / 'cover.png')
+    Image.new('RGB', (600, 400), 'red').save(source)
+    renditions = CoverRenditions(str(tmp_path / 'renditions'))
+    # 第一次请求不等待生成，由调用方返回原图
+    assert renditions.render(source, 200, 'jpeg') is None
+    wait_idle(renditions)
+    name, path = renditions.render(source, 200, 'jpeg')
+    assert name.endswith('_256.jpg') and os.path.exists(path)
+    with Image.open(path) as img:
+        assert img.size == (256, 171)
+
+
+def test_render_corrupt_image_is_not_retried(tmp_path):
+    source = str(tmp_path / 'cover.png')
+    with open(source, 'wb') as f:
+        f.write(b'not an image')
+    renditions = CoverRenditions(str(tmp_path / 'renditions'))
+    assert renditions.render(source, 64, 'jpeg') is None
+    wait_idle(renditions)
+    assert len(renditions._failed) == 1
+    assert renditions.render(source, 64, 'jpeg') is None
+    assert not renditions._pending
+
+
+def test_missing_source_returns_none(tmp_path):
+    renditions = CoverRenditions(str(tmp_path / 'renditions'))
+    assert renditions.render(str(tmp_path / 'missing.png'), 64, 'jpeg') is None
+
+
+def test_hash_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(covers, 'HASH_CACHE_SIZE', 2)
+    renditions = CoverRenditions(str(tmp_path / 'renditions'))
+    for i in range(4):
+        source = str(tmp_path / f'{i}.png')
+        Image.new('RGB', (8, 8), (i, 0, 0)).save(source)
+        renditions.rendition_name(source, 64, 'jpeg')
+    assert len(renditions._hashes) == 2
+
+
+def test_renditions_from_original_jpeg(tmp_path):
+    # 提取出的原图保留 JPEG 格式，尺寸版本直接从它生成
+    source = str(tmp_path / '7.jpg')
+    Image.new('RGB', (1200, 1200), 'blue').save(source, format='JPEG')
+    assert covers.source_mimetype(source) == 'image/jpeg'
+    assert covers.source_mimetype(str(tmp_path / '0.png')) == 'image/png'
+    renditions = CoverRenditions(str(tmp_path / 'renditions'))
+    renditions.render(source, 64, 'jpeg')
+    wait_idle(renditions)
+    name, path = renditions.render(source, 64, 'jpeg')
+    with Image.open(path) as img:
+        assert img.size == (64, 64)
@@ -0,0 +1,131 @@
+import queue
+import threading
+
+import mysql.connector
+import pytest
+
+import database
+
+
+class FakeConnection:
+    def __init__(self, fail_reset=False, fail_reconnect=False):
+        self.fail_reset = fail_reset
+        self.fail_reconnect = fail_reconnect
+        self.connected = True
+        self.reconnects = 0
+
+    def reset_session(self):
+        if self.fail_reset:
+            raise mysql.connector.errors.OperationalError('reset failed')
+
+    def disconnect(self):
+        self.connected = False
+
+    def reconnect(self, attempts=1, delay=0):
+        if self.fail_reconnect:
+            raise mysql.connector.errors.InterfaceError('reconnect failed')
+        self.connected = True
+        self.reconnects += 1
+        self.fail_reset = False
+
+
+class FakePool:
+    reset_session = True
+    pool_size = 2
+
+    def __init__(self):
+        self._cnx_queue = queue.Queue(self.pool_size)
+
+    def add_connection(self, cnx):
+        self._cnx_queue.put(cnx, block=False)
+
+
+class BorrowPool(FakePool):
+    """借出时检查共享连接池的锁没有被占用"""
+
+    def __init__(self, shared):
+        super().__init__()
+        self.shared = shared
+        self.locked_during_borrow = []
+
+    def get_connection(self):
+        self.locked_during_borrow.append(self.shared._lock.locked())
+        try:
+            return FakePooled(self, self._cnx_queue.get_nowait())
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError('exhausted')
+
+
+class FakePooled:
+    def __init__(self, pool, cnx):
+        self._cnx_pool = pool
+        self._cnx = cnx
+
+
+@pytest.fixture
+def pool():
+    shared = database.SharedConnectionPool.__new__(database.SharedConnectionPool)
+    shared._lock = threading.Lock()
+    shared._available = threading.Condition(shared._lock)
+    shared._created_at = {}
+    shared._released_at = {}
+    shared._releases = 0
+    shared.wait_timeout = 2.0
+    shared.max_lifetime = 0
+    shared.validate_idle = 30.0
+    shared._stats = {'borrowed': 0, 'in_use': 1, 'peak_in_use': 1, 'waits': 0, 'wait_time': 0.0, 'max_wait': 0.0,
+                     'timeouts': 0, 'hold_time': 0.0}
+    shared._pool = FakePool()
+    return shared
+
+
+def test_release_returns_connection(pool):
+    cnx = FakeConnection()
+    pool.release(FakePooled(pool._pool, cnx), 0.1)
+    assert pool._pool._cnx_queue.get_nowait() is cnx
+    assert id(cnx) in pool._released_at
+    assert pool._stats['in_use'] == 0
+
+
+def test_release_reconnects_when_reset_fails(pool):
+    cnx = FakeConnection(fail_reset=True)
+    pool._created_at[id(cnx)] = 0.0
+    pool.release(FakePooled(pool._pool, cnx), 0.1)
+    assert cnx.reconnects == 1 and cnx.connected
+    assert pool._pool._cnx_queue.get_nowait() is cnx
+    assert pool._pool._cnx_queue.empty()
+    assert id(cnx) not in pool._created_at
+    assert pool._stats['in_use'] == 0
+
+
+def test_release_keeps_capacity_when_reconnect_fails(pool):
+    cnx = FakeConnection(fail_reset=True, fail_reconnect=True)
+    pool.release(FakePooled(pool._pool, cnx), 0.1)
+    # 断开的连接放回队列，下次借出时由连接池重连
+    assert pool._pool._cnx_queue.get_nowait() is cnx
+    assert not cnx.connected
+    assert pool._stats['in_use'] == 0
+
+
+def test_release_from_old_pool_disconnects(pool):
+    cnx = FakeConnection()
+    pool.release(FakePooled(FakePool(), cnx), 0.1)
+    assert not cnx.connected
+    assert pool._pool._cnx_queue.empty()
+    assert pool._stats['in_use'] == 0
+
+
+def test_borrow_does_not_hold_lock_and_waits_for_release(pool):
+    pool._pool = BorrowPool(pool)
+    pool._stats['in_use'] = 0
+    pool._pool.add_connection(FakeConnection())
+    first = pool.get_connection()
+    assert pool._pool.locked_during_borrow == [False]
+
+    released = threading.Timer(0.05, first.close)
+    released.start()
+    second = pool.get_connection()
+    released.join()
+    assert second._cnx is not None
+    assert not any(pool._pool.locked_during_borrow)
+    assert pool._stats['waits'] == 1 and pool._stats['in_use'] == 1
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import disk_cache
+from disk_cache import DiskCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(disk_cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_get_set_roundtrip(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', {'x': [1, 2]})
+    assert cache.get('a') == {'x': [1, 2]}
+    # 新实例从磁盘读取
+    assert DiskCache(str(tmp_path), ttl=60).get('a') == {'x': [1, 2]}
+
+
+def test_ttl_and_stale_entries(tmp_path, clock):
+    cache = DiskCache(str(tmp_path), ttl=10, stale_ttl=20)
+    cache.set('a', 1)
+    clock[0] += 15
+    assert cache.get('a') is None
+    value, expires = cache.get_entry('a')
+    assert value == 1 and expires < clock[0]
+    clock[0] += 20
+    assert cache.get_entry('a') == (None, None)
+    assert cache.stats()['entries'] == 0
+
+
+def test_purge_expired(tmp_path, clock):
+    cache = DiskCache(str(tmp_path), ttl=10, stale_ttl=0)
+    cache.set('old', 1)
+    clock[0] += 5
+    cache.set('new', 2)
+    clock[0] += 6
+    assert cache.purge_expired() == 1
+    assert cache.get('new') == 2
+
+
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60, max_bytes=1200, memory_items=1)
+    for i in range(4):
+        cache.set(f'k{i}', 'x' * 200)
+    cache.get('k0')  # k0 变为最近访问
+    cache.set('k4', 'x' * 200)
+    stats = cache.stats()
+    assert stats['bytes'] <= 1200 and stats['evictions'] > 0
+    assert cache.get('k0') is not None
+    assert cache.get('k1') is None
+
+
+def test_delete_and_forget(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=60)
+    cache.set('a', 1)
+    other = DiskCache(str(tmp_path), ttl=60)
+    other.set('a', 2)
+    assert cache.get('a') == 1  # 内存副本
+    cache.forget('a')
+    assert cache.get('a') == 2
+    cache.delete('a')
+    assert DiskCache(str(tmp_path), ttl=60).get('a') is None
+
+
+def test_cap_counts_entries_written_by_other_processes(tmp_path):
+    # 两个实例模拟两个进程，各自的写入都没有超过上限，但磁盘上的总量超过了
+    first = DiskCache(str(tmp_path), ttl=60, max_bytes=2000)
+    second = DiskCache(str(tmp_path), ttl=60, max_bytes=2000)
+    first.stats()
+    second.stats()
+    for i in range(5):
+        first.set(f'a{i}', 'x' * 200)
+        second.set(f'b{i}', 'x' * 200)
+    on_disk = sum(f.stat().st_size for f in tmp_path.glob('*/*.json'))
+    assert on_disk <= 2000
+    assert first.stats()['evictions'] + second.stats()['evictions'] > 0
+
+
+def test_compact_purges_expired_on_disk(tmp_path, clock):
+    writer = DiskCache(str(tmp_path), ttl=10, stale_ttl=0)
+    writer.set('old', 1)
+    clock[0] += 11
+    writer.set('new', 2)
+    other = DiskCache(str(tmp_path), ttl=10, stale_ttl=0)
+    assert other.compact(purge=True) == 1
+    assert len(list(tmp_path.glob('*/*.json'))) == 1
+    assert other.get('new') == 2
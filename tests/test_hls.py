@@ -0,0 +1,89 @@
+import os
+import stat
+import sys
+
+import pytest
+
+from hls import HlsPackager
+from transcode import Transcoder
+
+# 代替 ffmpeg：记录调用次数，按 -hls_segment_filename 模板写出 SEGMENTS 个分片和对应的播放列表
+FAKE_FFMPEG = '''#!{python}
+import os, sys
+args = sys.argv[1:]
+with open({log!r}, 'a') as f:
+    f.write(' '.join(args) + '\\n')
+pattern = args[args.index('-hls_segment_filename') + 1]
+lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0',
+         '#EXT-X-PLAYLIST-TYPE:VOD']
+for i, length in enumerate({lengths!r}):
+    with open(pattern % i, 'wb') as f:
+        f.write(b'segment %d' % i)
+    lines += ['#EXTINF:%.6f,' % length, os.path.basename(pattern % i)]
+with open(args[-1], 'w') as f:
+    f.write('\\n'.join(lines + ['#EXT-X-ENDLIST']) + '\\n')
+'''
+
+
+@pytest.fixture
+def packager(tmp_path, monkeypatch):
+    log = str(tmp_path / 'ffmpeg.log')
+    script = tmp_path / 'ffmpeg'
+    script.write_text(FAKE_FFMPEG.format(python=sys.executable, log=log, lengths=[6.016, 5.995, 2.989]))
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    source = tmp_path / 'song.flac'
+    source.write_bytes(b'audio')
+    transcoder = Transcoder(str(tmp_path / 'renditions'), ffmpeg=str(script))
+    packager = HlsPackager(transcoder)
+    monkeypatch.setattr(packager, 'source_signature', lambda path: 'abc')
+    packager.log = log
+    packager.source = str(source)
+    return packager
+
+
+def calls(packager):
+    with open(packager.log) as f:
+        return f.read().splitlines()
+
+
+def test_media_playlist_comes_from_the_encode(packager):
+    playlist = packager.media_playlist(7, packager.source, 128)
+    # 分片数量和时长以 ffmpeg 实际生成的为准，不按歌曲时长推算
+    assert '#EXTINF:6.016000,\nabc_0.ts' in playlist
+    assert '#EXTINF:2.989000,\nabc_2.ts\n#EXT-X-ENDLIST' in playlist
+    assert playlist.count('.ts') == 3
+    # 之后请求分片不再编码
+    packager.segment(7, packager.source, 128, 'abc', 2)
+    assert len(calls(packager)) == 1
+
+
+def test_all_segments_come_from_one_encode(packager):
+    first = packager.segment(7, packager.source, 128, 'abc', 1)
+    with open(first, 'rb') as f:
+        assert f.read() == b'segment 1'
+    for index in (0, 2):
+        with open(packager.segment(7, packager.source, 128, 'abc', index), 'rb') as f:
+            assert f.read() == b'segment %d' % index
+    [command] = calls(packager)
+    assert '-f hls' in command and '-hls_time 6' in command and '-ss' not in command
+    # 临时目录已清理，只留下分片
+    root = packager.transcoder.store.root
+    assert not [name for name in os.listdir(root) if name.endswith('.tmp')]
+    assert packager.transcoder.store.stats()['files'] == 4  # 3 个分片加播放列表
+
+
+def test_each_bitrate_is_encoded_separately(packager):
+    packager.segment(7, packager.source, 64, 'abc', 0)
+    packager.segment(7, packager.source, 192, 'abc', 0)
+    assert len(calls(packager)) == 2
+
+
+def test_unknown_segment(packager):
+    with pytest.raises(LookupError):
+        packager.segment(7, packager.source, 128, 'old', 0)
+    with pytest.raises(LookupError):
+        packager.segment(7, packager.source, 128, 'abc', 3)
+    # 越界的序号不会触发重新编码
+    with pytest.raises(LookupError):
+        packager.segment(7, packager.source, 128, 'abc', 4)
+    assert len(calls(packager)) == 1
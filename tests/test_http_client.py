@@ -0,0 +1,89 @@
+import pytest
+import requests
+
+import http_client
+from http_client import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http_client.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow() and breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_probe(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow() and breaker.state == 'half_open'
+    # 试探请求进行中时拒绝其他请求
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.failures == 0 and breaker.allow()
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+def make_client(monkeypatch, session, **kwargs):
+    client = HttpClient(**kwargs)
+    monkeypatch.setattr(http_client.time, 'sleep', lambda seconds: None)
+    _, breaker, stats = client._host_state('upstream')
+    client._sessions['upstream'] = session
+    return client, breaker, stats
+
+
+def test_request_retries_temporary_errors(monkeypatch):
+    session = FakeSession(requests.ConnectionError(), 503, 200)
+    client, breaker, stats = make_client(monkeypatch, session, max_retries=2)
+    assert client.get('http://upstream/a').status_code == 200
+    assert session.calls == 3
+    assert stats.retries == 2 and stats.errors == 2
+    assert breaker.state == 'closed'
+
+
+def test_request_other_exceptions_release_half_open_probe(monkeypatch, clock):
+    session = FakeSession(requests.exceptions.TooManyRedirects(), 200)
+    client, breaker, stats = make_client(monkeypatch, session, max_retries=0)
+    breaker.state, breaker.opened_at = 'open', clock[0] - breaker.reset_timeout
+    with pytest.raises(requests.exceptions.TooManyRedirects):
+        client.get('http://upstream/a')
+    assert breaker.state == 'open' and stats.errors == 1
+    with pytest.raises(CircuitOpenError):
+        client.get('http://upstream/a')
+    clock[0] += breaker.reset_timeout
+    assert client.get('http://upstream/a').status_code == 200
+    assert breaker.state == 'closed'
@@ -0,0 +1,275 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import ingest
+from manifest import Manifest, partial_hash
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, query, params=()):
+        self.result = [(path,) for path in self.db.paths if path.startswith(params[0][:-1])]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self):
+        self.paths = []
+
+    def get_connection(self):
+        return self
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        pass
+
+
+class FakeWriter:
+    """只记录写入的路径，flush 时视为已提交"""
+
+    def __init__(self, db, batch_size, **kwargs):
+        self.db = db
+        self.cursor = db.cursor()
+        self.batch_size = batch_size
+        self.pending = []
+        self.written = 0
+        self.sidecar_futures = []
+
+    def add(self, tags, defaults, song_id=None):
+        self.pending.append(tags['file_path'])
+        return len(self.pending) >= self.batch_size
+
+    def flush(self):
+        if self.db.fail_after is not None and len(self.db.paths) + len(self.pending) > self.db.fail_after:
+            raise RuntimeError('interrupted')
+        self.db.paths += self.pending
+        self.written += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    fake.fail_after = None
+    monkeypatch.setattr(ingest, 'get_db_connection', lambda: fake)
+    monkeypatch.setattr(ingest, 'BatchWriter', FakeWriter)
+    monkeypatch.setattr(ingest, 'ProcessPoolExecutor', ThreadPoolExecutor)
+    monkeypatch.setattr(ingest, 'read_song_tags', lambda path: {'file_path': path})
+    return fake
+
+
+def make_files(folder, names):
+    for name in names:
+        (folder / name).write_bytes(b'')
+
+
+def test_resume_skips_committed_files_after_folder_changes(db, tmp_path):
+    folder = tmp_path / 'music'
+    folder.mkdir()
+    make_files(folder, ['b.mp3', 'c.mp3', 'd.mp3', 'e.mp3'])
+    checkpoint = str(tmp_path / 'checkpoint.json')
+
+    db.fail_after = 2
+    with pytest.raises(RuntimeError):
+        ingest.batch_ingest(str(folder), batch_size=2, checkpoint_path=checkpoint)
+    assert [p.rsplit('/', 1)[1] for p in db.paths] == ['b.mp3', 'c.mp3']
+    assert ingest.load_checkpoint(checkpoint, str(folder)) == 2
+
+    # 中断后排在前面的文件新增、已导入的文件删除，续传时既不跳过新文件也不重复导入
+    make_files(folder, ['a.mp3'])
+    (folder / 'b.mp3').unlink()
+    db.fail_after = None
+    ingest.batch_ingest(str(folder), batch_size=2, checkpoint_path=checkpoint)
+    assert sorted(p.rsplit('/', 1)[1] for p in db.paths) == ['a.mp3', 'b.mp3', 'c.mp3', 'd.mp3', 'e.mp3']
+
+
+def test_checkpoint_for_other_folder_is_ignored(tmp_path):
+    checkpoint = str(tmp_path / 'checkpoint.json')
+    assert ingest.load_checkpoint(checkpoint, '/music') is None
+    ingest.save_checkpoint(checkpoint, '/music', 3)
+    assert ingest.load_checkpoint(checkpoint, '/music') == 3
+    assert ingest.load_checkpoint(checkpoint, '/other') is None
+
+
+class DimensionCursor:
+    """模拟 artists/albums 表：插入时分配自增 ID，按名称查回"""
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.result = []
+
+    def execute(self, query, params=()):
+        if query.startswith('SELECT Name, ArtistID FROM artists WHERE'):
+            self.result = [(name, i) for i, name in self.tables['artists'].items() if name in params]
+        elif query.startswith('SELECT Title, ArtistID, AlbumID FROM albums WHERE'):
+            self.result = [(title, artist, i) for i, (title, artist) in self.tables['albums'].items()
+                           if title in params]
+        else:
+            self.result = []
+
+    def executemany(self, query, rows):
+        table = 'artists' if 'INTO artists' in query else 'albums'
+        for row in rows:
+            self.tables['next'] += 1
+            self.tables[table][self.tables['next']] = row[0] if table == 'artists' else (row[0], row[1])
+
+    def fetchall(self):
+        return self.result
+
+
+def test_dimension_ids_are_shared_only_after_commit():
+    tables = {'artists': {}, 'albums': {}, 'next': 0}
+    cache = ingest.DimensionCache()
+    first, second = DimensionCursor(tables), DimensionCursor(tables)
+
+    [(artist_id, album_id)] = cache.resolve(first, [('Band', 'Record', 'Band')])
+    # 第一个写入方还没提交，另一个写入方看不到它新建的 ID
+    assert 'band' not in cache.artists
+    assert cache.resolve(first, [('Band', 'Record', 'Band')]) == [(artist_id, album_id)]
+
+    # 回滚后这些 ID 不会被任何写入方使用
+    cache.rollback(first)
+    for i in (artist_id, album_id):
+        tables['artists'].pop(i, None)
+        tables['albums'].pop(i, None)
+    [(artist_id, album_id)] = cache.resolve(second, [('Band', 'Record', 'Band')])
+    assert artist_id in tables['artists'] and album_id in tables['albums']
+
+    cache.commit(second)
+    assert cache.artists['band'] == artist_id
+    assert cache.resolve(first, [('band ', 'Record', 'Band')]) == [(artist_id, album_id)]
+
+
+class SchemaDb:
+    """模拟 information_schema：记录已有的列和索引，执行 ALTER/CREATE INDEX 后更新"""
+
+    def __init__(self, columns, indexes):
+        self.columns = set(columns)
+        self.indexes = set(indexes)
+        self.statements = []
+        self.result = []
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=()):
+        if 'information_schema.COLUMNS' in query:
+            self.result = [(int(params[1] in self.columns),)]
+        elif 'information_schema.STATISTICS' in query:
+            self.result = [('FilePath',)] if params[1] in self.indexes else []
+        else:
+            self.statements.append(query)
+            if query.startswith('ALTER TABLE songs ADD COLUMN'):
+                self.columns.add(query.split()[5])
+            elif query.startswith('CREATE INDEX'):
+                self.indexes.add(query.split()[2])
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_ensure_schema_upgrades_old_songs_table(monkeypatch):
+    db = SchemaDb(columns={'SongID', 'Bitrate'}, indexes=set())
+    monkeypatch.setattr(ingest, 'get_db_connection', lambda: db)
+    assert ingest.ensure_schema() == 3
+    assert {'Codec', 'Orphaned'} <= db.columns and 'idx_file_path' in db.indexes
+    db.statements.clear()
+    assert ingest.ensure_schema() == 0
+    assert db.statements == []
+
+
+class SyncDb:
+    """记录 sync_library 执行的更新，以及提交时已经执行过的语句数"""
+
+    def __init__(self):
+        self.updates = []
+        self.committed = 0
+
+    def get_connection(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=()):
+        self.result = []
+
+    def executemany(self, query, rows):
+        self.updates.append((query.split(' WHERE')[0], [row[-1] for row in rows]))
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        self.committed = len(self.updates)
+
+    def close(self):
+        pass
+
+
+class RecordingBus:
+    def __init__(self, db):
+        self.db = db
+        self.published = []
+
+    def invalidate(self, *tags):
+        # 通知必须在提交之后发出，否则其他进程可能读到旧数据再缓存起来
+        assert self.db.committed == len(self.db.updates)
+        self.published += tags
+
+
+def test_sync_publishes_moved_restored_and_orphaned_songs(monkeypatch, tmp_path):
+    folder = tmp_path / 'music'
+    folder.mkdir()
+    (folder / 'moved.mp3').write_bytes(b'moved')
+    (folder / 'back.mp3').write_bytes(b'back')
+    manifest_path = str(tmp_path / 'manifest.sqlite3')
+    manifest = Manifest(manifest_path)
+    old_path = str(folder / 'old' / 'moved.mp3')
+    manifest.upsert(old_path, 5, 1, partial_hash(str(folder / 'moved.mp3'), 5), 1)
+    back = str(folder / 'back.mp3')
+    st = os.stat(back)
+    manifest.upsert(back, st.st_size, st.st_mtime_ns, partial_hash(back, st.st_size), 2)
+    manifest.mark_missing([back])
+    manifest.upsert(str(folder / 'gone.mp3'), 4, 1, 'gone', 3)
+    manifest.commit()
+    manifest.close()
+
+    db = SyncDb()
+    bus = RecordingBus(db)
+    monkeypatch.setattr(ingest, 'get_db_connection', lambda: db)
+    stats = ingest.sync_library(str(folder), manifest_path=manifest_path, invalidations=bus)
+    assert (stats['moved'], stats['restored'], stats['orphaned']) == (1, 1, 1)
+    assert sorted(bus.published) == ['song:1', 'song:2', 'song:3']
@@ -0,0 +1,195 @@
+import json
+
+import pytest
+from flask import Flask, jsonify
+
+import invalidation
+from invalidation import SEQUENCE_TAG, InvalidationBus, LocalBackend, RedisBackend, tagged_cache
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return LocalBackend(str(tmp_path / 'invalidation'), slots=1024)
+
+
+def test_local_versions_and_events(backend):
+    position = backend.position()
+    assert backend.versions(['song:1', 'song:2']) == [0, 0]
+    backend.invalidate(['song:1'])
+    backend.invalidate(['song:1', 'album:3'])
+    assert backend.versions(['song:1', 'album:3', 'song:2']) == [2, 1, 0]
+
+    events, position = backend.events(position, 0)
+    assert events == [['song:1'], ['song:1', 'album:3']]
+    assert backend.events(position, 0) == ([], position)
+
+
+def test_local_events_survive_several_rotations(backend, monkeypatch):
+    monkeypatch.setattr(invalidation, 'EVENT_LOG_MAX_BYTES', 30)
+    backend.invalidate(['song:0'])
+    position = backend.position()
+    # 每两条事件轮换一次，读取方落后三个文件
+    for i in range(1, 7):
+        backend.invalidate([f'song:{i}'])
+    events, position = backend.events(position, 0)
+    assert events == [[f'song:{i}'] for i in range(1, 7)]
+    backend.invalidate(['song:7'])
+    assert backend.events(position, 0)[0] == [['song:7']]
+
+
+def test_local_reader_behind_all_rotations_keeps_going(backend, monkeypatch):
+    monkeypatch.setattr(invalidation, 'EVENT_LOG_MAX_BYTES', 1)
+    monkeypatch.setattr(invalidation, 'EVENT_LOG_ROTATIONS', 2)
+    backend.invalidate(['song:0'])
+    position = backend.position()
+    for i in range(1, 6):
+        backend.invalidate([f'song:{i}'])
+    # song:1、song:2 所在的文件已删除，从保留下来的文件继续读
+    events, position = backend.events(position, 0)
+    assert events == [['song:3'], ['song:4'], ['song:5']]
+    backend.invalidate(['song:6'])
+    assert backend.events(position, 0)[0] == [['song:6']]
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def incr(self, key):
+        self.commands.append(('incr', key))
+
+    def xadd(self, stream, fields, maxlen, approximate):
+        self.commands.append(('xadd', fields))
+
+    def execute(self):
+        for command, arg in self.commands:
+            if command == 'incr':
+                self.client.values[arg] = self.client.values.get(arg, 0) + 1
+            else:
+                entry_id = f'{len(self.client.entries) + 1}-0'.encode()
+                self.client.entries.append((entry_id, {b'tags': arg['tags'].encode('utf-8')}))
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.entries = []
+
+    def mget(self, keys):
+        return [str(self.values[key]).encode() if key in self.values else None for key in keys]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def xrevrange(self, stream, count):
+        return self.entries[-count:][::-1]
+
+    def xread(self, streams, block, count):
+        [(stream, position)] = streams.items()
+        if isinstance(position, bytes):
+            position = position.decode()
+        start = int(position.split('-')[0])
+        entries = [entry for entry in self.entries if int(entry[0].split(b'-')[0]) > start][:count]
+        return [(stream.encode(), entries)] if entries else []
+
+
+def test_redis_backend(monkeypatch):
+    client = FakeRedis()
+    fake_module = type('redis', (), {'Redis': type('Redis', (), {'from_url': staticmethod(lambda url: client)})})
+    monkeypatch.setattr(invalidation, 'redis', fake_module)
+    backend = RedisBackend('redis://localhost')
+    position = backend.position()
+    assert position == '0-0'
+    assert backend.versions([]) == []
+
+    backend.invalidate(['song:1', 'artist:2'])
+    backend.invalidate(['song:1'])
+    assert backend.versions(['song:1', 'artist:2', 'song:3']) == [2, 1, 0]
+    events, position = backend.events(position, 0.1)
+    assert events == [['song:1', 'artist:2'], ['song:1']]
+    assert position == b'2-0'
+    assert backend.events(position, 0.1) == ([], position)
+    assert backend.position() == b'2-0'
+
+
+def test_redis_backend_requires_client(monkeypatch):
+    monkeypatch.setattr(invalidation, 'redis', None)
+    with pytest.raises(RuntimeError):
+        RedisBackend('redis://localhost')
+
+
+def test_bus_dispatches_by_kind(backend):
+    bus = InvalidationBus(backend)
+    seen = []
+    bus.on('song', seen.append)
+    bus.on('album', lambda value: 1 / 0)
+    position = backend.position()
+    bus.invalidate('song:1', 'album:2', 'song:1')
+    events, _ = backend.events(position, 0)
+    assert events == [['song:1', 'album:2', SEQUENCE_TAG]]
+    for tags in events:
+        bus.dispatch(tags)
+    assert seen == ['1']
+    assert bus.stats()['handler_errors'] == 1 and bus.stats()['published'] == 2
+
+
+class DictCache:
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.entries[key] = value
+
+
+@pytest.fixture
+def app(backend):
+    app = Flask(__name__)
+    app.bus = InvalidationBus(backend)
+    app.cache = DictCache()
+    app.calls = 0
+    app.during_view = None
+
+    @app.route('/songs/<int:song_id>')
+    @tagged_cache(app.cache, app.bus, lambda data: [f"song:{data['id']}"])
+    def song(song_id):
+        app.calls += 1
+        if app.during_view:
+            app.during_view()
+        if song_id == 404:
+            return jsonify({'error': 'missing'}), 404
+        return jsonify({'id': song_id, 'version': app.calls})
+
+    return app
+
+
+def test_tagged_cache_until_tag_changes(app):
+    client = app.test_client()
+    assert client.get('/songs/1').get_json() == {'id': 1, 'version': 1}
+    assert client.get('/songs/1').get_json() == {'id': 1, 'version': 1}
+    assert app.calls == 1
+    # 其他标签的失效不影响这份缓存
+    app.bus.invalidate('song:2')
+    assert client.get('/songs/1').get_json()['version'] == 1
+    app.bus.invalidate('song:1')
+    assert client.get('/songs/1').get_json()['version'] == 2
+    assert app.calls == 2
+
+
+def test_tagged_cache_skips_errors_and_racing_invalidations(app):
+    client = app.test_client()
+    client.get('/songs/404')
+    client.get('/songs/404')
+    assert app.calls == 2
+
+    # 生成响应期间有过失效，不知道响应是否已过时，不缓存
+    app.during_view = lambda: app.bus.invalidate('song:9')
+    client.get('/songs/1')
+    app.during_view = None
+    client.get('/songs/1')
+    client.get('/songs/1')
+    assert app.calls == 4
+    assert json.loads(app.cache.get('tagged:/songs/1?')[2]) == {'id': 1, 'version': 4}
@@ -0,0 +1,43 @@
+from lyrics import LyricsStore, merge_translation, parse_lrc, resolve_lyrics
+
+
+def test_parse_lrc_tags_fractions_and_offset():
+    text = '[ti:Song]\n[00:01.50]first\n[00:03.123][01:00]repeat\nplain line\n[offset:500]'
+    assert parse_lrc(text) == [(1000, 'first'), (2623, 'repeat'), (59500, 'repeat')]
+    assert parse_lrc(None) == []
+
+
+def test_merge_translation_within_tolerance():
+    lines = [(1000, 'hello'), (5000, 'world'), (9000, 'again')]
+    sub_lines = [(1100, '你好'), (5400, '世界'), (9000, '')]
+    assert merge_translation(lines, sub_lines) == [(1000, 'hello', '你好'), (5000, 'world', None),
+                                                   (9000, 'again', None)]
+
+
+def test_resolve_lyrics_prefers_lrc_file(tmp_path):
+    assert resolve_lyrics(1, 'stored', 'online', lrc_dir=str(tmp_path)) == 'stored'
+    assert resolve_lyrics(1, None, lambda: 'online', lrc_dir=str(tmp_path)) == 'online'
+    assert resolve_lyrics(1, lrc_dir=str(tmp_path)) is None
+    (tmp_path / '1.lrc').write_text('[00:01]edited', encoding='utf-8')
+
+    def stored():
+        raise AssertionError('有 lrc 文件时不应查询其他来源')
+
+    assert resolve_lyrics(1, stored, lrc_dir=str(tmp_path)) == '[00:01]edited'
+
+
+def test_lyrics_store_caches_and_invalidates():
+    calls = []
+
+    def loader(song_id):
+        calls.append(song_id)
+        return f'[00:0{len(calls)}]line', None
+
+    store = LyricsStore(loader, max_items=1)
+    first = store.get(1)
+    assert store.get(1) is first and first.lines() == [[1000, 'line', None]]
+    store.invalidate(1)
+    assert store.get(1).lines() == [[2000, 'line', None]]
+    store.get(2)
+    assert store.stats()['evictions'] == 1
+    assert store.get(1).index_at(3500) == -1 and calls == [1, 1, 2, 1]
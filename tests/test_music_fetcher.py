@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from music_fetcher import MusicFetcher
+
+DATA = bytes(range(256)) * 1024
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """按 server.behaviour 返回音频数据：'ok' 正常，'cut' 第一次只发一半后断开，'cut_always' 每次都断开且不支持 Range"""
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+        start = 0
+        cut = server.behaviour == 'cut_always' or (server.behaviour == 'cut' and len(server.requests) == 1)
+        range_header = self.headers.get('Range')
+        if range_header and server.behaviour != 'cut_always':
+            start = int(range_header[len('bytes='):].split('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+        else:
+            self.send_response(200)
+        body = DATA[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cut:
+            body = body[:len(body) // 2]
+        for i in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[i:i + 64 * 1024])
+            self.wfile.flush()
+            time.sleep(server.delay)
+        if cut:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    httpd.requests = []
+    httpd.behaviour = 'ok'
+    httpd.delay = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_fetcher(server):
+    url = f'http://127.0.0.1:{server.server_address[1]}/song.mp3'
+    return MusicFetcher(lambda song_id: url, session=requests.Session())
+
+
+def wait_done(download, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not download.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert download.done
+
+
+def test_concurrent_fetches_share_one_download(server, tmp_path):
+    server.delay = 0.01
+    fetcher = make_fetcher(server)
+    path = str(tmp_path / '1.mp3')
+    first = fetcher.fetch(1, path)
+    second = fetcher.fetch(1, path)
+    assert first is second
+    assert first.wait_started(5)
+    assert b''.join(second.iter_bytes()) == DATA
+    wait_done(first)
+    assert server.requests == [None]
+
+
+def test_download_is_renamed_when_complete(server, tmp_path):
+    fetcher = make_fetcher(server)
+    path = str(tmp_path / 'music' / '2.mp3')
+    download = fetcher.fetch(2, path)
+    wait_done(download)
+    assert download.error is None
+    assert not os.path.exists(path + '.part')
+    with open(path, 'rb') as f:
+        assert f.read() == DATA
+    # 下载结束后再次请求会重新开始
+    assert fetcher.fetch(2, path) is not download
+
+
+def test_interrupted_download_resumes_with_range(server, tmp_path):
+    server.behaviour = 'cut'
+    fetcher = make_fetcher(server)
+    path = str(tmp_path / '3.mp3')
+    download = fetcher.fetch(3, path)
+    wait_done(download)
+    assert download.error is None
+    assert server.requests == [None, f'bytes={len(DATA) // 2}-']
+    with open(path, 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_reader_sees_failure_instead_of_truncated_file(server, tmp_path):
+    server.behaviour = 'cut_always'
+    server.delay = 0.01
+    fetcher = make_fetcher(server)
+    path = str(tmp_path / '4.mp3')
+    download = fetcher.fetch(4, path)
+    assert download.wait_started(5)
+    received = bytearray()
+    with pytest.raises(IOError):
+        for chunk in download.iter_bytes():
+            received += chunk
+    assert download.error is not None
+    assert len(received) < len(DATA)
+    assert not os.path.exists(path)
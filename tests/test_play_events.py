@@ -0,0 +1,63 @@
+import pytest
+
+import play_events
+from play_events import PlayEventPipeline
+
+
+class FakeDb:
+    def __init__(self):
+        self.statements = []
+        self.fail = False
+
+    def get_connection(self):
+        if self.fail:
+            raise ConnectionError('database down')
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=()):
+        self.statements.append(' '.join(query.split()))
+
+    def executemany(self, query, rows):
+        self.statements.append(' '.join(query.split()))
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    monkeypatch.setattr(play_events, 'get_db_connection', lambda: fake)
+    return fake
+
+
+def test_tables_are_created_before_the_first_write(db, tmp_path):
+    db.fail = True
+    pipeline = PlayEventPipeline(str(tmp_path), flush_interval=3600)
+    pipeline.start()  # 启动时数据库不可用，建表留到第一次写库前重试
+    db.fail = False
+    pipeline.record(1, played_ms=60 * 1000)
+    assert pipeline.flush() == 1
+    creates = [i for i, s in enumerate(db.statements) if s.startswith('CREATE TABLE IF NOT EXISTS')]
+    writes = [i for i, s in enumerate(db.statements) if s.startswith(('INSERT', 'UPDATE'))]
+    assert len(creates) == 2 and max(creates) < min(writes)
+
+    db.statements.clear()
+    pipeline.record(1, played_ms=60 * 1000)
+    pipeline.flush()
+    assert not any(s.startswith('CREATE') for s in db.statements)
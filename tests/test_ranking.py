@@ -0,0 +1,82 @@
+import pytest
+
+import ranking
+from ranking import HotSnapshot, ensure_schema
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.db.queries.append(query)
+        if 'information_schema.COLUMNS' in query:
+            self.rows = [(int(self.db.has_column),)]
+        elif 'information_schema.STATISTICS' in query:
+            self.rows = [(column,) for column in self.db.index_columns]
+        else:
+            self.rows = []
+            if query.startswith('ALTER TABLE hot ADD COLUMN'):
+                self.db.has_column = True
+            elif 'UNIQUE (Generation, TargetID, Type)' in query:
+                self.db.index_columns = ['Generation', 'TargetID', 'Type']
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self, has_column, index_columns):
+        self.has_column = has_column
+        self.index_columns = index_columns
+        self.queries = []
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def old_db(monkeypatch):
+    fake = FakeDb(False, ['TargetID', 'Type'])
+    monkeypatch.setattr(ranking, 'get_db_connection', lambda: fake)
+    return fake
+
+
+def test_ensure_schema_upgrades_old_table_once(old_db):
+    assert ensure_schema() == 2
+    alters = [query for query in old_db.queries if query.startswith('ALTER')]
+    assert 'ADD COLUMN Generation' in alters[0]
+    assert 'DROP INDEX unique_target_type' in alters[1]
+    assert any('CREATE TABLE IF NOT EXISTS hot_generation' in query for query in old_db.queries)
+    assert any(query.startswith('INSERT IGNORE INTO hot_generation') for query in old_db.queries)
+
+    old_db.queries.clear()
+    assert ensure_schema() == 0
+    assert not any(query.startswith('ALTER') for query in old_db.queries)
+
+
+def test_snapshot_page_cursor():
+    snapshot = HotSnapshot(1, None, [(1, 10, 100, 'A', 'X'), (2, 11, 101, 'B', 'Y'), (3, 12, 102, 'C', 'Z')])
+    rows, cursor = snapshot.page(2)
+    assert [row[0] for row in rows] == [100, 101] and cursor == '2:11'
+    rows, cursor = snapshot.page(2, cursor)
+    assert [row[0] for row in rows] == [102] and cursor is None
@@ -0,0 +1,147 @@
+from datetime import datetime
+
+import pytest
+
+import recommender
+from recommender import (PLAYLIST_SONGS_QUERY, SONG_ARTISTS_QUERY, USER_PLAYS_QUERY, RecommendIndex, _State,
+                         build)
+
+# (PlaylistSongID, PlaylistID, SongID)
+PLAYLIST_ROWS = [(1, 1, 10), (2, 1, 11), (3, 1, 12), (4, 2, 10), (5, 2, 11), (6, 3, 12), (7, 3, 13)]
+# (UserID, SongID, Plays, LastPlayed)
+USER_PLAYS = [(5, 10, 3, datetime(2024, 1, 1)), (6, 11, 1, datetime(2024, 1, 1)), (6, 13, 2, datetime(2024, 1, 1))]
+SONG_ARTISTS = [(10, 100), (11, 100), (12, 101), (13, 102)]
+PUBLIC_PLAYLISTS = [(1, '通勤'), (2, '跑步')]  # 歌单 3 不公开
+
+
+def neighbors(state):
+    """按歌曲ID整理近邻，和列号的分配顺序无关"""
+    result = {}
+    for col, song_id in enumerate(state.songs):
+        result[song_id] = {state.songs[c]: round(float(s), 5)
+                           for c, s in zip(state.neighbor_cols[col], state.neighbor_scores[col]) if c >= 0}
+    return result
+
+
+def cooccurrence(state):
+    matrix = state.cooccurrence.tocoo()
+    return {(state.songs[r], state.songs[c]): round(float(v), 5)
+            for r, c, v in zip(matrix.row, matrix.col, matrix.data)}
+
+
+def test_incremental_apply_matches_one_shot_build():
+    later_plays = [(5, 10, 7, datetime(2024, 1, 2)), (5, 12, 1, datetime(2024, 1, 2))]  # 播放次数更新 + 新记录
+    incremental = _State()
+    incremental.update_neighbors(incremental.apply(PLAYLIST_ROWS[:4], USER_PLAYS[:2]))
+    incremental.update_neighbors(incremental.apply(PLAYLIST_ROWS[4:], USER_PLAYS[2:]))
+    incremental.update_neighbors(incremental.apply([], later_plays))
+
+    one_shot = _State()
+    one_shot.update_neighbors(one_shot.apply(PLAYLIST_ROWS, [USER_PLAYS[1], USER_PLAYS[2]] + later_plays))
+
+    assert cooccurrence(incremental) == cooccurrence(one_shot)
+    assert neighbors(incremental) == neighbors(one_shot)
+    assert incremental.playlist_song_id == 7 and incremental.playlist_rows == len(PLAYLIST_ROWS)
+    assert incremental.played_after == datetime(2024, 1, 2)
+
+
+def test_apply_without_changes():
+    state = _State()
+    assert len(state.apply([], [])) == 0
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        if query == PLAYLIST_SONGS_QUERY:
+            self.rows = [row for row in self.db.playlist_rows if row[0] > params[0]]
+        elif query == USER_PLAYS_QUERY:
+            self.rows = [row for row in self.db.user_plays if row[3] >= params[0]]
+        elif query == SONG_ARTISTS_QUERY:
+            self.rows = SONG_ARTISTS
+        elif query.startswith('SELECT COUNT(*) FROM playlist_songs'):
+            self.rows = [(len([row for row in self.db.playlist_rows if row[0] <= params[0]]),)]
+        elif 'FROM artists' in query:
+            self.rows = [(100, '歌手甲'), (101, '歌手乙'), (102, '歌手丙')]
+        elif 'FROM playlists' in query:
+            self.rows = PUBLIC_PLAYLISTS
+        else:
+            raise AssertionError(query)
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self, playlist_rows, user_plays):
+        self.playlist_rows = playlist_rows
+        self.user_plays = user_plays
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb(PLAYLIST_ROWS, USER_PLAYS)
+    monkeypatch.setattr(recommender, 'get_db_connection', lambda: fake)
+    return fake
+
+
+def test_recommend_index_lookups(db, tmp_path):
+    index = RecommendIndex(build(str(tmp_path)))
+
+    similar = index.similar_songs(10)
+    assert similar[0][0] == 11  # 总是一起出现在歌单里
+    assert 10 not in [song_id for song_id, _ in similar]
+    assert [score for _, score in similar] == sorted((score for _, score in similar), reverse=True)
+    assert len(index.similar_songs(10, limit=1)) == 1
+    assert index.similar_songs(999) == []
+
+    assert index.similar_artists(100)[0][0] == 101
+    assert index.artist_names[100] == '歌手甲'
+
+    # 只推荐公开歌单
+    assert {playlist_id for playlist_id, _ in index.song_playlists(12)} <= {1, 2}
+    assert index.playlist_names == dict(PUBLIC_PLAYLISTS)
+
+    # 每日推荐不包含已经听过的歌
+    songs = [song_id for song_id, _ in index.user_songs(6)]
+    assert songs and 11 not in songs and 13 not in songs
+    assert index.user_playlists(5)
+    assert index.user_songs(999) == []
+    assert index.stats()['songs'] == 4 and index.stats()['users'] == 2
+
+
+def test_incremental_build_matches_full_build(db, tmp_path):
+    db.playlist_rows, db.user_plays = PLAYLIST_ROWS[:4], USER_PLAYS[:1]
+    build(str(tmp_path / 'incremental'))
+    db.playlist_rows, db.user_plays = PLAYLIST_ROWS, USER_PLAYS
+    incremental = RecommendIndex(build(str(tmp_path / 'incremental')))
+    full = RecommendIndex(build(str(tmp_path / 'full'), full=True))
+
+    for song_id in (10, 11, 12, 13):
+        assert incremental.similar_songs(song_id) == full.similar_songs(song_id)
+        assert incremental.song_playlists(song_id) == full.song_playlists(song_id)
+    for artist_id in (100, 101, 102):
+        assert incremental.similar_artists(artist_id) == full.similar_artists(artist_id)
+    for user_id in (5, 6):
+        assert incremental.user_songs(user_id) == full.user_songs(user_id)
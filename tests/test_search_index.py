@@ -0,0 +1,133 @@
+from datetime import datetime
+
+import pytest
+
+import search_index
+from search_index import CatalogSearch, InvertedIndex, tokenize, tokenize_query
+
+
+def test_tokenize_latin_and_cjk():
+    assert tokenize('Hello, World!') == ['hello', 'world']
+    assert tokenize('晴天') == ['晴', '天', '晴天']
+    assert tokenize('Ｊａｙ周杰伦') == ['jay', '周', '杰', '伦', '周杰', '杰伦']
+
+
+def test_tokenize_query_prefix():
+    assert tokenize_query('hel') == (['hel'], True)
+    assert tokenize_query('hello ') == (['hello'], False)
+    assert tokenize_query('周杰伦') == (['周杰', '杰伦'], False)
+    assert tokenize_query('周') == (['周'], False)
+
+
+def test_bm25_ranks_weighted_fields_first():
+    index = InvertedIndex()
+    index.add(1, [('love story', 3.0), ('taylor swift', 2.0)])
+    index.add(2, [('story of my life', 3.0), ('one direction', 2.0)])
+    index.add(3, [('you belong with me', 3.0), ('love', 0.5)])
+    assert [doc for doc, _ in index.search('love')] == [1, 3]
+    assert [doc for doc, _ in index.search('story')][0] == 1
+    assert index.search('love direction') == []
+    assert [doc for doc, _ in index.search('dir')] == [2]
+
+
+def test_index_update_and_remove():
+    index = InvertedIndex()
+    index.add(1, [('old title', 1.0)])
+    index.add(1, [('new title', 1.0)])
+    assert index.search('old') == []
+    assert [doc for doc, _ in index.search('new')] == [1]
+    index.remove(1)
+    assert len(index) == 0 and index.search('title') == []
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        self.db.queries.append((query, params))
+        self.rows = [row for row in self.db.rows if not params or (row[-1] and row[-1] >= params[0])]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self):
+        self.rows = []
+        self.queries = []
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    monkeypatch.setattr(search_index, 'get_db_connection', lambda: fake)
+    return fake
+
+
+def song(song_id, title, artist_id, artist, time):
+    return (song_id, title, artist_id, artist, None, None, 200, None, None, None, time)
+
+
+def test_sync_incremental_and_full(db):
+    t1, t2 = datetime(2024, 1, 1), datetime(2024, 1, 2)
+    db.rows = [song(1, 'Alpha', 10, 'Band', t1), song(2, 'Beta', 11, 'Solo', None)]
+    search = CatalogSearch(full_sync_interval=3600)
+    assert search.sync() == 2
+    assert search.search('beta')['result']['songs'][0]['id'] == 2
+
+    db.rows.append(song(3, 'Gamma', 10, 'Band', t2))
+    search.sync()
+    assert 'COALESCE' in db.queries[-1][0] and db.queries[-1][1] == (t1,)
+    assert search.search('gamma') is not None
+
+    # 删除的歌曲在下一次全量同步时移除，只被它引用的歌手一并移除
+    db.rows = [row for row in db.rows if row[0] != 2]
+    search.full_sync_interval = 0
+    search.sync()
+    assert db.queries[-1][1] == ()
+    assert search.search('beta') is None
+    assert search.artists.search('solo') == []
+    assert search.artists.search('band') != []
+
+
+def test_reference_counts_follow_updates_and_removals():
+    search = CatalogSearch()
+    search.add_song(1, 'Alpha', 10, 'Band', 20, 'First')
+    search.add_song(2, 'Beta', 10, 'Band', 20, 'First')
+    search.add_song(2, 'Beta', 11, 'Solo', 21, 'Second')  # 改到另一个歌手和专辑
+    assert [doc for doc, _ in search.artists.search('band')] == [10]
+    search.remove_song(1)
+    assert search.artists.search('band') == [] and search.albums.search('first') == []
+    assert search.search('solo')['result']['artists'] == [{'id': 11, 'name': 'Solo'}]
+
+
+def test_search_skips_documents_removed_after_scoring(monkeypatch):
+    search = CatalogSearch()
+    search.add_song(1, 'Alpha', 10, 'Band')
+    search.add_song(2, 'Alpha Two', 11, 'Other')
+    hits = search.songs.search('alpha')
+    artist_hits = search.artists.search('band')
+    search.remove_song(1)
+    # 模拟打分完成后、取文档之前歌曲被同步线程移除
+    monkeypatch.setattr(search.songs, 'search', lambda keyword, limit: hits)
+    monkeypatch.setattr(search.artists, 'search', lambda keyword, limit: artist_hits)
+    result = search.search('alpha')
+    assert [song['id'] for song in result['result']['songs']] == [2]
+    assert result['result']['artists'] == []
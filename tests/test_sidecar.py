@@ -0,0 +1,33 @@
+import threading
+
+import sidecar
+from disk_cache import DiskCache
+from sidecar import SidecarBuilder
+
+
+def test_invalidate_deletes_stored_copy_and_drops_inflight_build(tmp_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    versions = iter(['old', 'new'])
+
+    def fake_build(song_id, source_path, lyrics, cover_path, fallback):
+        lrc = next(versions)
+        if lrc == 'old':
+            started.set()
+            release.wait(5)
+        return {'id': song_id, 'lrc': lrc}
+
+    monkeypatch.setattr(sidecar, 'build_sidecar', fake_build)
+    builder = SidecarBuilder(store=DiskCache(str(tmp_path), ttl=60), workers=1)
+    builder.store.set('1', {'id': 1, 'lrc': 'stale'})
+
+    # 生成旧副本的过程中歌曲被失效：磁盘上的副本被删除，旧结果不写入
+    futures = builder.submit([(1, 'a.mp3', None, None)])
+    assert started.wait(5)
+    builder.invalidate('1')
+    assert builder.store.get('1') is None
+    release.set()
+    builder.wait(futures)
+    assert builder.store.get('1') is None
+
+    builder.wait(builder.submit([(1, 'a.mp3', None, None)]))
+    assert builder.store.get('1')['lrc'] == 'new'
@@ -0,0 +1,22 @@
+import sys
+
+import transcode
+from transcode import Transcoder
+
+
+def test_needs_transcode_uses_recorded_format(tmp_path, monkeypatch):
+    probes = []
+    monkeypatch.setattr(transcode.mutagen, 'File', lambda path: probes.append(path))
+    source = tmp_path / 'song.mp3'
+    source.write_bytes(b'audio')
+    transcoder = Transcoder(str(tmp_path / 'renditions'), ffmpeg=sys.executable)
+
+    # 入库时记录了码率和编码格式，不再打开原文件
+    assert not transcoder.needs_transcode(str(source), 128, 128, 'mp3')
+    assert transcoder.needs_transcode(str(source), 128, 320, 'mp3')
+    assert transcoder.needs_transcode(str(source), 320, 128, 'flac')
+    assert probes == []
+
+    # 没有记录时才探测
+    assert transcoder.needs_transcode(str(source), 128)
+    assert probes == [str(source)]
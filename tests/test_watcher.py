@@ -0,0 +1,166 @@
+import os
+
+import pytest
+
+import watcher
+from manifest import Manifest
+from watcher import FETCHER_RETRIES, Inotify, LibraryWatcher
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, query, values):
+        if 'SongID IN' in query:
+            self.result = [(v, v) for v in values if v in self.db.song_ids]
+        else:
+            self.result = []
+
+    def executemany(self, query, rows):
+        self.db.links += rows
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeDb:
+    def __init__(self):
+        self.song_ids = set()
+        self.links = []
+
+    def get_connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+class FakeWriter:
+    def __init__(self, db, batch_size, **kwargs):
+        self.cursor = db.cursor()
+        self.added = []
+        self.insert_ids = {}
+        self.written = 0
+
+    def add(self, tags, defaults, song_id=None, insert_id=None):
+        self.added.append(tags['file_path'])
+        if insert_id is not None:
+            self.insert_ids[tags['file_path']] = insert_id
+
+    def flush(self):
+        self.written = len(self.added)
+        return {path: self.insert_ids.get(path, 100 + i) for i, path in enumerate(self.added)}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDb()
+    monkeypatch.setattr(watcher, 'get_db_connection', lambda: fake)
+    monkeypatch.setattr(watcher, 'BatchWriter', FakeWriter)
+    monkeypatch.setattr(watcher, 'safe_read_tags', lambda path: ({'file_path': path}, None))
+    return fake
+
+
+def test_fetched_file_without_song_row_is_retried(db, tmp_path):
+    folder = tmp_path / 'storage'
+    folder.mkdir()
+    path = str(folder / '42.mp3')
+    with open(path, 'wb') as f:
+        f.write(b'audio')
+    st = os.stat(path)
+    files = [(path, st.st_size, st.st_mtime_ns)]
+    library = LibraryWatcher(str(folder), manifest_path=str(tmp_path / 'manifest.sqlite3'), use_inotify=False)
+    manifest = Manifest(library.manifest_path)
+    try:
+        library._ingest(manifest, files)
+        assert path not in library.known
+        assert path in library.pending
+
+        # 歌曲信息写入数据库后再次处理时关联到这首歌
+        db.song_ids.add(42)
+        library.pending.clear()
+        library._ingest(manifest, files)
+        assert library.known[path] == (st.st_size, st.st_mtime_ns)
+        assert db.links == [(path, 42)]
+        assert manifest.entries(str(folder) + os.sep)[path][3] == 42
+    finally:
+        manifest.close()
+
+
+def test_regular_file_is_ingested(db, tmp_path):
+    folder = tmp_path / 'storage'
+    folder.mkdir()
+    path = str(folder / 'song.flac')
+    with open(path, 'wb') as f:
+        f.write(b'audio')
+    st = os.stat(path)
+    library = LibraryWatcher(str(folder), manifest_path=str(tmp_path / 'manifest.sqlite3'), use_inotify=False)
+    manifest = Manifest(library.manifest_path)
+    try:
+        library._ingest(manifest, [(path, st.st_size, st.st_mtime_ns)])
+        assert path in library.known
+        assert manifest.entries(str(folder) + os.sep)[path][3] == 100
+    finally:
+        manifest.close()
+
+
+def test_fetched_file_is_ingested_with_its_id_when_no_row_appears(db, tmp_path):
+    folder = tmp_path / 'storage'
+    folder.mkdir()
+    path = str(folder / '42.mp3')
+    with open(path, 'wb') as f:
+        f.write(b'audio')
+    st = os.stat(path)
+    files = [(path, st.st_size, st.st_mtime_ns)]
+    library = LibraryWatcher(str(folder), manifest_path=str(tmp_path / 'manifest.sqlite3'), use_inotify=False)
+    manifest = Manifest(library.manifest_path)
+    try:
+        for _ in range(FETCHER_RETRIES):
+            library._ingest(manifest, files)
+            assert path in library.pending and path not in library.known
+        # 重试次数用完后按文件名里的 SongID 入库，不再重复推迟
+        library.pending.clear()
+        library._ingest(manifest, files)
+        assert library.known[path] == (st.st_size, st.st_mtime_ns)
+        assert path not in library.pending and path not in library.deferrals
+        assert manifest.entries(str(folder) + os.sep)[path][3] == 42
+    finally:
+        manifest.close()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/sys/fs/inotify'), reason='需要 inotify')
+def test_inotify_skips_directory_removed_before_walk(tmp_path):
+    source = Inotify()
+    try:
+        source.add_tree(str(tmp_path))
+        gone = tmp_path / 'extracting'
+        gone.mkdir()
+        gone.rmdir()
+        kept = tmp_path / 'album'
+        kept.mkdir()
+        (kept / 'a.mp3').write_bytes(b'audio')
+        events = []
+        for _ in range(5):
+            events += source.read(0.2)
+        assert str(kept / 'a.mp3') in [path for path, _ in events]
+        # 直接对不存在的目录调用也不会抛出
+        source.add_tree(str(tmp_path / 'missing'))
+    finally:
+        source.close()
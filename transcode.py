@@ -0,0 +1,259 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import mutagen
+
+BITRATES = (64, 128, 192)  # 码率阶梯（kbps）
+FFMPEG = os.getenv('FFMPEG_PATH', 'ffmpeg')
+TRANSCODE_TIMEOUT = 300  # 单次转码最长时间（秒）
+WAIT_TIMEOUT = 20  # 请求线程等待转码完成的最长时间（秒）
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def pick_bitrate(bitrate):
+    """取不超过请求码率的最大阶梯，低于最低阶梯时取最低阶梯"""
+    candidates = [br for br in BITRATES if br <= bitrate]
+    return candidates[-1] if candidates else BITRATES[0]
+
+
+def source_signature(stat):
+    """原文件变化后生成新的版本文件名，旧版本由 LRU 淘汰"""
+    return f'{stat.st_mtime_ns:x}{stat.st_size:x}'[-12:]
+
+
+class RenditionStore:
+    """转码结果的磁盘存储：按歌曲ID分片，超出容量按最近访问淘汰"""
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None  # 文件名 -> 大小，按最近访问排序
+        self._bytes = 0
+
+    def path(self, name):
+        # 按歌曲ID末两位分片，文件名以 <歌曲ID>_<码率>_<原文件签名> 开头
+        return os.path.join(self.root, name.split('_', 1)[0][-2:].zfill(2), name)
+
+    def _ensure_index(self):
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                if shard.name.endswith('.tmp'):
+                    continue  # 正在进行的多文件编码的临时目录
+                for entry in os.scandir(shard.path):
+                    if not entry.name.endswith('.tmp'):
+                        st = entry.stat()
+                        entries.append((st.st_atime, entry.name, st.st_size))
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+        self._bytes = sum(size for _, _, size in entries)
+
+    def lookup(self, name):
+        """存在时返回文件路径并标记为最近使用"""
+        path = self.path(name)
+        with self._lock:
+            self._ensure_index()
+            if name in self._index:
+                if os.path.exists(path):
+                    self._index.move_to_end(name)
+                    return path
+                self._bytes -= self._index.pop(name)
+        return None
+
+    def add(self, name, size):
+        with self._lock:
+            self._ensure_index()
+            self._bytes += size - self._index.pop(name, 0)
+            self._index[name] = size
+            while self._bytes > self.max_bytes and len(self._index) > 1:
+                old_name, old_size = self._index.popitem(last=False)
+                self._bytes -= old_size
+                try:
+                    os.remove(self.path(old_name))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            self._ensure_index()
+            return {'files': len(self._index), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+class Transcoder:
+    """按需把歌曲转成 64/128/192 kbps 的 MP3：ffmpeg 子进程池，同一 (歌曲, 码率) 同时只转一次"""
+
+    def __init__(self, root, max_bytes=2 * 1024 * 1024 * 1024, workers=2, ffmpeg=FFMPEG):
+        self.store = RenditionStore(root, max_bytes)
+        self.ffmpeg = shutil.which(ffmpeg)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='transcode')
+        self._prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transcode-prewarm')
+        self._lock = threading.Lock()
+        self._pending = {}  # 文件名 -> Future
+        self._bitrates = {}  # (路径, 签名) -> 原文件码率
+        self._stats = {'hits': 0, 'transcodes': 0, 'failures': 0, 'passthrough': 0}
+
+    @property
+    def available(self):
+        return self.ffmpeg is not None
+
+    def source_bitrate(self, source_path, stat):
+        key = (source_path, source_signature(stat))
+        bitrate = self._bitrates.get(key)
+        if bitrate is None:
+            try:
+                audio = mutagen.File(source_path)
+                bitrate = (getattr(audio.info, 'bitrate', 0) or 0) // 1000 if audio else 0
+            except Exception:
+                bitrate = 0
+            self._bitrates[key] = bitrate
+        return bitrate
+
+    def needs_transcode(self, source_path, bitrate, source_bitrate=None, codec=None):
+        """原文件本身就是不高于目标码率的 MP3 时直接返回原文件；
+        source_bitrate（kbps）和 codec 为入库时记录的值，为空时才用 mutagen 探测原文件"""
+        if not self.available:
+            return False
+        if source_bitrate is None:
+            source_bitrate = self.source_bitrate(source_path, os.stat(source_path))
+        is_mp3 = codec == 'mp3' if codec else source_path.lower().endswith('.mp3')
+        if is_mp3 and 0 < source_bitrate <= bitrate:
+            self._stats['passthrough'] += 1
+            return False
+        return True
+
+    def rendition_name(self, song_id, source_path, bitrate):
+        return f'{song_id}_{bitrate}_{source_signature(os.stat(source_path))}.mp3'
+
+    def get(self, song_id, source_path, bitrate, timeout=WAIT_TIMEOUT):
+        """返回转码后的文件路径；超时返回 None（转码在后台继续），失败时抛出 TranscodeError"""
+        name = self.rendition_name(song_id, source_path, bitrate)
+        return self.produce(name, *self._mp3_args(source_path, bitrate), timeout=timeout)
+
+    def prewarm(self, items, bitrates=BITRATES):
+        """在单独的低优先级线程中预转码，items 为 [(歌曲ID, 原文件路径, 记录的码率, 记录的编码格式)]"""
+        for song_id, source_path, source_bitrate, codec in items:
+            for bitrate in bitrates:
+                if self.available and self.needs_transcode(source_path, bitrate, source_bitrate, codec):
+                    name = self.rendition_name(song_id, source_path, bitrate)
+                    self.produce(name, *self._mp3_args(source_path, bitrate), timeout=0, background=True)
+
+    @staticmethod
+    def _mp3_args(source_path, bitrate):
+        return (['-i', source_path],
+                ['-map', '0:a:0', '-map_metadata', '0', '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3'])
+
+    def produce(self, name, input_args, output_args, timeout=WAIT_TIMEOUT, background=False):
+        """用 ffmpeg 生成存储中名为 name 的文件，同名文件同时只生成一次；返回路径，超时返回 None"""
+        path = self.store.lookup(name)
+        if path:
+            self._stats['hits'] += 1
+            return path
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                executor = self._prewarm_executor if background else self._executor
+                future = executor.submit(self._run, name, input_args, output_args)
+                self._pending[name] = future
+        if timeout == 0:
+            return None
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            return None
+
+    def produce_many(self, job, name_for, wanted, input_args, output_args, timeout=WAIT_TIMEOUT):
+        """用一次 ffmpeg 编码生成多个文件（例如 HLS 分片和播放列表），同一 job 同时只运行一次。
+        output_args(临时目录) 返回输出参数，编码结束后临时目录中的每个文件按 name_for(文件名) 存入存储。
+        返回 wanted 的路径，超时返回 None；编码完成但没有生成 wanted 时抛出 LookupError"""
+        path = self.store.lookup(wanted)
+        if path:
+            self._stats['hits'] += 1
+            return path
+        with self._lock:
+            future = self._pending.get(job)
+            if future is None:
+                future = self._executor.submit(self._run_many, job, name_for, input_args, output_args)
+                self._pending[job] = future
+        if timeout == 0:
+            return None
+        try:
+            future.result(timeout)
+        except TimeoutError:
+            return None
+        path = self.store.lookup(wanted)
+        if path is None:
+            raise LookupError(f'编码结果中没有 {wanted}')
+        return path
+
+    def _ffmpeg(self, args, name):
+        command = [self.ffmpeg, '-nostdin', '-v', 'error', '-y'] + args
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    timeout=TRANSCODE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise TranscodeError(f'转码超时: {name}')
+        if result.returncode != 0:
+            raise TranscodeError(result.stderr.decode('utf-8', 'replace').strip()[-500:])
+
+    def _run(self, name, input_args, output_args):
+        path = self.store.path(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            os.close(fd)
+            try:
+                self._ffmpeg(input_args + output_args + [tmp_path], name)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.store.add(name, os.path.getsize(path))
+            self._stats['transcodes'] += 1
+            return path
+        except Exception:
+            self._stats['failures'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def _run_many(self, job, name_for, input_args, output_args):
+        try:
+            os.makedirs(self.store.root, exist_ok=True)
+            tmp_dir = tempfile.mkdtemp(dir=self.store.root, suffix='.tmp')
+            try:
+                self._ffmpeg(input_args + output_args(tmp_dir), job)
+                # 先存分片再存播放列表，播放列表可见时它引用的分片都已就位
+                for filename in sorted(os.listdir(tmp_dir), key=lambda f: f.endswith('.m3u8')):
+                    name = name_for(filename)
+                    path = self.store.path(name)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(os.path.join(tmp_dir, filename), path)
+                    self.store.add(name, os.path.getsize(path))
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._stats['transcodes'] += 1
+        except Exception:
+            self._stats['failures'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(job, None)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self._stats, pending=pending, available=self.available, **self.store.stats())
@@ -0,0 +1,46 @@
+import fcntl
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+
+def current_version(root):
+    """CURRENT 文件指向的版本目录，还没有构建过时返回 None"""
+    try:
+        with open(os.path.join(root, 'CURRENT'), 'r', encoding='utf-8') as f:
+            return os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def new_version(root):
+    path = os.path.join(root, f'v{time.time_ns()}')
+    os.makedirs(path)
+    return path
+
+
+def publish(root, path):
+    """原子地把 CURRENT 指向新版本，然后删掉更早的版本；保留上一个版本，正在读取它的进程不受影响"""
+    previous = current_version(root)
+    tmp_path = os.path.join(root, 'CURRENT.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(os.path.basename(path))
+    os.replace(tmp_path, os.path.join(root, 'CURRENT'))
+    for name in os.listdir(root):
+        old = os.path.join(root, name)
+        if name.startswith('v') and old not in (path, previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(root):
+    """多个进程共用目录时只让一个进程构建，拿不到锁时返回 False"""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'build.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
@@ -0,0 +1,333 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+
+from database import get_db_connection
+from ingest import (AUDIO_EXTENSIONS, MANIFEST_PATH, BatchWriter, Defaults, DimensionCache, ensure_schema,
+                    load_config, safe_read_tags, scan_files)
+from manifest import Manifest, partial_hash
+
+# inotify 事件掩码，见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+SETTLE_SECONDS = 2.0  # 文件大小和修改时间保持不变多久后才认为写入完成
+POLL_INTERVAL = 5.0  # 不支持 inotify 时的轮询间隔（秒）
+RETRY_DELAY = 30.0  # 入库失败，或在线获取的文件还没有对应歌曲时，多久后重试（秒）
+FETCHER_RETRIES = 3  # 在线获取的文件等待对应歌曲出现的次数，之后按文件名里的 SongID 直接入库
+FETCHER_FILE_RE = re.compile(r'^\d+\.mp3$')  # 在线获取时缓存的 <SongID>.mp3
+
+
+class Inotify:
+    """通过 ctypes 调用 inotify，递归监听目录"""
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify 仅支持 Linux')
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self._dirs = {}  # wd -> 目录
+
+    def add_tree(self, root):
+        for directory, _, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                code = ctypes.get_errno()
+                if code in (errno.ENOENT, errno.ENOTDIR):
+                    # 遍历到一半目录已被删除或移走（先解压再移动的工具很常见），跳过
+                    continue
+                raise OSError(code, f'无法监听目录 {directory}')
+            self._dirs[wd] = directory
+
+    def read(self, timeout):
+        """返回 [(路径, 掩码)]；队列溢出时路径为 None，调用方应重新扫描"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                # 新目录：加入监听，并把监听生效前已经写入的文件一并交给调用方
+                try:
+                    self.add_tree(path)
+                    events.extend((file_path, IN_MOVED_TO) for file_path, _, _ in scan_files(path))
+                except OSError as e:
+                    # 目录在处理前已经消失；移到别处时目标目录会产生自己的事件
+                    print(f'[watch] 跳过目录 {path}:', e)
+            else:
+                events.append((path, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryWatcher:
+    """常驻监听曲库目录：新文件写入完成后解析标签并批量入库，和 --sync 共用文件清单"""
+
+    def __init__(self, folder_path, config_path=None, batch_size=100, settle=SETTLE_SECONDS,
+                 poll_interval=POLL_INTERVAL, manifest_path=MANIFEST_PATH, on_ingested=None, use_inotify=True,
+                 sidecars=None, invalidations=None):
+        self.folder_path = os.path.abspath(folder_path)
+        self.defaults = Defaults(load_config(config_path))
+        self.batch_size = batch_size
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.manifest_path = manifest_path
+        self.use_inotify = use_inotify
+        self.sidecars = sidecars  # SidecarBuilder，入库后在后台生成元数据副本
+        self.invalidations = invalidations  # InvalidationBus，入库后通知各进程清理缓存
+        self.on_ingested = on_ingested  # on_ingested(入库数量)，例如触发搜索索引增量同步
+        self.dimensions = DimensionCache()  # 多批之间共享
+        self.pending = {}  # 路径 -> [最后一次事件时间, (大小, 修改时间)]
+        self.known = {}  # 路径 -> (大小, 修改时间)，与清单一致
+        self.deferrals = {}  # 在线获取的文件路径 -> 已推迟的次数
+        self.mode = None
+        self._stop = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='library-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        os.makedirs(self.folder_path, exist_ok=True)
+        manifest = Manifest(self.manifest_path)
+        source = None
+        self.mode = 'poll'
+        if self.use_inotify:
+            try:
+                source = Inotify()
+                source.add_tree(self.folder_path)
+                self.mode = 'inotify'
+            except OSError as e:
+                print('inotify 不可用，改为轮询:', e)
+                if source:
+                    source.close()
+                    source = None
+        print(f'[watch] 正在监听 {self.folder_path}（{self.mode}）')
+
+        try:
+            self.known = {path: entry[:2] for path, entry in
+                          manifest.entries(os.path.join(self.folder_path, '')).items() if not entry[4]}
+            self._rescan()  # 补上未运行期间新增的文件
+            last_poll = time.monotonic()
+            while not self._stop.is_set():
+                if source:
+                    for path, mask in source.read(self.settle / 2):
+                        if path is None:
+                            print('[watch] inotify 队列溢出，重新扫描')
+                            self._rescan()
+                        else:
+                            self._touch(path, mask)
+                else:
+                    self._stop.wait(min(self.settle, self.poll_interval))
+                    if time.monotonic() - last_poll >= self.poll_interval:
+                        self._rescan()
+                        last_poll = time.monotonic()
+
+                ready = self._collect_ready()
+                for i in range(0, len(ready), self.batch_size):
+                    self._ingest(manifest, ready[i:i + self.batch_size])
+        finally:
+            if source:
+                source.close()
+            manifest.close()
+
+    def _touch(self, path, mask):
+        if not path.lower().endswith(AUDIO_EXTENSIONS):
+            return
+        entry = self.pending.setdefault(path, [0.0, None])
+        entry[0] = time.monotonic()
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            # 写入方已经关闭文件，只需再确认一次 stat 不变
+            entry[1] = self._stat(path)
+
+    def _rescan(self):
+        for path, size, mtime_ns in scan_files(self.folder_path):
+            if self.known.get(path) != (size, mtime_ns) and path not in self.pending:
+                self.pending[path] = [time.monotonic(), (size, mtime_ns)]
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def _collect_ready(self):
+        """去抖：距最后一次事件超过 settle 且前后两次 stat 一致的文件才算写入完成"""
+        now = time.monotonic()
+        ready = []
+        for path, entry in list(self.pending.items()):
+            if now - entry[0] < self.settle:
+                continue
+            current = self._stat(path)
+            if current is None:
+                del self.pending[path]
+                self.deferrals.pop(path, None)
+            elif current != entry[1]:
+                entry[0], entry[1] = now, current
+            else:
+                del self.pending[path]
+                ready.append((path,) + current)
+        return ready
+
+    def _ingest(self, manifest, files):
+        start = time.monotonic()
+        try:
+            with get_db_connection().get_connection() as db:
+                writer = BatchWriter(db, len(files), track_ids=True, dimensions=self.dimensions,
+                                     sidecars=self.sidecars, invalidations=self.invalidations)
+                try:
+                    items, registered, deferred, insert_ids = self._classify(manifest, writer.cursor, files)
+                    parsed = {}
+                    for path, size, mtime_ns, file_hash, song_id in items:
+                        tags, error = safe_read_tags(path)
+                        if error:
+                            print('解析失败:', error)
+                            continue
+                        writer.add(tags, self.defaults.for_file(path), song_id, insert_ids.get(path))
+                        parsed[path] = (size, mtime_ns, file_hash, song_id)
+                    inserted = writer.flush()
+                    db.commit()
+                finally:
+                    writer.close()
+        except Exception as e:
+            # 数据库不可用等情况：稍后重试这一批
+            print('[watch] 入库失败，稍后重试:', e)
+            for path, size, mtime_ns in files:
+                self.pending[path] = [time.monotonic() + RETRY_DELAY, (size, mtime_ns)]
+            return
+
+        # 数据库提交成功后再更新清单
+        for path, (size, mtime_ns, file_hash, song_id) in parsed.items():
+            registered.append((path, size, mtime_ns, file_hash, song_id or inserted.get(path)))
+        for entry in registered:
+            manifest.upsert(*entry)
+        manifest.commit()
+        for path, size, mtime_ns in files:
+            if path in deferred:
+                # 不记入 known，稍后再检查是否已有对应的歌曲
+                self.deferrals[path] = self.deferrals.get(path, 0) + 1
+                self.pending[path] = [time.monotonic() + RETRY_DELAY, (size, mtime_ns)]
+            else:
+                self.deferrals.pop(path, None)
+                self.known[path] = (size, mtime_ns)
+        if writer.written:
+            print(f'[watch] 入库 {writer.written} 首歌曲，用时 {time.monotonic() - start:.1f}s')
+            if self.on_ingested:
+                try:
+                    self.on_ingested(writer.written)
+                except Exception as e:
+                    print('[watch] 入库回调失败:', e)
+
+    def _classify(self, manifest, cursor, files):
+        """返回 (需要解析入库的文件, 只需登记到清单的文件, 稍后重试的路径, {路径: 插入时使用的 SongID})，
+        前两者的元素均为 (路径, 大小, 修改时间, 指纹, SongID)"""
+        entries = manifest.entries(os.path.join(self.folder_path, ''))
+        db_paths = self._existing(cursor, "SELECT FilePath, SongID FROM songs WHERE FilePath IN ({})",
+                                  [path for path, _, _ in files])
+        fetched = {path: int(os.path.basename(path)[:-4]) for path, _, _ in files
+                   if os.path.dirname(path) == self.folder_path and FETCHER_FILE_RE.match(os.path.basename(path))}
+        fetched_ids = self._existing(cursor, "SELECT SongID, SongID FROM songs WHERE SongID IN ({})",
+                                     list(set(fetched.values())))
+        links = []
+
+        items, registered, deferred, insert_ids = [], [], set(), {}
+        for path, size, mtime_ns in files:
+            file_hash = partial_hash(path, size)
+            entry = entries.get(path)
+            if entry and entry[2] == file_hash:
+                registered.append((path, size, mtime_ns, file_hash, entry[3]))
+            elif entry and entry[3]:
+                items.append((path, size, mtime_ns, file_hash, entry[3]))
+            elif path in db_paths:
+                registered.append((path, size, mtime_ns, file_hash, db_paths[path]))
+            elif path in fetched:
+                # 在线获取的 <SongID>.mp3：已有这首歌时只关联文件，不重复插入
+                song_id = fetched_ids.get(fetched[path])
+                if song_id:
+                    links.append((path, song_id))
+                    registered.append((path, size, mtime_ns, file_hash, song_id))
+                elif self.deferrals.get(path, 0) < FETCHER_RETRIES:
+                    # 在线获取时不会写入数据库，但其他写入方可能正在插入这首歌；稍等几轮避免插入重复的行
+                    deferred.add(path)
+                else:
+                    # 一直没有对应的歌曲：按文件名里的 SongID 入库，保持与上游歌曲ID一致
+                    items.append((path, size, mtime_ns, file_hash, None))
+                    insert_ids[path] = fetched[path]
+            else:
+                items.append((path, size, mtime_ns, file_hash, None))
+        if links:
+            cursor.executemany("UPDATE songs SET FilePath = %s WHERE SongID = %s AND FilePath IS NULL", links)
+        return items, registered, deferred, insert_ids
+
+    @staticmethod
+    def _existing(cursor, query, values):
+        if not values:
+            return {}
+        cursor.execute(query.format(','.join(['%s'] * len(values))), values)
+        return dict(cursor.fetchall())
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="监听曲库目录，新文件写入完成后自动入库")
+    parser.add_argument('folder', nargs='?', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage'))
+    parser.add_argument('--config', help="默认配置 JSON，例如 {\"cover\": \"...\", \"language\": \"国语\"}")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS, help="文件静止多少秒后入库")
+    parser.add_argument('--poll', action='store_true', help="强制使用轮询而不是 inotify")
+    args = parser.parse_args()
+
+    ensure_schema()  # 旧库先补齐 songs 表缺少的列和索引
+    watcher = LibraryWatcher(args.folder, config_path=args.config, settle=args.settle, use_inotify=not args.poll)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()